@@ -0,0 +1,271 @@
+"""端到端备份基准测试
+
+在本地 SFTP 服务器上对合成的源目录执行真实的 execute_backup，输出每个场景的
+文件/秒、MB/秒、SFTP 请求数（网络往返）和峰值内存，结果为 JSON，可在不同提交之间对比
+
+场景:
+    tiny         大量小文件
+    huge         少量大文件
+    deep         深层嵌套目录
+    incremental  小文件目录首次全量上传后，只修改少量文件再运行一次
+
+用法: python -m benchmarks.bench_backup [--scenario tiny --scenario huge ...] [--scale 1.0]
+          [--latency-ms 0] [--bandwidth 10MB] [--task '{"upload_workers": 4}'] [--output result.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import logging
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from benchmarks.sftp_server import LocalSFTPServer
+from src.backup_manager import BackupManager
+from src.connection_pool import get_connection_pool
+from src.throttle import parse_rate
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCENARIOS = ('tiny', 'huge', 'deep', 'incremental')
+
+# incremental 场景第二次运行前修改的文件比例
+INCREMENTAL_CHANGE_RATIO = 0.01
+
+
+def _write(path: str, size: int, rng: random.Random):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            step = min(remaining, 1024 * 1024)
+            f.write(rng.randbytes(step))
+            remaining -= step
+
+
+def make_tiny_tree(root: str, scale: float, rng: random.Random) -> list:
+    """每个目录 100 个 1KB 左右的文件"""
+    files = []
+    total = max(int(5000 * scale), 1)
+    for i in range(total):
+        directory = os.path.join(root, f"dir{i // 100:04d}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"file{i:06d}.dat")
+        _write(path, rng.randint(512, 2048), rng)
+        files.append(path)
+    return files
+
+
+def make_huge_tree(root: str, scale: float, rng: random.Random) -> list:
+    """3 个 64MB 的文件"""
+    os.makedirs(root, exist_ok=True)
+    size = max(int(64 * 1024 * 1024 * scale), 1024)
+    files = []
+    for i in range(3):
+        path = os.path.join(root, f"huge{i}.bin")
+        _write(path, size, rng)
+        files.append(path)
+    return files
+
+
+def make_deep_tree(root: str, scale: float, rng: random.Random) -> list:
+    """4 条 50 层深的目录链，每层 5 个小文件"""
+    files = []
+    depth = max(int(50 * scale), 1)
+    for branch in range(4):
+        directory = os.path.join(root, f"branch{branch}")
+        for level in range(depth):
+            directory = os.path.join(directory, f"level{level:03d}")
+            os.makedirs(directory, exist_ok=True)
+            for j in range(5):
+                path = os.path.join(directory, f"file{j}.dat")
+                _write(path, rng.randint(256, 4096), rng)
+                files.append(path)
+    return files
+
+
+BUILDERS = {
+    'tiny': make_tiny_tree,
+    'huge': make_huge_tree,
+    'deep': make_deep_tree,
+    'incremental': make_tiny_tree,
+}
+
+
+class PeakRSS:
+    """运行期间的峰值常驻内存
+
+    安装了 psutil 时后台采样本次测量区间的峰值；否则使用 getrusage 给出的进程启动以来的峰值
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if psutil is not None:
+            process = psutil.Process()
+            self.peak = process.memory_info().rss
+
+            def sample():
+                while not self._stop.wait(self.interval):
+                    self.peak = max(self.peak, process.memory_info().rss)
+
+            self._thread = threading.Thread(target=sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, psutil.Process().memory_info().rss)
+        elif resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux 以 KB 为单位，macOS 以字节为单位
+            self.peak = peak if sys.platform == 'darwin' else peak * 1024
+        return False
+
+    @property
+    def source(self) -> str:
+        if psutil is not None:
+            return 'psutil-sampled'
+        return 'getrusage-process' if resource is not None else 'unavailable'
+
+
+def measure_run(manager: BackupManager, server: LocalSFTPServer, scenario: str, label: str) -> dict:
+    """执行一次备份并汇总本次运行的指标"""
+    server.counter.reset()
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        ok = manager.execute_backup('bench')
+        elapsed = time.perf_counter() - start
+    stats = manager.backup_stats
+    counts = server.counter.snapshot()
+    return {
+        'scenario': scenario,
+        'run': label,
+        'success': ok,
+        'files': stats['total_files'],
+        'files_uploaded': stats['success_files'],
+        'files_skipped': stats['skipped_files'],
+        'bytes_total': stats['total_size'],
+        'bytes_sent': stats['transferred_size'],
+        'seconds': round(elapsed, 3),
+        'files_per_sec': round(stats['total_files'] / max(elapsed, 1e-9), 1),
+        'mb_per_sec': round(stats['transferred_size'] / max(elapsed, 1e-9) / (1024 * 1024), 2),
+        'round_trips': counts['total'],
+        'by_type': counts['by_type'],
+        'peak_rss_mb': round(rss.peak / (1024 * 1024), 1) if rss.peak else None,
+        'rss_source': rss.source,
+    }
+
+
+def run_scenario(server: LocalSFTPServer, work_dir: str, scenario: str, args) -> list:
+    """生成场景的源目录并执行备份，incremental 场景修改少量文件后再运行一次"""
+    rng = random.Random(args.seed)
+    source = os.path.join(work_dir, scenario, 'source')
+    target = os.path.join(work_dir, scenario, 'remote')
+    files = BUILDERS[scenario](source, args.scale, rng)
+
+    task = {'source_path': source, 'target_server': 'bench', 'target_path': target}
+    task.update(args.task)
+    manager = BackupManager({'bench': server.server_config()}, {'bench': task})
+    results = [measure_run(manager, server, scenario, 'full')]
+
+    if scenario == 'incremental':
+        changed = rng.sample(files, max(int(len(files) * INCREMENTAL_CHANGE_RATIO), 1))
+        for path in changed:
+            _write(path, rng.randint(512, 2048), rng)
+            # 保证修改时间与上次上传时不同
+            stat = os.stat(path)
+            os.utime(path, (stat.st_atime, stat.st_mtime + 2))
+        results.append(measure_run(manager, server, scenario, 'incremental'))
+
+    # 释放连接，下一个场景重新建立，避免场景之间互相影响
+    get_connection_pool().close_all()
+    shutil.rmtree(os.path.join(work_dir, scenario), ignore_errors=True)
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=parent_dir,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='要运行的场景，可重复指定，默认全部')
+    parser.add_argument('--scale', type=float, default=1.0, help='按比例缩放文件数量和大小')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='注入的单向延迟（毫秒）')
+    parser.add_argument('--bandwidth', help='每个方向的带宽上限，如 10MB')
+    parser.add_argument('--task', type=json.loads, default={},
+                        help='附加的任务配置（JSON），如 \'{"upload_workers": 4, "bulk_transfer": true}\'')
+    parser.add_argument('--seed', type=int, default=1, help='生成文件内容的随机种子')
+    parser.add_argument('--output', help='结果同时写入该文件')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # 场景之间关闭连接时服务端会记录连接重置，与测量无关
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    scenarios = args.scenario or list(SCENARIOS)
+    work_dir = tempfile.mkdtemp(prefix='bench_backup_')
+    cwd = os.getcwd()
+    server = LocalSFTPServer(latency=args.latency_ms / 1000, bandwidth=parse_rate(args.bandwidth))
+    server.start()
+    try:
+        # 历史记录等文件写入临时目录，不污染项目 logs
+        os.chdir(work_dir)
+        results = []
+        for scenario in scenarios:
+            results.extend(run_scenario(server, work_dir, scenario, args))
+        report = {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {
+                'scale': args.scale,
+                'latency_ms': args.latency_ms,
+                'bandwidth': args.bandwidth,
+                'task': args.task,
+                'seed': args.seed,
+            },
+            'results': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        print(output)
+        if args.output:
+            with open(os.path.join(cwd, args.output), 'w', encoding='utf-8') as f:
+                f.write(output)
+    finally:
+        os.chdir(cwd)
+        get_connection_pool().close_all()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
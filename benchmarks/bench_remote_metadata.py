@@ -0,0 +1,87 @@
+"""远程元数据往返次数基准测试
+
+对比逐文件 stat 与按目录 listdir_attr 两种方式在增量运行（文件均未变化）时
+产生的 SFTP 请求数
+
+用法: python -m benchmarks.bench_remote_metadata [--dirs 20] [--files 50]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from benchmarks.sftp_server import LocalSFTPServer
+from src.backup_manager import BackupManager
+from src.connection_pool import get_connection_pool
+
+
+def make_tree(root: str, dirs: int, files: int):
+    """生成 dirs 个目录、每个目录 files 个小文件的源目录"""
+    for i in range(dirs):
+        path = os.path.join(root, f"dir{i:04d}")
+        os.makedirs(path)
+        for j in range(files):
+            with open(os.path.join(path, f"file{j:04d}.dat"), 'wb') as f:
+                f.write(os.urandom(256))
+
+
+def run_case(server: LocalSFTPServer, source: str, target: str, remote_listing: bool) -> dict:
+    """首次全量上传后，测量一次无变化增量运行的请求数"""
+    task = {'source_path': source, 'target_server': 'bench', 'target_path': target,
+            'remote_listing': remote_listing}
+    manager = BackupManager({'bench': server.server_config()}, {'bench': task})
+    manager.execute_backup('bench')
+
+    server.counter.reset()
+    start = time.time()
+    manager.execute_backup('bench')
+    elapsed = time.time() - start
+    counts = server.counter.snapshot()
+    return {
+        'mode': 'listdir_attr' if remote_listing else 'per-file stat',
+        'files': manager.backup_stats['total_files'],
+        'round_trips': counts['total'],
+        'by_type': counts['by_type'],
+        'seconds': round(elapsed, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dirs', type=int, default=20)
+    parser.add_argument('--files', type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    work_dir = tempfile.mkdtemp(prefix='bench_metadata_')
+    cwd = os.getcwd()
+    server = LocalSFTPServer()
+    server.start()
+    try:
+        # 历史记录等文件写入临时目录，不污染项目 logs
+        os.chdir(work_dir)
+        source = os.path.join(work_dir, 'source')
+        make_tree(source, args.dirs, args.files)
+        results = [
+            run_case(server, source, os.path.join(work_dir, 'remote_stat'), False),
+            run_case(server, source, os.path.join(work_dir, 'remote_listing'), True),
+        ]
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    finally:
+        os.chdir(cwd)
+        get_connection_pool().close_all()
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
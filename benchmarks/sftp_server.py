@@ -0,0 +1,367 @@
+"""本地回环 SFTP 测试服务器
+
+基于 paramiko 在 127.0.0.1 上启动一个 SFTP 服务，把远程路径直接映射到本地文件系统，
+并统计收到的 SFTP 请求数（即网络往返次数），供性能基准测试使用；
+支持 exec 通道（远程 tar 解包、增量传输辅助脚本在本机执行），
+可在服务器前加一层链路模拟，注入单向延迟并限制带宽
+"""
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+import logging
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface, SFTP_OK
+
+from src.throttle import TokenBucket
+
+
+class RequestCounter:
+    """线程安全的请求计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.by_type = {}
+
+    def add(self, kind: str):
+        with self._lock:
+            self.total += 1
+            self.by_type[kind] = self.by_type.get(kind, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.total = 0
+            self.by_type = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'total': self.total, 'by_type': dict(self.by_type)}
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def read(self, offset, length):
+        self.counter.add('read')
+        return super().read(offset, length)
+
+    def write(self, offset, data):
+        self.counter.add('write')
+        return super().write(offset, data)
+
+    def chattr(self, attr):
+        try:
+            SFTPServer.set_file_attr(self.filename, attr)
+            return SFTP_OK
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+def _make_interface(counter: RequestCounter):
+    """生成绑定计数器的 SFTPServerInterface 实现"""
+
+    class _Interface(SFTPServerInterface):
+        def list_folder(self, path):
+            counter.add('listdir')
+            try:
+                result = []
+                for name in os.listdir(path):
+                    attr = SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                    attr.filename = name
+                    result.append(attr)
+                return result
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+
+        def stat(self, path):
+            counter.add('stat')
+            try:
+                return SFTPAttributes.from_stat(os.stat(path))
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            counter.add('open')
+            try:
+                fd = os.open(path, flags, 0o666)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            if flags & os.O_WRONLY:
+                mode = 'ab' if flags & os.O_APPEND else 'wb'
+            elif flags & os.O_RDWR:
+                mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+            else:
+                mode = 'rb'
+            handle = _Handle(flags)
+            handle.counter = counter
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def remove(self, path):
+            counter.add('remove')
+            try:
+                os.remove(path)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
+
+        def rename(self, oldpath, newpath):
+            counter.add('rename')
+            if os.path.exists(newpath):
+                return SFTPServer.convert_errno(17)
+            try:
+                os.rename(oldpath, newpath)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
+
+        def posix_rename(self, oldpath, newpath):
+            counter.add('rename')
+            try:
+                os.replace(oldpath, newpath)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
+
+        def mkdir(self, path, attr):
+            counter.add('mkdir')
+            try:
+                os.mkdir(path)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
+
+        def rmdir(self, path):
+            counter.add('rmdir')
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
+
+        def chattr(self, path, attr):
+            counter.add('setstat')
+            try:
+                SFTPServer.set_file_attr(path, attr)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
+
+        def canonicalize(self, path):
+            counter.add('realpath')
+            return os.path.abspath(path)
+
+    return _Interface
+
+
+class _ServerAuth(paramiko.ServerInterface):
+    """接受任意用户名密码的测试认证，exec 请求在本机用 shell 执行"""
+
+    def __init__(self, counter: RequestCounter):
+        self.counter = counter
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        self.counter.add('exec')
+        threading.Thread(target=_run_command, args=(channel, command), daemon=True).start()
+        return True
+
+
+def _run_command(channel, command):
+    """执行命令，通道数据作为标准输入，输出和退出码发回通道"""
+    process = subprocess.Popen(command if isinstance(command, str) else command.decode('utf-8'),
+                               shell=True, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed_stdin():
+        try:
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                process.stdin.write(data)
+        except (OSError, EOFError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def pump_stderr():
+        for data in iter(lambda: process.stderr.read(65536), b''):
+            channel.sendall_stderr(data)
+
+    threads = [threading.Thread(target=feed_stdin, daemon=True),
+               threading.Thread(target=pump_stderr, daemon=True)]
+    for thread in threads:
+        thread.start()
+    try:
+        for data in iter(lambda: process.stdout.read(65536), b''):
+            channel.sendall(data)
+        threads[1].join()
+        channel.send_exit_status(process.wait())
+    finally:
+        channel.close()
+
+
+class _LinkEmulator:
+    """在客户端和服务器之间转发 TCP 数据，模拟有延迟和带宽上限的链路
+
+    每个方向上收到的数据延迟 latency 秒后才发出，数据在途期间不阻塞后续读取（与真实链路一样可以流水线）；
+    bandwidth 为每个方向所有连接共享的字节/秒上限
+    """
+
+    def __init__(self, host: str, target_port: int, latency: float, bandwidth: float = None):
+        self.host = host
+        self.target_port = target_port
+        self.latency = latency
+        # 每个方向一个令牌桶，突发量取约 10ms 的数据量，使发送尽量平滑
+        self._buckets = {}
+        if bandwidth:
+            burst = max(bandwidth / 100, 65536)
+            self._buckets = {'up': TokenBucket(bandwidth, burst),
+                             'down': TokenBucket(bandwidth, burst)}
+        self._sock = None
+        self._stop = threading.Event()
+        self.port = None
+
+    def start(self) -> int:
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, 0))
+        self._sock.listen(50)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self.port
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                break
+            upstream = socket.create_connection((self.host, self.target_port))
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._forward(client, upstream, self._buckets.get('up'))
+            self._forward(upstream, client, self._buckets.get('down'))
+
+    def _forward(self, source, target, bucket):
+        in_flight = queue.Queue()
+
+        def receive():
+            try:
+                while True:
+                    data = source.recv(65536)
+                    if not data:
+                        break
+                    in_flight.put((time.monotonic() + self.latency, data))
+            except OSError:
+                pass
+            in_flight.put((None, None))
+
+        def deliver():
+            try:
+                while True:
+                    due, data = in_flight.get()
+                    if data is None:
+                        target.shutdown(socket.SHUT_WR)
+                        break
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    if bucket is not None:
+                        bucket.consume(len(data))
+                    target.sendall(data)
+            except OSError:
+                for sock in (source, target):
+                    sock.close()
+
+        threading.Thread(target=receive, daemon=True).start()
+        threading.Thread(target=deliver, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sock:
+            self._sock.close()
+
+
+class LocalSFTPServer:
+    """在回环地址上运行的 SFTP 服务器
+
+    latency 为注入的单向延迟（秒，往返时间为其两倍），bandwidth 为每个方向的带宽上限（字节/秒），
+    设置任一项时客户端经过链路模拟连接服务器
+    """
+
+    def __init__(self, host: str = '127.0.0.1', latency: float = 0.0, bandwidth: float = None):
+        self.host = host
+        self.port = None
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._link = None
+        self.counter = RequestCounter()
+        self.logger = logging.getLogger(__name__)
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._sock = None
+        self._transports = []
+        self._stop = threading.Event()
+
+    def start(self) -> int:
+        """启动服务器，返回监听端口"""
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, 0))
+        self._sock.listen(50)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        if self.latency or self.bandwidth:
+            self._link = _LinkEmulator(self.host, self.port, self.latency, self.bandwidth)
+            self.port = self._link.start()
+        return self.port
+
+    def _accept_loop(self):
+        interface = _make_interface(self.counter)
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, interface)
+            transport.start_server(server=_ServerAuth(self.counter))
+            self._transports.append(transport)
+
+    def server_config(self) -> dict:
+        """返回可直接写入 servers 配置的连接信息"""
+        return {'host': self.host, 'port': self.port,
+                'username': 'bench', 'password': 'bench'}
+
+    def stop(self):
+        self._stop.set()
+        if self._link:
+            self._link.stop()
+        if self._sock:
+            self._sock.close()
+        for transport in self._transports:
+            transport.close()
@@ -27,8 +27,8 @@ pyinstaller --noconfirm ^
             --hidden-import yaml ^
             --hidden-import flask ^
             --hidden-import paramiko ^
-            --hidden-import schedule ^
             --hidden-import psutil ^
+            --hidden-import watchdog.observers.read_directory_changes ^
             main.py
 
 :: 复制文件到发布目录
@@ -4,6 +4,8 @@ import sys
 from src.logger import setup_logger
 from src.scheduler import BackupScheduler
 from src.web_app import create_app
+from src.history import configure_history
+from src.config_store import get_config_store
 
 def get_resource_path(relative_path):
     """获取资源文件的绝对路径"""
@@ -21,8 +23,7 @@ def load_config():
         config_path = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), 'config', 'config.yaml')
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"Config file not found: {config_path}")
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+        return get_config_store(config_path).get()
     except FileNotFoundError as fnf_e:
         print(f"Error loading config: {str(fnf_e)}")
         raise
@@ -30,6 +31,23 @@ def load_config():
         print(f"Error loading config: {str(e)}")
         raise
 
+def calibrate(config, server_name, remote_dir='.'):
+    """校准模式：python main.py calibrate <服务器名> [远程目录]"""
+    from src.calibrate import calibrate_server, save_calibration
+    
+    if server_name not in config['servers']:
+        print(f"Server not found: {server_name}")
+        return 1
+    transfer = calibrate_server(config['servers'][server_name], remote_dir)
+    if transfer is None:
+        print("Calibration failed")
+        return 1
+    print(yaml.dump({'transfer': transfer}, allow_unicode=True))
+    config_path = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), 'config', 'config.yaml')
+    save_calibration(config_path, server_name, transfer)
+    print(f"Saved to {config_path}")
+    return 0
+
 def main():
     # 设置工作目录为exe所在目录
     if getattr(sys, 'frozen', False):
@@ -40,6 +58,11 @@ def main():
     
     # 设置日志
     logger = setup_logger(config['logging'])
+    configure_history(config.get('history'))
+    
+    if len(sys.argv) >= 3 and sys.argv[1] == 'calibrate':
+        sys.exit(calibrate(config, *sys.argv[2:4]))
+    
     logger.info("Starting backup system")
     
     try:
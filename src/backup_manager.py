@@ -1,8 +1,12 @@
 import os
 import time
-from typing import Dict
+import threading
+from collections import deque
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 import logging
 import shutil
+import stat
 
 # 添加项目根目录到 Python 路径
 import sys
@@ -13,59 +17,260 @@ if parent_dir not in sys.path:
 
 # 使用绝对导入
 from src.sftp_client import SFTPClient
+from src.connection_pool import get_connection_pool
 from src.history import add_history_record
+from src.manifest import BackupManifest, UNCHANGED, TOUCHED, CHANGED
+from src.bulk_transfer import BulkBatch, BulkEntry, build_bulk_options, write_tar
+from src.scanner import scan_tree
+from src.pipeline import Pipeline
+from src.events import ProgressTracker, get_event_bus
+from src.throttle import Throttle, get_server_throttle
+from src import metrics
+from src.logger import LazyText
+from src.profiling import PhaseTimer, RunProfiler, profile_mode
 
-class BackupManager:
-    def __init__(self, servers_config: Dict, task_config: Dict):
-        self.servers = servers_config
-        self.task_config = task_config
-        self.logger = logging.getLogger(__name__)
-        self.backup_stats = {
-            'start_time': None,
+# 监视模式下同一目录变化的文件达到该数量时才列出远程目录，否则逐个 stat
+WATCH_LISTING_MIN_FILES = 16
+
+# 每次运行保留的最近错误信息条数
+MAX_RUN_ERRORS = 20
+
+
+class BackupRun:
+    """单次备份运行的上下文
+
+    统计计数、本地清单和传输设置都属于某一次运行，多个任务并发执行时互不干扰
+    """
+
+    def __init__(self, task_name: str):
+        self.task_name = task_name
+        self.stats = {
+            'start_time': time.strftime('%Y-%m-%d %H:%M:%S'),
             'end_time': None,
             'total_files': 0,
             'total_size': 0,
             'success_files': 0,
             'failed_files': 0,
-            'skipped_files': 0
+            'skipped_files': 0,
+            'uploaded_size': 0,
+            'transferred_size': 0,
+            'processed_size': 0,
+            'throttled_seconds': 0.0
         }
-        
-    def _reset_stats(self):
-        """重置统计信息"""
+        # 多通道并发上传时保护统计计数
+        self._stats_lock = threading.Lock()
+        self.start_ts = time.time()
+        # 本次运行使用的本地清单，以及是否与远程核对
+        self.manifest = None
+        self.reconciling = False
+        # 是否按目录批量获取远程文件信息（listdir_attr）
+        self.remote_listing = True
+        # 本次运行的传输设置（增量传输、原子上传、断点续传）
+        self.upload_options = {}
+        # 小文件批量打包传输设置，None 表示不启用
+        self.bulk_options = None
+        # 监视模式下本次只备份的变化路径，None 表示完整扫描源目录
+        self.paths = None
+        # 并发扫描源目录的线程数
+        self.scan_workers = 1
+        # 流水线各阶段之间的队列长度，以及运行结束后各阶段的计数
+        self.queue_size = 256
+        self.pipeline_stats = []
+        # 取消请求，任务被取消时置位，各阶段停止处理新的文件
+        self.cancelled = threading.Event()
+        # 扫描结束后总文件数和总大小不再增加，可以估算剩余时间
+        self.scan_complete = False
+        # 最近的错误信息，供任务进度查询
+        self.errors = deque(maxlen=MAX_RUN_ERRORS)
+        # 传输进度，节流后推送给 Web 端
+        self.progress = ProgressTracker(get_event_bus(), task_name, self.stats)
+        # 本次运行生效的限速器（任务限速和服务器共享限速），为空表示不限速
+        self.throttles: List[Throttle] = []
+        # 目标服务器名称，以及统计项对应的指标计数器（带任务和服务器标签）
+        self.server_name = None
+        self.counters = {}
+        # 各阶段（扫描、远程 stat、建目录、上传等）的累计耗时，以及开启剖析时的剖析器
+        self.phases = PhaseTimer()
+        self.profiler: Optional[RunProfiler] = None
+
+    def update_stats(self, **deltas):
+        """线程安全地累加统计计数"""
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+        counters = self.counters
+        for key, value in deltas.items():
+            counter = counters.get(key)
+            if counter is not None:
+                counter.inc(value)
+        self.progress.tick()
+
+    def throttle(self, amount: int):
+        """发送 amount 字节前依次经过各限速器，累计因限速等待的时间"""
+        waited = 0.0
+        for limiter in self.throttles:
+            waited += limiter.consume(amount)
+        if waited:
+            with self._stats_lock:
+                self.stats['throttled_seconds'] += waited
+
+
+class BackupManager:
+    def __init__(self, servers_config: Dict, task_config: Dict):
+        self.servers = servers_config
+        self.task_config = task_config
+        self.logger = logging.getLogger(__name__)
+        # 最近一次完成的运行的统计信息
         self.backup_stats = {
-            'start_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'start_time': None,
             'end_time': None,
             'total_files': 0,
             'total_size': 0,
             'success_files': 0,
             'failed_files': 0,
-            'skipped_files': 0
+            'skipped_files': 0,
+            'uploaded_size': 0,
+            'transferred_size': 0,
+            'processed_size': 0,
+            'throttled_seconds': 0.0
         }
         
-    def _log_backup_summary(self, task_name: str):
+    def _log_backup_summary(self, run: BackupRun):
         """记录备份任务的总结信息"""
-        self.backup_stats['end_time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        stats = run.stats
+        stats['end_time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        elapsed = max(time.time() - run.start_ts, 0.001)
+        files_per_sec = stats['success_files'] / elapsed
+        mb_per_sec = stats['uploaded_size'] / elapsed / (1024 * 1024)
+        sent_mb_per_sec = stats['transferred_size'] / elapsed / (1024 * 1024)
         
         summary = [
             "-" * 50,
-            f"备份任务总结 - {task_name}",
-            f"开始时间: {self.backup_stats['start_time']}",
-            f"结束时间: {self.backup_stats['end_time']}",
-            f"总文件数: {self.backup_stats['total_files']}",
-            f"总大小: {self._format_size(self.backup_stats['total_size'])}",
-            f"成功: {self.backup_stats['success_files']} 个文件",
-            f"失败: {self.backup_stats['failed_files']} 个文件",
-            f"跳过: {self.backup_stats['skipped_files']} 个文件（已是最新）",
-            "-" * 50
+            f"备份任务总结 - {run.task_name}",
+            f"开始时间: {stats['start_time']}",
+            f"结束时间: {stats['end_time']}",
+            f"总文件数: {stats['total_files']}",
+            f"总大小: {self._format_size(stats['total_size'])}",
+            f"成功: {stats['success_files']} 个文件",
+            f"失败: {stats['failed_files']} 个文件",
+            f"跳过: {stats['skipped_files']} 个文件（已是最新）",
+            f"耗时: {elapsed:.2f} 秒",
+            f"传输速率: {files_per_sec:.2f} 文件/秒, {mb_per_sec:.2f} MB/秒",
+            f"实际发送: {self._format_size(stats['transferred_size'])} "
+            f"(上传文件大小 {self._format_size(stats['uploaded_size'])})",
         ]
+        if run.throttles:
+            summary.append(f"限速等待（各通道合计）: {stats['throttled_seconds']:.2f} 秒, "
+                           f"实际发送速率: {sent_mb_per_sec:.2f} MB/秒")
+        # 各操作的累计耗时（多线程时为各线程之和），用于判断时间花在哪里
+        for phase, entry in run.phases.summary().items():
+            summary.append(f"阶段耗时 {phase}: {entry['seconds']:.2f} 秒 ({entry['count']} 次)")
+        if run.profiler is not None and run.profiler.path:
+            summary.append(f"性能剖析: {run.profiler.path}")
+        # 流水线各阶段的吞吐量和队列峰值，用于判断瓶颈所在
+        for stage in run.pipeline_stats:
+            summary.append(f"阶段 {stage['stage']} (x{stage['workers']}): 处理 {stage['processed']} 项, "
+                           f"{stage['per_sec']:.2f} 项/秒, 队列峰值 {stage['max_queue_depth']}, "
+                           f"忙碌 {stage['busy_seconds']:.2f} 秒")
+        summary.append("-" * 50)
         
         # 确保每行都被记录
         for line in summary:
             self.logger.info(line)
         
-    def execute_backup(self, task_name: str) -> bool:
-        """执行指定的备份任务"""
-        self._reset_stats()
+    def _open_manifest(self, run: BackupRun, task: Dict, reconcile: bool):
+        """按任务配置打开本地清单，并决定本次是否与远程核对"""
+        run.manifest = None
+        run.reconciling = False
+        if not task.get('manifest', False):
+            return
+        try:
+            run.manifest = BackupManifest(
+                run.task_name,
+                f"{task['target_server']}|{task['target_path']}",
+                use_hash=task.get('manifest_hash', False)
+            )
+        except Exception as e:
+            self.logger.warning(f"打开本地清单失败，本次将逐个检查远程文件: {str(e)}")
+            return
+        run.reconciling = reconcile or run.manifest.reconcile_due(
+            task.get('manifest_reconcile_hours', 24))
+        if run.reconciling:
+            self.logger.info(f"本次运行将与远程核对本地清单: {run.task_name}")
+
+    def _close_manifest(self, run: BackupRun, success: bool):
+        """关闭本地清单，核对成功时记录核对时间"""
+        if not run.manifest:
+            return
+        try:
+            if success and run.reconciling:
+                run.manifest.mark_reconciled()
+            run.manifest.close()
+        except Exception as e:
+            self.logger.warning(f"保存本地清单失败: {str(e)}")
+        finally:
+            run.manifest = None
+
+    def _build_upload_options(self, task: Dict) -> Dict:
+        """根据任务配置生成上传设置"""
+        options = {
+            'atomic': task.get('atomic_upload', True),
+            'resume_min_size': int(task.get('resume_min_size_mb', 64)) * 1024 * 1024,
+            'checkpoint_size': int(task.get('resume_checkpoint_mb', 64)) * 1024 * 1024,
+            'delta': None
+        }
+        if task.get('delta_transfer', False):
+            options['delta'] = {
+                'min_size': int(task.get('delta_min_size_mb', 64)) * 1024 * 1024,
+                'block_size': int(task.get('delta_block_size', 128 * 1024)),
+                'max_literal': int(task.get('delta_max_changed_mb', 16)) * 1024 * 1024,
+                'python': task.get('delta_python', 'python3')
+            }
+        return options
+
+    def _start_profiler(self, run: BackupRun, task: Dict, job) -> Optional[RunProfiler]:
+        """手动触发时指定的 profile 优先，其次为任务配置的 profile，未开启时返回 None"""
+        requested = getattr(job, 'profile', None)
+        try:
+            mode = profile_mode(requested if requested is not None else task.get('profile'))
+        except ValueError as e:
+            self.logger.error(str(e))
+            return None
+        if mode is None:
+            return None
+        profiler = RunProfiler(mode, run.task_name)
+        profiler.start()
+        self.logger.info(f"本次运行开启性能剖析 ({profiler.mode}): {run.task_name}")
+        return profiler
+
+    def _build_throttles(self, task: Dict, target_server: Dict) -> List[Throttle]:
+        """任务限速只作用于本次运行；服务器限速由发往该服务器的所有运行和通道共享"""
+        throttles = []
+        try:
+            if task.get('bandwidth_limit'):
+                throttles.append(Throttle(task['bandwidth_limit']))
+            server_throttle = get_server_throttle(task['target_server'],
+                                                  target_server.get('bandwidth_limit'))
+            if server_throttle is not None:
+                throttles.append(server_throttle)
+        except (ValueError, TypeError, AttributeError) as e:
+            self.logger.error(f"带宽限制配置无效，本次运行不限速: {str(e)}")
+        return throttles
+
+    def execute_backup(self, task_name: str, reconcile: bool = False,
+                       paths: Optional[Iterable[str]] = None, job=None) -> bool:
+        """执行指定的备份任务
+
+        reconcile 为 True 时忽略本地清单的跳过判断，逐个与远程核对并刷新清单；
+        paths 不为空时只备份这些变化的文件或目录（监视模式）；
+        job 为任务队列中的运行登记（TaskRun），通过它报告进度和接收取消请求
+        """
+        run = BackupRun(task_name)
+        run.paths = set(paths) if paths is not None else None
+        if job is not None:
+            run.cancelled = job.cancelled
+            run.progress.run_id = job.run_id
+            job.backup_run = run
         self.logger.debug(f"开始执行备份任务: {task_name}")
         task = self.task_config.get(task_name)
         if not task:
@@ -79,6 +284,8 @@ class BackupManager:
         if not target_server:
             self.logger.error(f"目标服务器配置不存在: target={task['target_server']}")
             return False
+        run.server_name = task['target_server']
+        run.counters = metrics.run_counters(task_name, run.server_name)
             
         retry_count = 0
         max_retries = task.get('retry_times', 3)
@@ -86,121 +293,473 @@ class BackupManager:
         
         success = False
         details = ""
+        self._open_manifest(run, task, reconcile)
+        run.remote_listing = task.get('remote_listing', True)
+        run.upload_options = self._build_upload_options(task)
+        # 取消时中断正在上传的文件，每块发送后更新传输进度
+        run.upload_options['cancel'] = run.cancelled
+        run.upload_options['progress'] = run.progress.update
+        run.throttles = self._build_throttles(task, target_server)
+        run.upload_options['throttle'] = run.throttle if run.throttles else None
+        run.bulk_options = build_bulk_options(task)
+        run.scan_workers = int(task.get('scan_workers', 1))
+        run.queue_size = int(task.get('pipeline_queue_size', 256))
+        run.upload_options['phases'] = run.phases
+        run.profiler = self._start_profiler(run, task, job)
         try:
             success = self._perform_backup(
-                task_name,
+                run,
+                task['target_server'],
                 target_server,
                 task['source_path'],
-                task['target_path']
+                task['target_path'],
+                upload_workers=task.get('upload_workers', 1)
             )
             
             details = (
-                f"总文件数: {self.backup_stats['total_files']}, "
-                f"成功: {self.backup_stats['success_files']}, "
-                f"失败: {self.backup_stats['failed_files']}, "
-                f"跳过: {self.backup_stats['skipped_files']}"
+                f"总文件数: {run.stats['total_files']}, "
+                f"成功: {run.stats['success_files']}, "
+                f"失败: {run.stats['failed_files']}, "
+                f"跳过: {run.stats['skipped_files']}"
             )
+            if run.cancelled.is_set():
+                success = False
+                details = f"已取消, {details}"
             
             # 添加历史记录
-            add_history_record(task_name, success, details)
+            with run.phases.measure('history'):
+                add_history_record(task_name, success, details,
+                                   files=run.stats['success_files'],
+                                   size=run.stats['uploaded_size'],
+                                   duration=time.time() - run.start_ts,
+                                   phases=run.phases.summary())
             
         except Exception as e:
             self.logger.error(f"备份失败: {str(e)}", exc_info=True)
             details = f"错误: {str(e)}"
-            add_history_record(task_name, False, details)
+            add_history_record(task_name, False, details,
+                               duration=time.time() - run.start_ts,
+                               phases=run.phases.summary())
+        finally:
+            with run.phases.measure('manifest'):
+                self._close_manifest(run, success)
+            if run.profiler is not None:
+                path = run.profiler.stop()
+                if job is not None:
+                    job.profile_path = path
         
-        # 记录备份总结
-        self._log_backup_summary(task_name)
+        # 推送最终进度并记录备份总结
+        result = 'cancelled' if run.cancelled.is_set() else ('success' if success else 'failed')
+        metrics.RUNS.labels(task_name, run.server_name, result).inc()
+        metrics.RUN_SECONDS.labels(task_name, run.server_name).observe(time.time() - run.start_ts)
+        run.progress.tick(force=True)
+        self._log_backup_summary(run)
+        self.backup_stats = run.stats
         return success
         
-    def _perform_backup(self, task_name: str, target: Dict, 
-                       source_path: str, target_path: str) -> bool:
+    def _perform_backup(self, run: BackupRun, server_name: str, target: Dict, 
+                       source_path: str, target_path: str,
+                       upload_workers: int = 1) -> bool:
         """执行实际的备份操作"""
-        # 创建SFTP客户端
-        sftp_client = SFTPClient(
-            host=target['host'],
-            port=target['port'],
-            username=target['username'],
-            password=target.get('password'),
-            key_file=target.get('key_file')
-        )
-        
-        try:
-            # 检查源文件是否存在
-            if not os.path.exists(source_path):
-                self.logger.error(f"源路径不存在: {source_path}")
-                return False
-                
+        # 检查源文件是否存在
+        if not os.path.exists(source_path):
+            self.logger.error(f"源路径不存在: {source_path}")
+            return False
+            
+        # 从连接池借用SFTP连接，避免每次运行都重新握手认证
+        connect_start = time.perf_counter()
+        with get_connection_pool().session(server_name, target) as sftp_client:
+            run.phases.add('connect', time.perf_counter() - connect_start)
             # 如果源路径是目录，则进行递归备份
             if os.path.isdir(source_path):
-                return self._backup_directory(sftp_client, source_path, target_path)
+                return self._backup_directory(run, sftp_client, source_path, target_path,
+                                              upload_workers)
             else:
-                return self._backup_file(sftp_client, source_path, target_path)
-                
-        finally:
-            sftp_client.close()
+                return self._backup_file(run, sftp_client, source_path, target_path)
             
-    def _backup_directory(self, sftp_client: SFTPClient, 
-                         source_dir: str, target_dir: str) -> bool:
-        """递归备份整个目录"""
-        success = True
-        total_files = 0
-        success_files = 0
-        
+    def _backup_directory(self, run: BackupRun, sftp_client: SFTPClient, 
+                         source_dir: str, target_dir: str,
+                         upload_workers: int = 1) -> bool:
+        """递归备份整个目录
+
+        按 扫描 → 比对 → 传输 → 记录 四个阶段流式处理，阶段之间用有界队列连接，
+        内存占用与目录大小无关，扫描未结束时传输就已开始
+        """
         self.logger.info(f"开始备份目录: {source_dir} -> {target_dir}")
+        if not sftp_client.sftp and not sftp_client.connect():
+            return False
         
-        for root, dirs, files in os.walk(source_dir):
-            # 计算目标路径
-            relative_path = os.path.relpath(root, source_dir)
-            current_target_dir = os.path.join(target_dir, relative_path)
-            
-            # 备份文件
-            for file in files:
-                total_files += 1
-                source_file = os.path.join(root, file)
-                target_file = os.path.join(current_target_dir, file)
-                if self._backup_file(sftp_client, source_file, target_file):
-                    success_files += 1
-                else:
-                    success = False
+        # 传输阶段每个线程使用一个SFTP通道，都开在同一个SSH连接上
+        channels = [sftp_client]
+        for _ in range(upload_workers - 1):
+            channel = sftp_client.open_channel()
+            if channel is None:
+                break
+            channels.append(channel)
+        if len(channels) > 1:
+            self.logger.info(f"使用 {len(channels)} 个SFTP通道并发上传")
         
+        # 比对阶段使用独立通道列目录和查询远程文件；无法打开时由传输阶段自行比对
+        comparer = sftp_client.open_channel()
+        
+        def scan():
+            for group in self._scan_groups(run, source_dir, target_dir):
+                if run.cancelled.is_set():
+                    return
+                yield group
+            run.scan_complete = True
+        
+        def compare(channel, group, emit):
+            self._compare_group(run, channel, group, emit)
+        
+        def open_transfer(index):
+            # 每个通道各自累积小文件批次
+            return channels[index], self._new_bulk_batch(run, channels[index], target_dir)
+        
+        def transfer(worker, item, emit):
+            channel, batch = worker
+            # 取消后丢弃队列中剩余的文件
+            if not run.cancelled.is_set():
+                self._transfer_file(run, channel, *item, batch=batch, record=emit)
+        
+        def close_transfer(worker, emit):
+            channel, batch = worker
+            if batch is not None and not run.cancelled.is_set():
+                self._flush_bulk(run, channel, batch, emit)
+        
+        def record(state, recorder, emit):
+            recorder()
+        
+        pipeline = Pipeline(run.task_name, worker_context=(
+            run.profiler.thread_context if run.profiler is not None else None))
+        pipeline.add_stage('compare', compare, queue_size=run.queue_size,
+                           open_worker=lambda index: comparer)
+        pipeline.add_stage('transfer', transfer, workers=len(channels), queue_size=run.queue_size,
+                           open_worker=open_transfer, close_worker=close_transfer)
+        # 清单写入（可能包含计算哈希）集中在单独的线程，不占用传输线程
+        pipeline.add_stage('record', record, queue_size=run.queue_size)
+        try:
+            pipeline.run(scan())
+        finally:
+            # 扫描耗时只计扫描本身，不含等待下游队列；取消的运行也记录
+            metrics.SCAN_SECONDS.labels(run.task_name).observe(pipeline.source_stats.busy_seconds)
+            # 主客户端由调用方关闭，这里只关闭额外打开的通道
+            for channel in channels[1:]:
+                channel.close()
+            if comparer is not None:
+                comparer.close()
+        run.pipeline_stats = pipeline.stats()
+        run.phases.add('scan', pipeline.source_stats.busy_seconds, pipeline.source_stats.processed)
+        
+        total = run.stats['total_files']
+        succeeded = total - run.stats['failed_files']
+        success = run.stats['failed_files'] == 0 and pipeline.errors == 0
         if success:
             self.logger.info(f"目录备份完成: {source_dir}")
-            self.logger.info(f"成功备份 {success_files}/{total_files} 个文件")
+            self.logger.info(f"成功备份 {succeeded}/{total} 个文件")
         else:
             self.logger.warning(f"目录部分备份完成: {source_dir}")
-            self.logger.warning(f"成功备份 {success_files}/{total_files} 个文件，有文件备份失败")
+            self.logger.warning(f"成功备份 {succeeded}/{total} 个文件，有文件备份失败")
                     
         return success
+
+    def _scan_groups(self, run: BackupRun, source_dir: str, target_dir: str):
+        """扫描阶段：监视模式下只处理变化的路径，否则遍历整个源目录"""
+        if run.paths is None:
+            return self._walk_files(run, source_dir, target_dir)
+        return self._walk_paths(run, source_dir, target_dir, run.paths)
+
+    def _walk_paths(self, run: BackupRun, source_dir: str, target_dir: str,
+                    paths: Iterable[str]):
+        """只遍历变化的路径：变化的目录整体遍历，文件按所在目录分组"""
+        source_dir = os.path.abspath(source_dir)
+        dirs, files_by_dir = [], {}
+        # 排序后目录总在其下的路径之前
+        for path in sorted(os.path.abspath(p) for p in paths):
+            relative_path = os.path.relpath(path, source_dir)
+            if relative_path.startswith(os.pardir):
+                continue
+            # 已被包含在变化目录中的路径不再单独处理
+            if any(path.startswith(d + os.sep) for d in dirs):
+                continue
+            try:
+                local_stat = os.stat(path)
+            except OSError:
+                # 已删除的路径直接忽略
+                continue
+            if stat.S_ISDIR(local_stat.st_mode):
+                dirs.append(path)
+            elif stat.S_ISREG(local_stat.st_mode):
+                files_by_dir.setdefault(os.path.dirname(path), []).append(
+                    (os.path.basename(path), local_stat))
+        
+        for path in dirs:
+            yield from self._walk_files(
+                run, path, os.path.join(target_dir, os.path.relpath(path, source_dir)))
         
-    def _backup_file(self, sftp_client: SFTPClient, 
+        for directory, names in files_by_dir.items():
+            current_target_dir = os.path.join(target_dir, os.path.relpath(directory, source_dir))
+            # 只有少量文件变化时逐个 stat 比列出整个远程目录更省
+            yield directory, current_target_dir, names, len(names) >= WATCH_LISTING_MIN_FILES
+
+    def _walk_files(self, run: BackupRun, source_dir: str, target_dir: str):
+        """遍历源目录，逐个目录产出 (源目录, 目标目录, [(文件名, 本地 stat)], 是否列远程目录)
+
+        本地文件的 stat 在扫描时获取一次，后续处理直接使用
+        """
+        worker_context = run.profiler.thread_context if run.profiler is not None else None
+        for root, files in scan_tree(source_dir, run.scan_workers, worker_context):
+            if not files:
+                continue
+            # 计算目标路径
+            relative_path = os.path.relpath(root, source_dir)
+            current_target_dir = os.path.join(target_dir, relative_path)
+            yield root, current_target_dir, files, True
+
+    def _listing_enabled(self, run: BackupRun) -> bool:
+        """本地清单可信时无需列目录，其余情况按目录批量获取远程信息"""
+        if not run.remote_listing:
+            return False
+        return run.manifest is None or run.reconciling
+
+    def _list_remote_dir(self, lister: SFTPClient, remote_dir: str):
+        """获取远程目录列表，返回 (文件名到属性的映射, 是否强制上传)
+
+        目录不存在时目录下所有文件都需要上传；列目录出错时退回逐个 stat
+        """
+        try:
+            remote_attrs = lister.list_remote_dir(remote_dir)
+        except Exception as e:
+            self.logger.debug(f"获取远程目录列表失败，改为逐个检查: {remote_dir}: {str(e)}")
+            return None, False
+        if remote_attrs is None:
+            return None, True
+        return remote_attrs, False
+
+    def _compare_group(self, run: BackupRun, sftp_client: Optional[SFTPClient],
+                       group: Tuple, emit: Callable):
+        """比对阶段：每个远程目录只请求一次 listdir_attr，需要上传的文件交给传输阶段"""
+        root, target_dir, files, want_listing = group
+        remote_attrs, force = None, False
+        if want_listing and sftp_client is not None and self._listing_enabled(run):
+            with run.phases.measure('remote_list'):
+                remote_attrs, force = self._list_remote_dir(sftp_client, target_dir)
+        
+        for name, local_stat in files:
+            if run.cancelled.is_set():
+                return
+            source_file = os.path.join(root, name)
+            try:
+                item = self._compare_file(run, sftp_client, source_file,
+                                          os.path.join(target_dir, name),
+                                          remote_attrs, force, local_stat)
+            except Exception as e:
+                self._record_failure(run, source_file, e)
+                continue
+            if item is not None:
+                emit(item)
+
+    def _compare_file(self, run: BackupRun, sftp_client: Optional[SFTPClient],
+                      source_file: str, target_file: str,
+                      remote_attrs: Optional[Dict] = None, force: bool = False,
+                      local_stat: Optional[os.stat_result] = None) -> Optional[Tuple]:
+        """判断单个文件是否需要上传，需要时返回传输阶段的参数，否则返回 None
+
+        remote_attrs 为目标目录的远程列表（目录已存在），force 表示已知需要上传；
+        local_stat 为扫描时获取的本地文件信息，未提供时重新 stat；
+        sftp_client 为 None 时只根据本地清单判断，远程比对留给传输阶段
+        """
+        if local_stat is None:
+            local_stat = os.stat(source_file)
+        file_size = local_stat.st_size
+        run.update_stats(total_files=1, total_size=file_size)
+        
+        self.logger.debug("开始备份文件: %s (%s)", source_file, LazyText(self._format_size, file_size))
+        
+        # 优先根据本地清单判断，未变化的文件不产生任何网络请求
+        manifest = run.manifest
+        state = None
+        if manifest and not run.reconciling:
+            state = manifest.check(source_file, target_file, file_size, local_stat.st_mtime)
+            if state == UNCHANGED:
+                run.update_stats(skipped_files=1, processed_size=file_size)
+                self.logger.debug("清单显示文件未变化，跳过: %s", source_file)
+                return None
+            if state == TOUCHED and sftp_client is not None and sftp_client.set_remote_mtime(
+                    target_file, local_stat.st_atime, local_stat.st_mtime):
+                manifest.record(source_file, target_file, file_size, local_stat.st_mtime)
+                run.update_stats(skipped_files=1, processed_size=file_size)
+                self.logger.debug("文件内容未变化，仅同步修改时间: %s", source_file)
+                return None
+        
+        # 清单已确认文件变化时无需再查询远程状态
+        force = force or state in (CHANGED, TOUCHED)
+        if not force and sftp_client is not None:
+            if remote_attrs is None:
+                # 没有目录列表时逐个 stat，每个文件一次往返
+                with run.phases.measure('remote_stat'):
+                    changed = sftp_client.check_remote_file(source_file, target_file, None, local_stat)
+            else:
+                # 目录列表的往返已计入 remote_list，这里只是查表
+                changed = sftp_client.check_remote_file(source_file, target_file, remote_attrs,
+                                                        local_stat)
+            if not changed:
+                self._record_result(run, source_file, target_file, local_stat, True, True)
+                return None
+            force = True
+        return source_file, target_file, remote_attrs, force, local_stat
+
+    def _backup_file(self, run: BackupRun, sftp_client: SFTPClient, 
                      source_file: str, target_file: str) -> bool:
-        """备份单个文件"""
+        """备份单个文件（源路径本身是文件时使用）"""
         try:
-            file_size = os.path.getsize(source_file)
-            self.backup_stats['total_files'] += 1
-            self.backup_stats['total_size'] += file_size
-            
-            self.logger.debug(f"开始备份文件: {source_file} ({self._format_size(file_size)})")
+            item = self._compare_file(run, sftp_client, source_file, target_file)
+            run.scan_complete = True
+            if item is None:
+                return True
+            return self._transfer_file(run, sftp_client, *item, record=self._record_now)
+        except Exception as e:
+            self._record_failure(run, source_file, e)
+            return False
+
+    def _transfer_file(self, run: BackupRun, sftp_client: SFTPClient,
+                       source_file: str, target_file: str,
+                       remote_attrs: Optional[Dict], force: bool,
+                       local_stat: os.stat_result,
+                       batch: Optional[BulkBatch] = None,
+                       record: Callable = None) -> bool:
+        """传输阶段：上传单个文件，结果交给 record 记录
+
+        batch 不为空时，需要上传的小文件加入批次，稍后打包传输
+        """
+        try:
+            file_size = local_stat.st_size
             
-            result = sftp_client.upload_file(source_file, target_file)
+            # 小文件加入批次，由 _flush_bulk 统一打包传输
+            if batch is not None and batch.accepts(file_size):
+                if not force and not sftp_client.check_remote_file(source_file, target_file, remote_attrs,
+                                                                   local_stat):
+                    record(partial(self._record_result, run, source_file, target_file,
+                                   local_stat, True, True))
+                    return True
+                batch.add(source_file, target_file, file_size, local_stat.st_mtime)
+                if batch.is_full():
+                    return self._flush_bulk(run, sftp_client, batch, record)
+                return True
             
-            if result:
-                if sftp_client.last_skipped:  # 需要在SFTPClient中添加此属性
-                    self.backup_stats['skipped_files'] += 1
-                    self.logger.debug(f"文件跳过: {source_file} -> {target_file}")
-                else:
-                    self.backup_stats['success_files'] += 1
-                    self.logger.info(f"文件备份成功: {source_file} -> {target_file} ({self._format_size(file_size)})")
-            else:
-                self.backup_stats['failed_files'] += 1
-                
+            started = time.perf_counter()
+            result = sftp_client.upload_file(source_file, target_file,
+                                             force=force,
+                                             remote_attrs=remote_attrs,
+                                             options=run.upload_options,
+                                             local_stat=local_stat)
+            if result and not sftp_client.last_skipped:
+                metrics.UPLOAD_SECONDS.labels(run.server_name).observe(time.perf_counter() - started)
+            record(partial(self._record_result, run, source_file, target_file, local_stat,
+                           result, sftp_client.last_skipped, sftp_client.last_sent_bytes))
             return result
             
         except Exception as e:
-            self.backup_stats['failed_files'] += 1
-            self.logger.error(f"文件备份失败: {source_file}: {str(e)}")
+            self._record_failure(run, source_file, e, local_stat.st_size)
             return False
+        finally:
+            run.progress.finish(source_file)
+
+    @staticmethod
+    def _record_now(recorder: Callable):
+        """不经过记录阶段，直接记录结果"""
+        recorder()
+
+    def _record_result(self, run: BackupRun, source_file: str, target_file: str,
+                       local_stat: os.stat_result, result: bool, skipped: bool,
+                       sent_bytes: int = 0):
+        """根据单个文件的处理结果更新统计和本地清单"""
+        file_size = local_stat.st_size
+        if result:
+            if run.manifest:
+                run.manifest.record(source_file, target_file, file_size, local_stat.st_mtime)
+            if skipped:
+                run.update_stats(skipped_files=1, processed_size=file_size)
+                self.logger.debug("文件跳过: %s -> %s", source_file, target_file)
+            else:
+                run.update_stats(success_files=1, uploaded_size=file_size,
+                                 transferred_size=sent_bytes, processed_size=file_size)
+                self.logger.info("文件备份成功: %s -> %s (%s)", source_file, target_file,
+                                 LazyText(self._format_size, file_size))
+        else:
+            # 上传失败的原因已由 SFTPClient 记录到日志
+            run.update_stats(failed_files=1, processed_size=file_size)
+            run.errors.append(f"文件上传失败: {source_file}")
+
+    def _record_failure(self, run: BackupRun, source_file: str, error: Exception,
+                        file_size: int = 0):
+        """记录处理过程中出错的文件"""
+        message = f"文件备份失败: {source_file}: {str(error)}"
+        run.update_stats(failed_files=1, processed_size=file_size)
+        run.errors.append(message)
+        self.logger.error(message)
+
+    def _record_bulk(self, run: BackupRun, entries: List[BulkEntry], sent: int):
+        """记录一个批次的传输结果"""
+        total_size = sum(entry.size for entry in entries)
+        if run.manifest:
+            for entry in entries:
+                run.manifest.record(entry.source_file, entry.target_file, entry.size, entry.mtime)
+        run.update_stats(success_files=len(entries), uploaded_size=total_size,
+                         transferred_size=sent, processed_size=total_size)
+        self.logger.info("批量传输完成: %d 个文件 (%s)", len(entries),
+                         LazyText(self._format_size, total_size))
+
+    def _new_bulk_batch(self, run: BackupRun, sftp_client: SFTPClient,
+                        target_dir: str) -> Optional[BulkBatch]:
+        """创建小文件批次，未启用或远程无法执行 tar 时返回 None"""
+        options = run.bulk_options
+        if not options:
+            return None
+        if not sftp_client.sftp and not sftp_client.connect():
+            return None
+        if not sftp_client.has_remote_tar(options['tar']):
+            return None
+        if run.upload_options.get('atomic', True) and not sftp_client.supports_staged_extract(target_dir):
+            # 无法暂存后移动时直接解包会绕过原子替换，保持原子上传时改为逐个上传
+            self.logger.info(f"远程目录不支持暂存解包，小文件将逐个上传: {target_dir}")
+            return None
+        return BulkBatch(target_dir, options['max_file_size'],
+                         options['segment_size'], options['max_files'])
+
+    def _flush_bulk(self, run: BackupRun, sftp_client: SFTPClient, batch: BulkBatch,
+                    record: Callable) -> bool:
+        """把批次中的小文件打成 tar 流发送到远程解包，失败时逐个上传"""
+        entries = batch.take()
+        if not entries:
+            return True
+        
+        try:
+            with run.phases.measure('bulk'):
+                sent = sftp_client.extract_tar(batch.target_root,
+                                               lambda fileobj: write_tar(fileobj, entries),
+                                               run.bulk_options['tar'],
+                                               run.upload_options.get('throttle'),
+                                               run.upload_options.get('atomic', True))
+        except Exception as e:
+            self.logger.warning(f"批量传输失败，改为逐个上传 {len(entries)} 个文件: {str(e)}")
+            success = True
+            for entry in entries:
+                try:
+                    local_stat = os.stat(entry.source_file)
+                    result = sftp_client.upload_file(entry.source_file, entry.target_file,
+                                                     force=True, options=run.upload_options,
+                                                     local_stat=local_stat)
+                    record(partial(self._record_result, run, entry.source_file, entry.target_file,
+                                   local_stat, result, False, sftp_client.last_sent_bytes))
+                except Exception as upload_error:
+                    self._record_failure(run, entry.source_file, upload_error, entry.size)
+                    result = False
+                success = success and result
+            return success
+        
+        record(partial(self._record_bulk, run, entries, sent))
+        return True
             
     def _format_size(self, size_in_bytes):
         """格式化文件大小显示"""
@@ -0,0 +1,122 @@
+"""SFTP 传输参数校准
+
+对目标服务器用不同的窗口大小、请求大小和加密算法上传一段探测数据，
+测量实际吞吐量并给出最佳的 transfer 设置，可保存到 config.yaml 中对应服务器的配置下
+"""
+import os
+import time
+import uuid
+import logging
+from typing import Dict, List, Optional
+
+from src.sftp_client import SFTPClient
+from src.config_store import get_config_store
+
+# 探测的 (窗口大小, 单次写请求大小) 组合
+PROBE_GRID = [
+    (2 * 1024 * 1024, 32 * 1024),
+    (8 * 1024 * 1024, 32 * 1024),
+    (8 * 1024 * 1024, 128 * 1024),
+    (32 * 1024 * 1024, 128 * 1024),
+    (32 * 1024 * 1024, 256 * 1024),
+]
+
+# 依次尝试的加密算法，服务器或本地不支持的会被跳过
+PROBE_CIPHERS = ['aes128-ctr', 'aes128-gcm@openssh.com', 'aes256-ctr', 'chacha20-poly1305@openssh.com']
+
+PROBE_BUFFER_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def _probe(server_config: Dict, transfer: Dict, remote_dir: str, probe_size: int) -> Optional[float]:
+    """用指定的传输参数上传探测数据，返回吞吐量（MB/s），失败返回 None"""
+    client = SFTPClient(
+        host=server_config['host'],
+        port=int(server_config['port']),
+        username=server_config['username'],
+        password=server_config.get('password'),
+        key_file=server_config.get('key_file'),
+        transfer=transfer
+    )
+    if not client.connect():
+        return None
+    remote_path = f"{remote_dir.rstrip('/')}/.calibrate-{uuid.uuid4().hex}"
+    block = os.urandom(PROBE_BUFFER_SIZE)
+    try:
+        cipher = client.ssh.get_transport().remote_cipher
+        if transfer.get('ciphers') and cipher != transfer['ciphers'][0]:
+            # 服务器不支持该算法，协商结果回落到了其他算法
+            return None
+        start = time.perf_counter()
+        with client.sftp.open(remote_path, 'w') as remote_file:
+            client._tune_file(remote_file)
+            sent = 0
+            while sent < probe_size:
+                chunk = block[:min(len(block), probe_size - sent)]
+                remote_file.write(chunk)
+                sent += len(chunk)
+        # 流水线写入在关闭时不检查确认，stat 一次确认数据已全部写入
+        if client.sftp.stat(remote_path).st_size != probe_size:
+            return None
+        elapsed = time.perf_counter() - start
+        return probe_size / (1024 * 1024) / max(elapsed, 1e-6)
+    except Exception as e:
+        logger.debug(f"校准探测失败 {transfer}: {str(e)}")
+        return None
+    finally:
+        try:
+            client.sftp.remove(remote_path)
+        except Exception:
+            pass
+        client.close()
+
+
+def calibrate_server(server_config: Dict, remote_dir: str = '.', probe_mb: int = 8) -> Optional[Dict]:
+    """对服务器做吞吐量探测，返回建议的 transfer 设置；全部探测失败时返回 None"""
+    probe_size = probe_mb * 1024 * 1024
+    results: List[Dict] = []
+
+    # 第一轮：窗口大小 × 请求大小
+    best = None
+    for window_size, request_size in PROBE_GRID:
+        transfer = {
+            'window_size': window_size,
+            'max_packet_size': min(request_size, 256 * 1024),
+            'request_size': request_size,
+            'pipelined': True,
+            'buffer_size': PROBE_BUFFER_SIZE,
+        }
+        speed = _probe(server_config, transfer, remote_dir, probe_size)
+        logger.info(f"校准: 窗口 {window_size // 1024}KB, 请求 {request_size // 1024}KB -> "
+                    f"{'失败' if speed is None else f'{speed:.2f} MB/s'}")
+        results.append({'transfer': transfer, 'speed': speed})
+        if speed is not None and (best is None or speed > best['speed']):
+            best = results[-1]
+    if best is None:
+        return None
+
+    # 第二轮：在最佳组合上比较加密算法
+    for cipher in PROBE_CIPHERS:
+        transfer = dict(best['transfer'], ciphers=[cipher])
+        speed = _probe(server_config, transfer, remote_dir, probe_size)
+        logger.info(f"校准: 加密算法 {cipher} -> "
+                    f"{'不支持' if speed is None else f'{speed:.2f} MB/s'}")
+        if speed is not None and speed > best['speed']:
+            best = {'transfer': transfer, 'speed': speed}
+
+    suggestion = dict(best['transfer'])
+    suggestion['calibration'] = {
+        'throughput_mbps': round(best['speed'], 2),
+        'probe_mb': probe_mb,
+        'calibrated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    return suggestion
+
+
+def save_calibration(config_path: str, server_name: str, transfer: Dict):
+    """把校准结果写入 config.yaml 中对应服务器的 transfer 项"""
+    with get_config_store(config_path).edit() as current_config:
+        if server_name not in current_config.get('servers', {}):
+            raise KeyError(f"服务器不存在: {server_name}")
+        current_config['servers'][server_name]['transfer'] = transfer
@@ -0,0 +1,115 @@
+"""进程内的配置存储
+
+所有读取都走内存缓存，按文件的修改时间、大小和 inode 判断缓存是否失效（外部手动修改配置文件后自动重新加载）；
+修改在锁内基于最新配置进行，写入临时文件后原子重命名，不会产生写了一半的配置文件或丢失并发修改
+"""
+import os
+import copy
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import yaml
+
+
+class ConfigStore:
+    """单个配置文件的缓存和原子写入"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._config = None
+        self._signature = None
+        self._listeners: List[Callable[[Dict], None]] = []
+
+    def subscribe(self, listener: Callable[[Dict], None]):
+        """配置变化（本进程写入或外部修改）后以新配置调用 listener"""
+        self._listeners.append(listener)
+
+    def _stat_signature(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _refresh(self) -> bool:
+        """文件变化时重新加载，返回是否重新加载（需持有锁）"""
+        signature = self._stat_signature()
+        if signature == self._signature and self._config is not None:
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+        first_load = self._config is None
+        self._config = config
+        self._signature = signature
+        if not first_load:
+            self.logger.info(f"配置文件已变化，重新加载: {self.path}")
+        return not first_load
+
+    def get(self) -> Dict:
+        """当前配置（只读，修改请使用 edit）"""
+        with self._lock:
+            changed = self._refresh()
+            config = self._config
+        if changed:
+            self._notify(config)
+        return config
+
+    @contextmanager
+    def edit(self):
+        """在锁内修改配置副本，退出时若有变化则原子写回并通知订阅者；发生异常时放弃修改"""
+        with self._lock:
+            self._refresh()
+            original = self._config
+            current = copy.deepcopy(original)
+            yield current
+            if current == original:
+                return
+            self._write(current)
+            self._config = current
+            self._signature = self._stat_signature()
+        self._notify(current)
+
+    def _write(self, config: Dict):
+        """写入同目录下的临时文件后重命名，替换是原子的"""
+        directory = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.config.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                yaml.dump(config, f, allow_unicode=True)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+            except OSError:
+                pass
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _notify(self, config: Dict):
+        for listener in list(self._listeners):
+            try:
+                listener(config)
+            except Exception as e:
+                self.logger.error(f"应用新配置失败: {str(e)}", exc_info=True)
+
+
+# 按路径共享的配置存储，同一文件的读写使用同一把锁
+_stores: Dict[str, ConfigStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_config_store(path: str) -> ConfigStore:
+    """获取配置文件对应的存储"""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ConfigStore(path)
+        return store
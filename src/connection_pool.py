@@ -0,0 +1,222 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from src.sftp_client import SFTPClient
+
+
+class _ServerSlot:
+    """单个服务器在连接池中的状态"""
+
+    def __init__(self, signature: Tuple, max_sessions: int):
+        self.signature = signature
+        self.max_sessions = max_sessions
+        self.in_use = 0
+        # 空闲连接列表: (客户端, 最后使用时间)
+        self.idle: List[Tuple[SFTPClient, float]] = []
+
+
+class SFTPConnectionPool:
+    """进程级 SSH/SFTP 连接池
+
+    按服务器名称复用已认证的连接，支持 keep-alive、空闲回收、
+    借出前健康检查以及每台服务器的最大会话数限制
+    """
+
+    def __init__(self, max_sessions: int = 4, idle_timeout: int = 300,
+                 keepalive: int = 30, health_check_after: int = 30):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        # 空闲超过该秒数的连接在借出前需要做一次健康检查
+        self.health_check_after = health_check_after
+        self.logger = logging.getLogger(__name__)
+        self._slots: Dict[str, _ServerSlot] = {}
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _signature(server_config: Dict) -> Tuple:
+        """连接参数签名，配置变化后旧连接不再复用"""
+        return (server_config.get('host'), int(server_config.get('port', 22)),
+                server_config.get('username'), server_config.get('password'),
+                server_config.get('key_file'), server_config.get('transfer'))
+
+    def _get_slot(self, server_name: str, server_config: Dict) -> _ServerSlot:
+        """获取服务器槽位，连接参数变化时丢弃旧的空闲连接（需持有锁）"""
+        signature = self._signature(server_config)
+        max_sessions = int(server_config.get('max_sessions', self.max_sessions))
+        slot = self._slots.get(server_name)
+        if slot is None:
+            slot = _ServerSlot(signature, max_sessions)
+            self._slots[server_name] = slot
+        elif slot.signature != signature:
+            self.logger.info(f"服务器 {server_name} 的连接参数已变化，关闭旧连接")
+            self._close_clients([client for client, _ in slot.idle])
+            slot.idle = []
+            slot.signature = signature
+        slot.max_sessions = max_sessions
+        return slot
+
+    def acquire(self, server_name: str, server_config: Dict,
+                timeout: Optional[float] = None) -> Optional[SFTPClient]:
+        """借出一个可用连接，达到会话上限时等待，连接失败返回 None"""
+        self._ensure_reaper()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            slot = self._get_slot(server_name, server_config)
+            while slot.in_use >= slot.max_sessions:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    self.logger.warning(f"等待服务器 {server_name} 的空闲会话超时")
+                    return None
+                self._cond.wait(remaining)
+                slot = self._get_slot(server_name, server_config)
+            slot.in_use += 1
+            idle = slot.idle
+            slot.idle = []
+
+        client = None
+        stale = []
+        # 优先复用最近使用过的连接
+        while idle:
+            candidate, last_used = idle.pop()
+            if time.time() - last_used < self.health_check_after or candidate.is_healthy():
+                client = candidate
+                break
+            stale.append(candidate)
+        self._close_clients(stale)
+
+        if client is None:
+            client = SFTPClient(
+                host=server_config['host'],
+                port=int(server_config['port']),
+                username=server_config['username'],
+                password=server_config.get('password'),
+                key_file=server_config.get('key_file'),
+                keepalive=int(server_config.get('keepalive', self.keepalive)),
+                transfer=server_config.get('transfer')
+            )
+            client.server_name = server_name
+            if not client.connect():
+                self._release_slot(server_name, idle)
+                return None
+            self.logger.debug(f"连接池新建连接: {server_name}")
+        else:
+            self.logger.debug(f"连接池复用连接: {server_name}")
+
+        self._release_slot(server_name, idle, borrowed=False)
+        return client
+
+    def _release_slot(self, server_name: str, idle: List, borrowed: bool = True):
+        """归还未使用的空闲连接；borrowed 为 True 时同时释放会话计数"""
+        with self._cond:
+            slot = self._slots.get(server_name)
+            if slot is None:
+                self._close_clients([client for client, _ in idle])
+                return
+            slot.idle.extend(idle)
+            if borrowed:
+                slot.in_use -= 1
+            self._cond.notify_all()
+
+    def release(self, server_name: str, client: SFTPClient, discard: bool = False):
+        """归还连接，discard 为 True 或连接已断开时直接关闭"""
+        with self._cond:
+            slot = self._slots.get(server_name)
+            if slot is not None:
+                slot.in_use -= 1
+                if not discard and client.sftp is not None:
+                    slot.idle.append((client, time.time()))
+                    client = None
+            self._cond.notify_all()
+        if client is not None:
+            self._close_clients([client])
+
+    @contextmanager
+    def session(self, server_name: str, server_config: Dict,
+                timeout: Optional[float] = None):
+        """以上下文管理器方式借用连接，异常时丢弃该连接"""
+        client = self.acquire(server_name, server_config, timeout)
+        if client is None:
+            raise ConnectionError(f"无法连接到服务器: {server_name}")
+        discard = False
+        try:
+            yield client
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.release(server_name, client, discard)
+
+    def evict(self, server_name: str):
+        """关闭并移除指定服务器的所有空闲连接"""
+        with self._cond:
+            slot = self._slots.get(server_name)
+            if slot is None:
+                return
+            clients = [client for client, _ in slot.idle]
+            slot.idle = []
+            if slot.in_use == 0:
+                del self._slots[server_name]
+        self._close_clients(clients)
+
+    def evict_idle(self):
+        """回收空闲超时的连接"""
+        now = time.time()
+        expired = []
+        with self._cond:
+            for slot in self._slots.values():
+                keep = []
+                for client, last_used in slot.idle:
+                    if now - last_used >= self.idle_timeout:
+                        expired.append(client)
+                    else:
+                        keep.append((client, last_used))
+                slot.idle = keep
+        if expired:
+            self.logger.debug(f"回收 {len(expired)} 个空闲连接")
+        self._close_clients(expired)
+
+    def close_all(self):
+        """关闭连接池中的所有空闲连接并停止回收线程"""
+        self._stop.set()
+        with self._cond:
+            clients = [client for slot in self._slots.values() for client, _ in slot.idle]
+            self._slots.clear()
+        self._close_clients(clients)
+
+    def _ensure_reaper(self):
+        """按需启动后台空闲回收线程"""
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(min(self.idle_timeout / 2, 60), 1)
+        while not self._stop.wait(interval):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                self.logger.error(f"回收空闲连接失败: {str(e)}")
+
+    def _close_clients(self, clients: List[SFTPClient]):
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+# 进程级共享连接池
+_pool = SFTPConnectionPool()
+
+
+def get_connection_pool() -> SFTPConnectionPool:
+    """获取进程级共享连接池"""
+    return _pool
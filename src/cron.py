@@ -0,0 +1,172 @@
+"""调度表达式解析
+
+支持标准 5 段 cron 表达式（分 时 日 月 星期），并兼容旧版的简写格式：
+    */n        每 n 分钟执行一次
+    HH:MM      每天特定时间执行
+    MM HH      每天特定时间执行
+    HH:MM W    每周特定时间执行，W 为星期几（0=周一 ... 6=周日）
+    */n h-h    在特定小时范围内每 n 分钟执行
+"""
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+_MONTH_NAMES = {name: i + 1 for i, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])}
+_WEEKDAY_NAMES = {name: i for i, name in enumerate(
+    ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])}
+
+# 最多向后查找的天数，超过说明表达式永远不会触发（如 2 月 30 日）
+_MAX_SEARCH_DAYS = 366 * 5
+
+
+def _parse_field(field: str, low: int, high: int, names: Optional[dict] = None) -> Set[int]:
+    """解析单个 cron 字段，返回允许的取值集合"""
+    values = set()
+    for part in field.lower().split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError(f"无效的步长: {field}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_str, end_str = part.split('-', 1)
+            start = _parse_value(start_str, names)
+            end = _parse_value(end_str, names)
+        else:
+            start = _parse_value(part, names)
+            # a/n 表示从 a 开始每 n 个取值
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"字段取值超出范围 {low}-{high}: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def _parse_value(value: str, names: Optional[dict]) -> int:
+    if names and value in names:
+        return names[value]
+    return int(value)
+
+
+class CronSchedule:
+    """标准 5 段 cron 表达式"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式应为 5 段: {expression}")
+        self.expression = expression
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, _MONTH_NAMES)
+        # 星期字段中 0 和 7 都表示周日
+        weekdays = _parse_field(fields[4], 0, 7, _WEEKDAY_NAMES)
+        self.weekdays = {d % 7 for d in weekdays}
+        # 日和星期都有限制时，满足任一即可（与 cron 一致）
+        self._day_any = fields[2] == '*'
+        self._weekday_any = fields[4] == '*'
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._day_any or self._weekday_any:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, after: datetime) -> datetime:
+        """返回严格晚于 after 的下一个触发时间"""
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=_MAX_SEARCH_DAYS)
+        while dt < limit:
+            if dt.month not in self.months:
+                # 跳到下个月 1 日零点
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+                continue
+            if dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+                continue
+            return dt
+        raise ValueError(f"cron 表达式不会触发: {self.expression}")
+
+    def __str__(self):
+        return self.expression
+
+
+class IntervalSchedule:
+    """固定间隔（分钟）执行，用于无法用 cron 分钟字段表示的间隔，如每 90 分钟"""
+
+    def __init__(self, minutes: int):
+        if minutes <= 0:
+            raise ValueError(f"无效的分钟间隔值: {minutes}")
+        self.minutes = minutes
+
+    def next_after(self, after: datetime) -> datetime:
+        return after.replace(microsecond=0) + timedelta(minutes=self.minutes)
+
+    def __str__(self):
+        return f"every {self.minutes} minutes"
+
+
+def convert_legacy(schedule_str: str) -> Optional[str]:
+    """把旧版简写格式转换为 cron 表达式，无法转换时返回 None"""
+    parts = schedule_str.split()
+
+    # */n：每 n 分钟
+    if len(parts) == 1 and parts[0].startswith('*/'):
+        interval = int(parts[0][2:])
+        if 0 < interval < 60 and 60 % interval == 0:
+            return f"*/{interval} * * * *"
+        if interval >= 60 and interval % 60 == 0 and 24 % (interval // 60) == 0:
+            return f"0 */{interval // 60} * * *"
+        return None
+
+    # HH:MM：每天特定时间
+    if len(parts) == 1 and ':' in parts[0]:
+        hour, minute = map(int, parts[0].split(':'))
+        return f"{minute} {hour} * * *"
+
+    # MM HH：每天特定时间
+    if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+        return f"{int(parts[0])} {int(parts[1])} * * *"
+
+    # HH:MM W：每周特定时间，旧格式 0 表示周一，cron 中 0 表示周日
+    if len(parts) == 2 and ':' in parts[0] and parts[1].isdigit():
+        hour, minute = map(int, parts[0].split(':'))
+        weekday = int(parts[1])
+        if not 0 <= weekday <= 6:
+            raise ValueError(f"无效的星期值: {weekday}")
+        return f"{minute} {hour} * * {(weekday + 1) % 7}"
+
+    # */n h-h：特定小时范围内每 n 分钟
+    if len(parts) == 2 and parts[0].startswith('*/') and '-' in parts[1]:
+        return f"{parts[0]} {parts[1]} * * *"
+
+    return None
+
+
+def parse_schedule(schedule_str: str):
+    """解析任务的调度配置，返回带 next_after 方法的调度对象；格式无效时抛出 ValueError"""
+    schedule_str = (schedule_str or '').strip()
+    if not schedule_str:
+        raise ValueError("未配置调度时间")
+    if len(schedule_str.split()) == 5:
+        return CronSchedule(schedule_str)
+
+    expression = convert_legacy(schedule_str)
+    if expression is not None:
+        return CronSchedule(expression)
+
+    parts = schedule_str.split()
+    if len(parts) == 1 and parts[0].startswith('*/') and parts[0][2:].isdigit():
+        return IntervalSchedule(int(parts[0][2:]))
+    raise ValueError(f"不支持的调度格式: {schedule_str}")
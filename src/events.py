@@ -0,0 +1,134 @@
+"""进程内的事件推送
+
+备份运行的开始、结束和传输进度发布到事件总线，Web 端通过 Server-Sent Events 订阅；
+没有订阅者时发布只做一次判断，不影响传输；订阅者处理不过来时丢弃最旧的事件，不阻塞发布方
+"""
+import json
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 每个订阅者最多缓存的事件数
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# 同一次运行两次进度事件之间的最小间隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+# 进度事件中最多列出的正在传输的文件数
+MAX_ACTIVE_FILES = 5
+
+
+class EventBus:
+    """发布/订阅事件总线"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: List[queue.Queue] = []
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self) -> queue.Queue:
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers = self._subscribers + [q]
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not q]
+
+    def publish(self, event_type: str, data: Dict):
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        event = (event_type, data)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # 慢速订阅者丢弃最旧的事件
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+
+def format_sse(event_type: str, data: Dict) -> str:
+    """格式化为 Server-Sent Events 消息"""
+    return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ProgressTracker:
+    """单次运行的传输进度
+
+    上传循环每发送一块调用 update，累计字节数并按 PROGRESS_INTERVAL 节流发布进度事件；
+    吞吐量按两次发布之间发送的字节数计算
+    """
+
+    def __init__(self, bus: EventBus, task_name: str, stats: Dict):
+        self.bus = bus
+        self.task_name = task_name
+        self.run_id: Optional[str] = None
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._files: Dict[str, Tuple[int, int]] = {}
+        self._bytes_sent = 0
+        self._last_publish = 0.0
+        self._last_bytes = 0
+        self.throughput = 0.0
+
+    def update(self, path: str, position: int, total: int, sent: int):
+        """记录文件 path 已发送到 position（共 total 字节），本次新发送 sent 字节"""
+        with self._lock:
+            self._bytes_sent += sent
+            self._files[path] = (position, total)
+        self.tick()
+
+    def finish(self, path: str):
+        """文件传输结束（成功、失败或取消）"""
+        with self._lock:
+            self._files.pop(path, None)
+
+    def tick(self, force: bool = False):
+        """距上次发布超过间隔时发布进度事件"""
+        now = time.time()
+        if not force and now - self._last_publish < PROGRESS_INTERVAL:
+            return
+        with self._lock:
+            elapsed = now - self._last_publish
+            if not force and elapsed < PROGRESS_INTERVAL:
+                return
+            if self._last_publish:
+                self.throughput = (self._bytes_sent - self._last_bytes) / max(elapsed, 0.001)
+            self._last_publish = now
+            self._last_bytes = self._bytes_sent
+            if not self.bus.has_subscribers():
+                return
+            files = [{'path': path, 'done': done, 'total': total}
+                     for path, (done, total) in list(self._files.items())[:MAX_ACTIVE_FILES]]
+            bytes_sent = self._bytes_sent
+        stats = self.stats
+        self.bus.publish('progress', {
+            'run_id': self.run_id,
+            'task_name': self.task_name,
+            'files_total': stats['total_files'],
+            'files_done': stats['success_files'] + stats['skipped_files'] + stats['failed_files'],
+            'bytes_total': stats['total_size'],
+            'bytes_done': stats['processed_size'],
+            'bytes_sent': bytes_sent,
+            'throughput_bps': round(self.throughput),
+            'throttled_seconds': round(stats['throttled_seconds'], 2),
+            'files': files,
+        })
+
+
+# 进程级事件总线
+_bus = EventBus()
+
+
+def get_event_bus() -> EventBus:
+    """获取进程级事件总线"""
+    return _bus
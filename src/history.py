@@ -1,50 +1,402 @@
 import os
 import json
-from typing import List, Dict
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Dict, Optional, Union
 import logging
 
-# 历史记录列表
-backup_history: List[Dict] = []
+# 历史记录数据库路径
+HISTORY_DB = os.path.join('logs', 'backup_history.db')
 
-# 历史记录文件路径
+# 旧版历史记录文件路径，首次打开数据库时导入
 HISTORY_FILE = os.path.join('logs', 'backup_history.json')
 
-def load_history():
-    """加载历史记录"""
-    global backup_history
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 每追加多少条记录检查一次保留策略
+RETENTION_CHECK_INTERVAL = 100
+
+# 一次清理删除超过多少条记录后回收数据库空间
+COMPACT_THRESHOLD = 1000
+
+# 汇总统计的时间粒度及对应的桶格式（本地时间，按字符串排序即按时间排序）
+ROLLUP_FORMATS = {
+    'hour': '%Y-%m-%d %H:00',
+    'day': '%Y-%m-%d',
+}
+
+# 按小时汇总的保留天数，按天汇总永久保留
+HOURLY_ROLLUP_DAYS = 90
+
+
+def parse_time(value: Union[str, float, int, None]) -> Optional[float]:
+    """把时间戳或 '2025-01-20'、'2025-01-20 16:11:53' 格式的时间转换为时间戳"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
     try:
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                backup_history = json.load(f)
-    except Exception as e:
-        logging.error(f"加载历史记录失败: {str(e)}")
-        backup_history = []
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in (TIME_FORMAT, '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"无法识别的时间: {value}")
+
+
+class HistoryStore:
+    """基于 SQLite 的备份历史记录
+
+    每条记录单独追加，按任务和时间建立索引，查询时只读取需要的部分；
+    写入记录时同时更新按小时和按天的分任务汇总，统计查询只读取汇总桶；
+    按保留天数和最大条数定期清理旧记录
+    """
+
+    def __init__(self, path: str = HISTORY_DB, retention_days: float = 365,
+                 max_records: int = 100000):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_records = max_records
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._since_check = 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # 需在建表前设置，之后才能用 incremental_vacuum 回收空间
+        self._conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_name TEXT NOT NULL,
+                ts REAL NOT NULL,
+                time TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                details TEXT,
+                files INTEGER NOT NULL DEFAULT 0,
+                size INTEGER NOT NULL DEFAULT 0,
+                duration REAL NOT NULL DEFAULT 0,
+                phases TEXT
+            )
+        """)
+        # 兼容没有统计字段的旧数据库
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(history)')}
+        for column, definition in (('files', 'INTEGER NOT NULL DEFAULT 0'),
+                                   ('size', 'INTEGER NOT NULL DEFAULT 0'),
+                                   ('duration', 'REAL NOT NULL DEFAULT 0'),
+                                   ('phases', 'TEXT')):
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE history ADD COLUMN {column} {definition}')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_history_ts ON history (ts)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_history_task_ts ON history (task_name, ts)')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rollups (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                task_name TEXT NOT NULL,
+                runs INTEGER NOT NULL,
+                success INTEGER NOT NULL,
+                failed INTEGER NOT NULL,
+                files INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                duration REAL NOT NULL,
+                PRIMARY KEY (granularity, bucket, task_name)
+            )
+        """)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def migrate_json(self, json_path: str):
+        """导入旧版 JSON 历史记录，导入后把原文件重命名为 .migrated"""
+        if not os.path.exists(json_path):
+            return
+        with self._lock:
+            migrated = self._conn.execute(
+                "SELECT value FROM meta WHERE key='migrated_json'").fetchone()
+            if migrated is None:
+                try:
+                    with open(json_path, 'r', encoding='utf-8') as f:
+                        records = json.load(f)
+                except Exception as e:
+                    self.logger.error(f"读取旧版历史记录失败: {str(e)}")
+                    return
+                rows = []
+                for record in records:
+                    try:
+                        ts = parse_time(record['time'])
+                    except (KeyError, ValueError):
+                        continue
+                    rows.append((record.get('task_name', ''), ts, record['time'],
+                                 1 if record.get('success') else 0, record.get('details', '')))
+                # 导入和标记在同一事务中，中途崩溃不会重复导入
+                with self._conn:
+                    self._conn.executemany(
+                        'INSERT INTO history (task_name, ts, time, success, details) VALUES (?, ?, ?, ?, ?)',
+                        rows)
+                    self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)",
+                                       (str(time.time()),))
+                    # 导入的记录需要重新计入汇总
+                    self._conn.execute("DELETE FROM meta WHERE key='rollups_built'")
+                self.logger.info(f"已导入 {len(rows)} 条旧版历史记录: {json_path}")
+        try:
+            os.replace(json_path, json_path + '.migrated')
+        except OSError as e:
+            self.logger.warning(f"重命名旧版历史记录文件失败: {str(e)}")
+
+    def add(self, task_name: str, success: bool, details: str, files: int = 0,
+            size: int = 0, duration: float = 0.0, ts: Optional[float] = None,
+            phases: Optional[Dict] = None) -> Dict:
+        """追加一条记录并更新汇总，files/size 为上传的文件数和字节数，duration 为耗时（秒），
+        phases 为各阶段耗时"""
+        ts = time.time() if ts is None else ts
+        record = {
+            'task_name': task_name,
+            'time': time.strftime(TIME_FORMAT, time.localtime(ts)),
+            'success': success,
+            'details': details
+        }
+        with self._lock:
+            # 记录和汇总在同一事务中更新
+            with self._conn:
+                cursor = self._conn.execute(
+                    'INSERT INTO history (task_name, ts, time, success, details, files, size, duration, '
+                    'phases) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (task_name, ts, record['time'], 1 if success else 0, details, files, size, duration,
+                     json.dumps(phases, ensure_ascii=False) if phases else None))
+                self._bump_rollups(task_name, ts, success, files, size, duration)
+            record['id'] = cursor.lastrowid
+            self._since_check += 1
+            check = self._since_check >= RETENTION_CHECK_INTERVAL
+            if check:
+                self._since_check = 0
+        if check:
+            self.apply_retention()
+        return record
+
+    def _bump_rollups(self, task_name: str, ts: float, success: bool, files: int,
+                      size: int, duration: float):
+        """把一条记录计入各粒度的汇总桶（需持有锁）"""
+        local = time.localtime(ts)
+        for granularity, fmt in ROLLUP_FORMATS.items():
+            self._conn.execute(
+                'INSERT INTO rollups (granularity, bucket, task_name, runs, success, failed, files, size, duration) '
+                'VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (granularity, bucket, task_name) DO UPDATE SET '
+                'runs = runs + 1, success = success + excluded.success, failed = failed + excluded.failed, '
+                'files = files + excluded.files, size = size + excluded.size, '
+                'duration = duration + excluded.duration',
+                (granularity, time.strftime(fmt, local), task_name,
+                 1 if success else 0, 0 if success else 1, files, size, duration))
+
+    def ensure_rollups(self):
+        """汇总表为空（新建或从旧版导入后）时根据已有记录重建"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key='rollups_built'").fetchone():
+                return
+            with self._conn:
+                self._conn.execute('DELETE FROM rollups')
+                rows = self._conn.execute(
+                    'SELECT task_name, ts, success, files, size, duration FROM history').fetchall()
+                for row in rows:
+                    self._bump_rollups(*row)
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollups_built', ?)",
+                                   (str(time.time()),))
+
+    @staticmethod
+    def _where(task_name: Optional[str], since: Optional[float], until: Optional[float],
+               success: Optional[bool] = None, before_id: Optional[int] = None,
+               after_id: Optional[int] = None):
+        clauses, params = [], []
+        if task_name:
+            clauses.append('task_name = ?')
+            params.append(task_name)
+        if since is not None:
+            clauses.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('ts < ?')
+            params.append(until)
+        if success is not None:
+            clauses.append('success = ?')
+            params.append(1 if success else 0)
+        if before_id is not None:
+            clauses.append('id < ?')
+            params.append(before_id)
+        if after_id is not None:
+            clauses.append('id > ?')
+            params.append(after_id)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, limit: Optional[int] = None, offset: int = 0,
+              task_name: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None, newest_first: bool = False,
+              success: Optional[bool] = None, before_id: Optional[int] = None,
+              after_id: Optional[int] = None) -> List[Dict]:
+        """按条件查询记录
+
+        since/until 为时间戳（含 since，不含 until）；记录 id 按写入顺序递增，
+        before_id/after_id 用作翻页和增量查询的游标
+        """
+        where, params = self._where(task_name, since, until, success, before_id, after_id)
+        order = 'DESC' if newest_first else 'ASC'
+        sql = (f'SELECT id, task_name, time, success, details, phases FROM history{where} '
+               f'ORDER BY id {order} LIMIT ? OFFSET ?')
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        records = []
+        for row in rows:
+            record = {'id': row[0], 'task_name': row[1], 'time': row[2],
+                      'success': bool(row[3]), 'details': row[4]}
+            if row[5]:
+                record['phases'] = json.loads(row[5])
+            records.append(record)
+        return records
+
+    def count(self, task_name: Optional[str] = None, since: Optional[float] = None,
+              until: Optional[float] = None) -> int:
+        where, params = self._where(task_name, since, until)
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM history{where}', params).fetchone()[0]
 
-def save_history():
-    """保存历史记录"""
+    def bounds(self):
+        """最小和最大记录 id，只在追加或清理记录时变化，可作为数据版本"""
+        with self._lock:
+            return self._conn.execute('SELECT MIN(id), MAX(id) FROM history').fetchone()
+
+    def rollups(self, granularity: str = 'day', since: Optional[float] = None,
+                until: Optional[float] = None, task_name: Optional[str] = None) -> List[Dict]:
+        """按桶返回汇总统计，since/until 对齐到所在的桶（含 since 所在桶，不含 until 所在桶）"""
+        fmt = ROLLUP_FORMATS[granularity]
+        clauses, params = ['granularity = ?'], [granularity]
+        if task_name:
+            clauses.append('task_name = ?')
+            params.append(task_name)
+        if since is not None:
+            clauses.append('bucket >= ?')
+            params.append(time.strftime(fmt, time.localtime(since)))
+        if until is not None:
+            clauses.append('bucket < ?')
+            params.append(time.strftime(fmt, time.localtime(until)))
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT bucket, task_name, runs, success, failed, files, size, duration FROM rollups '
+                f'WHERE {" AND ".join(clauses)} ORDER BY bucket, task_name', params).fetchall()
+        return [{'bucket': row[0], 'task_name': row[1], 'runs': row[2], 'success': row[3],
+                 'failed': row[4], 'files': row[5], 'size': row[6], 'duration': round(row[7], 2)}
+                for row in rows]
+
+    def apply_retention(self) -> int:
+        """删除超过保留天数或超出最大条数的最旧记录，返回删除的条数"""
+        deleted = 0
+        with self._lock:
+            if self.retention_days and self.retention_days > 0:
+                cutoff = time.time() - self.retention_days * 86400
+                deleted += self._conn.execute('DELETE FROM history WHERE ts < ?', (cutoff,)).rowcount
+            if self.max_records and self.max_records > 0:
+                deleted += self._conn.execute(
+                    'DELETE FROM history WHERE id IN ('
+                    'SELECT id FROM history ORDER BY ts DESC, id DESC LIMIT -1 OFFSET ?)',
+                    (self.max_records,)).rowcount
+            # 汇总不随记录删除，只清理过期的小时桶
+            hourly_cutoff = time.localtime(time.time() - HOURLY_ROLLUP_DAYS * 86400)
+            self._conn.execute("DELETE FROM rollups WHERE granularity='hour' AND bucket < ?",
+                               (time.strftime(ROLLUP_FORMATS['hour'], hourly_cutoff),))
+            self._conn.commit()
+        if deleted:
+            self.logger.info(f"按保留策略清理了 {deleted} 条历史记录")
+        if deleted >= COMPACT_THRESHOLD:
+            self.compact()
+        return deleted
+
+    def compact(self):
+        """回收已删除记录占用的空间并合并 WAL 文件"""
+        with self._lock:
+            self._conn.execute('PRAGMA incremental_vacuum')
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+# 全局历史记录存储，首次使用时打开
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+_options: Dict = {}
+
+
+def configure_history(options: Optional[Dict]):
+    """设置保留策略（配置文件中的 history 部分）"""
+    global _options
+    _options = dict(options or {})
+    with _store_lock:
+        if _store is not None:
+            _store.retention_days = float(_options.get('retention_days', 365))
+            _store.max_records = int(_options.get('max_records', 100000))
+    if _store is not None:
+        _store.apply_retention()
+
+
+def get_store() -> HistoryStore:
+    """获取历史记录存储，首次调用时打开数据库并导入旧版 JSON 记录"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            store = HistoryStore(HISTORY_DB,
+                                 retention_days=float(_options.get('retention_days', 365)),
+                                 max_records=int(_options.get('max_records', 100000)))
+            store.migrate_json(HISTORY_FILE)
+            store.ensure_rollups()
+            store.apply_retention()
+            _store = store
+        return _store
+
+
+def add_history_record(task_name: str, success: bool, details: str, files: int = 0,
+                       size: int = 0, duration: float = 0.0, phases: Optional[Dict] = None):
+    """添加历史记录"""
     try:
-        # 确保目录存在
-        os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(backup_history, f, ensure_ascii=False, indent=2)
+        get_store().add(task_name, success, details, files, size, duration, phases=phases)
     except Exception as e:
         logging.error(f"保存历史记录失败: {str(e)}")
 
-def add_history_record(task_name: str, success: bool, details: str):
-    """添加历史记录"""
-    from datetime import datetime
-    record = {
-        'task_name': task_name,
-        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'success': success,
-        'details': details
-    }
-    backup_history.append(record)
-    save_history()
-
-def get_history() -> List[Dict]:
-    """获取历史记录"""
-    return backup_history
-
-# 初始化时加载历史记录
-load_history() 
\ No newline at end of file
+
+def get_history(limit: Optional[int] = None, offset: int = 0,
+                task_name: Optional[str] = None, since: Optional[float] = None,
+                until: Optional[float] = None, newest_first: bool = False,
+                **filters) -> List[Dict]:
+    """获取历史记录，默认按时间从旧到新返回全部
+
+    filters 可包含 success、before_id、after_id，见 HistoryStore.query
+    """
+    return get_store().query(limit, offset, task_name, since, until, newest_first, **filters)
+
+
+def history_version():
+    """历史记录的版本 (最小 id, 最大 id)，用于生成 ETag"""
+    return get_store().bounds()
+
+
+def count_history(task_name: Optional[str] = None, since: Optional[float] = None,
+                  until: Optional[float] = None) -> int:
+    """符合条件的历史记录条数"""
+    return get_store().count(task_name, since, until)
+
+
+def get_rollups(granularity: str = 'day', since: Optional[float] = None,
+                until: Optional[float] = None, task_name: Optional[str] = None) -> List[Dict]:
+    """按小时或按天的分任务汇总统计"""
+    return get_store().rollups(granularity, since, until, task_name)
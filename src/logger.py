@@ -1,20 +1,101 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
-from typing import Dict
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
+
+# 后台写日志的队列长度，写入跟不上时调用方阻塞等待，不丢日志
+LOG_QUEUE_SIZE = 10000
+
+# 读取日志文件尾部时每次向前读取的块大小
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# 当前的后台写日志线程，重新配置时先停止旧的
+_listener: Optional[QueueListener] = None
+
+
+class LazyText:
+    """日志参数的延迟求值，只有日志确实输出时才调用 func(*args) 生成文本"""
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，便于日志收集系统解析"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+                    + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# 在调用线程中把异常堆栈转成文本，用于放入队列的日志记录
+_EXC_FORMATTER = logging.Formatter()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """把日志记录原样放入队列，消息和格式化都在后台线程中生成
+
+    标准 QueueHandler.prepare 会在调用线程中格式化消息，并把异常信息折叠进 msg；
+    这里只在调用线程中把异常堆栈转成文本缓存到 exc_text（不持有栈帧），
+    日志参数在后台线程中求值，因此参数在记录后不应再被修改
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
 
 def setup_logger(config: Dict) -> logging.Logger:
-    """配置日志系统"""
+    """配置日志系统
+    
+    调用方只把日志记录放入队列，由后台线程写文件和控制台，慢速磁盘不会拖慢传输；
+    config 中 format 为 json 时每行输出一个 JSON 对象，async 为 false 时直接同步写入
+    """
+    global _listener
     # 创建日志目录
     log_file = config.get('file', 'logs/backup.log')
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    level = config.get('level', 'INFO')
     
     # 创建logger
     logger = logging.getLogger()  # 使用root logger
-    logger.setLevel(config.get('level', 'INFO'))
+    logger.setLevel(level)
     
-    # 清除现有的处理器
+    # 清除现有的处理器，停止之前的后台写日志线程
     logger.handlers.clear()
+    _stop_listener()
     
     # 文件处理器 - 支持日志轮转
     file_handler = RotatingFileHandler(
@@ -28,18 +109,66 @@ def setup_logger(config: Dict) -> logging.Logger:
     console_handler = logging.StreamHandler()
     
     # 设置格式
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    if config.get('format', 'text') == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
     
     # 设置处理器的日志级别
-    file_handler.setLevel(config.get('level', 'INFO'))
-    console_handler.setLevel(config.get('level', 'INFO'))
+    file_handler.setLevel(level)
+    console_handler.setLevel(level)
     
     # 添加处理器
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if config.get('async', True):
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _listener = QueueListener(log_queue, file_handler, console_handler,
+                                  respect_handler_level=True)
+        _listener.start()
+        logger.addHandler(_DeferredQueueHandler(log_queue))
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
     
-    return logger 
\ No newline at end of file
+    return logger
+
+
+# 进程退出前写完队列中剩余的日志
+atexit.register(_stop_listener)
+
+
+def tail_log(path: str, lines: int) -> Tuple[List[str], int]:
+    """从文件末尾按块向前读取最后 lines 行，返回 (行列表, 已读到的偏移)
+
+    只读取包含这些行的末尾部分，不把整个日志文件读入内存；
+    末尾尚未写完的半行不返回，偏移停在最后一个换行符之后
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        position = end
+        data = b''
+        while position > 0 and data.count(b'\n') <= lines:
+            step = min(TAIL_BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    complete = data.rfind(b'\n') + 1
+    offset = end - (len(data) - complete)
+    result = data[:complete].decode('utf-8', 'replace').splitlines()
+    return result[-lines:] if lines else [], offset
+
+
+def read_log_from(path: str, offset: int, max_bytes: int) -> Tuple[List[str], int]:
+    """读取 offset 之后新写入的完整行（最多 max_bytes 字节），返回 (行列表, 新的偏移)"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(max_bytes)
+    complete = data.rfind(b'\n') + 1
+    if not complete and len(data) == max_bytes:
+        # 单行超过 max_bytes 时按字节截断返回
+        complete = len(data)
+    return data[:complete].decode('utf-8', 'replace').splitlines(), offset + complete
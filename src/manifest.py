@@ -0,0 +1,150 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from typing import Optional
+
+# 清单数据库目录
+MANIFEST_DIR = os.path.join('logs', 'manifest')
+
+# 批量提交的记录数，减少 SQLite 事务开销
+COMMIT_BATCH = 500
+
+# 文件比对结果
+UNKNOWN = 'unknown'      # 清单中没有记录，需要检查远程
+UNCHANGED = 'unchanged'  # 与上次上传时一致，可直接跳过
+TOUCHED = 'touched'      # 仅修改时间变化，内容哈希一致
+CHANGED = 'changed'      # 已变化，需要上传
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BackupManifest:
+    """本地备份清单
+
+    按任务保存在 logs/manifest/<任务名>.db 中，记录每个文件上次成功上传时的
+    大小、修改时间和可选的内容哈希。未变化的文件可直接跳过，无需访问远程服务器
+    """
+
+    def __init__(self, task_name: str, target: str, use_hash: bool = False,
+                 manifest_dir: str = MANIFEST_DIR):
+        self.task_name = task_name
+        self.target = target  # 目标标识: 服务器名|远程路径
+        self.use_hash = use_hash
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        os.makedirs(manifest_dir, exist_ok=True)
+        safe_name = re.sub(r'[^\w.-]', '_', task_name)
+        self.path = os.path.join(manifest_dir, f"{safe_name}.db")
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                target TEXT NOT NULL,
+                remote_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT,
+                uploaded_at REAL NOT NULL,
+                PRIMARY KEY (target, remote_path)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                target TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (target, key)
+            )
+        """)
+        self._conn.commit()
+
+    def check(self, local_path: str, remote_path: str, size: int, mtime: float) -> str:
+        """根据清单判断本地文件相对上次上传是否变化"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, mtime, hash FROM files WHERE target=? AND remote_path=?',
+                (self.target, remote_path)).fetchone()
+        if row is None:
+            return UNKNOWN
+        old_size, old_mtime, old_hash = row
+        if old_size != size:
+            return CHANGED
+        if old_mtime == mtime:
+            return UNCHANGED
+        if self.use_hash and old_hash:
+            try:
+                if file_hash(local_path) == old_hash:
+                    return TOUCHED
+            except OSError as e:
+                self.logger.debug(f"计算文件哈希失败: {local_path}: {str(e)}")
+        return CHANGED
+
+    def record(self, local_path: str, remote_path: str, size: int, mtime: float,
+               content_hash: Optional[str] = None):
+        """记录一次成功上传（或确认远程已是最新）"""
+        if self.use_hash and content_hash is None:
+            try:
+                content_hash = file_hash(local_path)
+            except OSError as e:
+                self.logger.debug(f"计算文件哈希失败: {local_path}: {str(e)}")
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (target, remote_path, size, mtime, hash, uploaded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.target, remote_path, size, mtime, content_hash, time.time()))
+            self._pending += 1
+            if self._pending >= COMMIT_BATCH:
+                self._conn.commit()
+                self._pending = 0
+
+    def forget(self, remote_path: str):
+        """删除某个文件的记录，下次运行时重新检查远程"""
+        with self._lock:
+            self._conn.execute('DELETE FROM files WHERE target=? AND remote_path=?',
+                               (self.target, remote_path))
+            self._pending += 1
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE target=? AND key=?',
+                                     (self.target, key)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO meta (target, key, value) VALUES (?, ?, ?)',
+                               (self.target, key, value))
+            self._conn.commit()
+
+    def reconcile_due(self, interval_hours: float) -> bool:
+        """距上次与远程核对是否已超过指定小时数（0 表示不定期核对）"""
+        if not interval_hours:
+            return False
+        last = self._get_meta('last_reconcile')
+        return last is None or time.time() - float(last) >= interval_hours * 3600
+
+    def mark_reconciled(self):
+        """记录本次与远程核对完成的时间"""
+        self._set_meta('last_reconcile', str(time.time()))
+
+    def close(self):
+        """提交未写入的记录并关闭数据库"""
+        with self._lock:
+            try:
+                self._conn.commit()
+            finally:
+                self._conn.close()
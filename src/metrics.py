@@ -0,0 +1,228 @@
+"""进程内的运行指标
+
+计数器和直方图保存在内存中，/metrics 以 Prometheus 文本格式输出；
+记录一次样本只是一次字典查找、一次二分查找和几次加法，可以在每个文件的处理路径上调用
+"""
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+# 单个请求、单个文件的耗时分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# 整次运行、整次扫描的耗时分桶（秒）
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0,
+                    1800.0, 3600.0, 7200.0, 21600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # 最后一个位置对应 +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """按标签值取得子指标，首次出现的标签组合才加锁创建"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}")
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+                for key, child in sorted(self._children.items())]
+
+
+class Histogram(_Metric):
+    """按上限分桶的样本分布"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in sorted(self._children.items()):
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，按注册顺序输出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# 进程级指标注册表
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """获取进程级指标注册表"""
+    return _registry
+
+
+FILES_UPLOADED = _registry.counter(
+    'backup_files_uploaded_total', '上传成功的文件数', ('task', 'server'))
+FILES_SKIPPED = _registry.counter(
+    'backup_files_skipped_total', '已是最新而跳过的文件数', ('task', 'server'))
+FILES_FAILED = _registry.counter(
+    'backup_files_failed_total', '上传失败的文件数', ('task', 'server'))
+BYTES_UPLOADED = _registry.counter(
+    'backup_bytes_uploaded_total', '上传成功的文件大小（字节）', ('task', 'server'))
+BYTES_SENT = _registry.counter(
+    'backup_bytes_sent_total', '实际发送的字节数（增量传输、打包传输时与文件大小不同）', ('task', 'server'))
+RUNS = _registry.counter(
+    'backup_runs_total', '备份运行次数', ('task', 'server', 'result'))
+UPLOAD_SECONDS = _registry.histogram(
+    'backup_upload_seconds', '单个文件的上传耗时（秒）', ('server',))
+CONNECT_SECONDS = _registry.histogram(
+    'backup_connect_seconds', '建立 SSH/SFTP 连接的耗时（秒）', ('server',))
+REMOTE_STAT_SECONDS = _registry.histogram(
+    'backup_remote_stat_seconds', '获取远程文件信息的耗时（秒）', ('server', 'op'))
+RUN_SECONDS = _registry.histogram(
+    'backup_run_seconds', '整次备份运行的耗时（秒）', ('task', 'server'), DURATION_BUCKETS)
+SCAN_SECONDS = _registry.histogram(
+    'backup_scan_seconds', '扫描源目录的耗时（秒）', ('task',), DURATION_BUCKETS)
+
+# 运行统计项与计数器的对应关系，BackupRun.update_stats 累加统计时同步增加计数器
+STAT_COUNTERS = {
+    'success_files': FILES_UPLOADED,
+    'skipped_files': FILES_SKIPPED,
+    'failed_files': FILES_FAILED,
+    'uploaded_size': BYTES_UPLOADED,
+    'transferred_size': BYTES_SENT,
+}
+
+
+def run_counters(task_name: str, server_name: str) -> Dict[str, _CounterChild]:
+    """一次运行使用的计数器，统计项名 -> 带任务和服务器标签的计数器"""
+    return {key: counter.labels(task_name, server_name) for key, counter in STAT_COUNTERS.items()}
@@ -0,0 +1,203 @@
+"""分阶段的流式处理引擎
+
+数据源在调用线程中逐项产出，各阶段之间用有界队列连接：下游处理不过来时上游阻塞（背压），
+无论数据量多大，内存占用都只与队列长度有关；各阶段同时运行，扫描尚未结束传输就已开始
+"""
+import time
+import queue
+import threading
+import logging
+from contextlib import ExitStack
+from typing import Callable, Dict, Iterable, List, Optional
+
+# 阶段结束标记
+_DONE = object()
+
+
+class StageStats:
+    """单个阶段的计数"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0     # 已处理的项数
+        self.emitted = 0       # 传给下一阶段的项数
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0  # 输入队列的峰值深度
+        self._lock = threading.Lock()
+
+    def add(self, processed: int = 0, emitted: int = 0, errors: int = 0, busy: float = 0.0):
+        with self._lock:
+            self.processed += processed
+            self.emitted += emitted
+            self.errors += errors
+            self.busy_seconds += busy
+
+    def to_dict(self, elapsed: float) -> Dict:
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'processed': self.processed,
+            'emitted': self.emitted,
+            'errors': self.errors,
+            'per_sec': round(self.processed / max(elapsed, 0.001), 2),
+            'busy_seconds': round(self.busy_seconds, 2),
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+
+class Stage:
+    """一个处理阶段
+
+    handler(state, item, emit) 处理一项，调用 emit 把结果传给下一阶段（可多次或不调用）；
+    open_worker(index) 为每个工作线程创建状态（如独立的 SFTP 通道），
+    close_worker(state, emit) 在线程结束前调用，可用于发送累积的批次
+    """
+
+    def __init__(self, name: str, handler: Callable, workers: int = 1,
+                 queue_size: int = 256, open_worker: Optional[Callable] = None,
+                 close_worker: Optional[Callable] = None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.queue = queue.Queue(maxsize=max(queue_size, 1))
+        self.open_worker = open_worker
+        self.close_worker = close_worker
+        self.stats = StageStats(name, self.workers)
+        self._remaining = self.workers
+        self._lock = threading.Lock()
+
+
+class Pipeline:
+    """由数据源和若干阶段组成的流水线"""
+
+    def __init__(self, name: str, source_name: str = 'scan',
+                 worker_context: Optional[Callable] = None):
+        self.name = name
+        self.source_stats = StageStats(source_name, 1)
+        self.stages: List[Stage] = []
+        # 每个工作线程在 worker_context() 返回的上下文中运行（用于性能剖析），None 表示不需要
+        self.worker_context = worker_context
+        self.elapsed = 0.0
+        self.logger = logging.getLogger(__name__)
+
+    def add_stage(self, name: str, handler: Callable, **kwargs) -> Stage:
+        stage = Stage(name, handler, **kwargs)
+        self.stages.append(stage)
+        return stage
+
+    @property
+    def errors(self) -> int:
+        return sum(stage.stats.errors for stage in self.stages) + self.source_stats.errors
+
+    def stats(self) -> List[Dict]:
+        """各阶段的吞吐量和队列深度"""
+        return [s.to_dict(self.elapsed) for s in
+                [self.source_stats] + [stage.stats for stage in self.stages]]
+
+    def _put(self, stage: Stage, item):
+        """放入阶段的输入队列，队列满时阻塞"""
+        stage.queue.put(item)
+        depth = stage.queue.qsize()
+        if depth > stage.stats.max_queue_depth:
+            stage.stats.max_queue_depth = depth
+
+    def _emitter(self, index: int, stats: StageStats) -> Callable:
+        """生成把结果传给第 index 个阶段的函数，最后一个阶段的结果直接丢弃"""
+        if index >= len(self.stages):
+            return lambda item: None
+        next_stage = self.stages[index]
+
+        def emit(item):
+            stats.add(emitted=1)
+            self._put(next_stage, item)
+        return emit
+
+    def _worker(self, index: int, worker_index: int):
+        stage = self.stages[index]
+        emit = self._emitter(index + 1, stage.stats)
+        state = None
+        finished = False  # 是否已取到本线程的结束标记
+        context = ExitStack()
+        try:
+            if self.worker_context is not None:
+                context.enter_context(self.worker_context())
+            if stage.open_worker is not None:
+                state = stage.open_worker(worker_index)
+            while True:
+                item = stage.queue.get()
+                if item is _DONE:
+                    finished = True
+                    break
+                start = time.perf_counter()
+                try:
+                    stage.handler(state, item, emit)
+                    stage.stats.add(processed=1, busy=time.perf_counter() - start)
+                except Exception as e:
+                    stage.stats.add(processed=1, errors=1, busy=time.perf_counter() - start)
+                    self.logger.error(f"{self.name} 阶段 {stage.name} 处理失败: {str(e)}", exc_info=True)
+            if stage.close_worker is not None:
+                try:
+                    stage.close_worker(state, emit)
+                except Exception as e:
+                    # 如发送最后一个批次失败，计为本阶段的错误
+                    stage.stats.add(errors=1)
+                    self.logger.error(f"{self.name} 阶段 {stage.name} 收尾失败: {str(e)}", exc_info=True)
+        except Exception as e:
+            stage.stats.add(errors=1)
+            self.logger.error(f"{self.name} 阶段 {stage.name} 工作线程出错: {str(e)}", exc_info=True)
+            # 继续消费输入直到结束标记，避免上游在满队列上永久阻塞；
+            # 已取到结束标记时不能再取，否则会永久阻塞或取走同阶段其他线程的结束标记
+            if not finished:
+                while stage.queue.get() is not _DONE:
+                    stage.stats.add(errors=1)
+        finally:
+            try:
+                context.close()
+            except Exception as e:
+                self.logger.error(f"{self.name} 阶段 {stage.name} 退出工作线程上下文失败: {str(e)}")
+            with stage._lock:
+                stage._remaining -= 1
+                last = stage._remaining == 0
+            # 本阶段最后一个线程结束后通知下一阶段
+            if last and index + 1 < len(self.stages):
+                next_stage = self.stages[index + 1]
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(_DONE)
+
+    def run(self, source: Iterable):
+        """运行流水线，数据源在当前线程中迭代，全部阶段处理完后返回"""
+        start = time.time()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(index, worker_index),
+                                          name=f"{self.name}-{stage.name}-{worker_index}",
+                                          daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        emit = self._emitter(0, self.source_stats)
+        try:
+            iterator = iter(source)
+            while True:
+                pull_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    # 数据源结束前的最后一段（或取消时的收尾）同样计入耗时
+                    self.source_stats.add(busy=time.perf_counter() - pull_start)
+                    break
+                self.source_stats.add(processed=1, busy=time.perf_counter() - pull_start)
+                emit(item)
+        except Exception as e:
+            self.source_stats.add(errors=1)
+            self.logger.error(f"{self.name} 数据源出错: {str(e)}", exc_info=True)
+        finally:
+            if self.stages:
+                for _ in range(self.stages[0].workers):
+                    self.stages[0].queue.put(_DONE)
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.time() - start
@@ -0,0 +1,231 @@
+"""备份运行的分阶段计时和性能剖析
+
+PhaseTimer 按阶段（扫描、远程 stat、建目录、上传、改修改时间、写历史记录等）累计耗时，
+结果写入运行总结和历史记录；RunProfiler 只在任务配置 profile 或手动触发时指定 profile 时创建，
+对一次运行的协调线程和流水线工作线程做 cProfile 或采样剖析，结果保存在 logs/profiles 下，
+未开启时不产生任何额外开销
+"""
+import os
+import sys
+import time
+import cProfile
+import pstats
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+# 剖析结果的保存目录
+PROFILE_DIR = os.path.join('logs', 'profiles')
+
+# 采样剖析的采样间隔（秒）
+SAMPLE_INTERVAL = 0.005
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+# Python 3.12 起 cProfile 基于 sys.monitoring：同一进程只能启用一个剖析器，它同时覆盖所有线程；
+# 之前的版本每个剖析器只覆盖启用它的线程
+_PROCESS_WIDE_CPROFILE = sys.version_info >= (3, 12)
+
+
+class PhaseTimer:
+    """按阶段累计耗时和次数，多个线程同时处于同一阶段时耗时相加"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, List] = {}
+
+    def add(self, phase: str, seconds: float, count: int = 1):
+        with self._lock:
+            entry = self._totals.get(phase)
+            if entry is None:
+                entry = self._totals[phase] = [0.0, 0]
+            entry[0] += seconds
+            entry[1] += count
+
+    @contextmanager
+    def measure(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def summary(self) -> Dict[str, Dict]:
+        """阶段 -> {seconds, count}，按耗时从多到少排列"""
+        with self._lock:
+            items = sorted(self._totals.items(), key=lambda item: item[1][0], reverse=True)
+            return {phase: {'seconds': round(seconds, 3), 'count': count}
+                    for phase, (seconds, count) in items}
+
+
+class _NullPhaseTimer:
+    """不计时的 PhaseTimer，调用方未提供计时器时使用"""
+
+    def add(self, phase: str, seconds: float, count: int = 1):
+        pass
+
+    def measure(self, phase: str):
+        return nullcontext()
+
+
+NULL_PHASES = _NullPhaseTimer()
+
+
+def profile_mode(value) -> Optional[str]:
+    """把任务配置或请求中的 profile 值规范为剖析方式，true 表示 cprofile，false 或空表示不剖析"""
+    if value is None or value is False or value == '':
+        return None
+    if value is True:
+        return 'cprofile'
+    mode = str(value).strip().lower()
+    if mode in ('true', '1', 'yes'):
+        return 'cprofile'
+    if mode in ('false', '0', 'no', 'none'):
+        return None
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"不支持的剖析方式: {value}（可选 {', '.join(PROFILE_MODES)}）")
+    return mode
+
+
+class RunProfiler:
+    """剖析一次备份运行
+
+    cprofile: Python 3.12 起整个运行只用一个 cProfile.Profile（会同时计入同一时间其他运行的线程），
+              之前的版本每个参与运行的线程各用一个，结束后合并保存为 .pstats，
+              可用 python -m pstats 或 snakeviz 查看；已有其他剖析器在运行时改用 sample
+    sample:   后台线程定时采集参与运行的线程的调用栈，保存为折叠栈格式 .folded，
+              可用 flamegraph.pl 或 speedscope 生成火焰图；开销比 cprofile 小，时间分布更接近实际
+    """
+
+    def __init__(self, mode: str, task_name: str, directory: str = PROFILE_DIR):
+        self.mode = mode
+        self.task_name = task_name
+        self.directory = directory
+        self.path = None
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+        # 3.12 之前每个线程一个 Profile，线程多次进入 thread_context 时继续累计
+        self._thread_profiles: Dict[int, cProfile.Profile] = {}
+        self._threads = set()
+        self._stacks = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._main_profile = None
+        self._main_thread = None
+
+    @staticmethod
+    def _enable_profile() -> Optional[cProfile.Profile]:
+        """创建并启用 cProfile.Profile，已有其他剖析器在运行时返回 None"""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        return profile
+
+    def start(self):
+        """开始剖析，调用线程（运行的协调线程）一并剖析"""
+        if self.mode == 'cprofile':
+            self._main_profile = self._enable_profile()
+            if self._main_profile is None:
+                self.logger.warning(f"已有其他剖析器在运行，改用采样剖析: {self.task_name}")
+                self.mode = 'sample'
+            else:
+                self._profiles.append(self._main_profile)
+        self._main_thread = threading.get_ident()
+        with self._lock:
+            self._threads.add(self._main_thread)
+        if self.mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample_loop, name='profiler-sampler',
+                                             daemon=True)
+            self._sampler.start()
+
+    @contextmanager
+    def thread_context(self):
+        """在参与运行的线程中使用，线程内的执行计入剖析结果
+
+        可在同一线程中反复进入（如扫描线程池按目录进入），开销只有一次登记和启停
+        """
+        ident = threading.get_ident()
+        profile = None
+        with self._lock:
+            self._threads.add(ident)
+        if self.mode == 'cprofile' and not _PROCESS_WIDE_CPROFILE:
+            profile = self._thread_profiles.get(ident)
+            if profile is not None:
+                profile.enable()
+            else:
+                profile = self._enable_profile()
+                if profile is not None:
+                    with self._lock:
+                        self._thread_profiles[ident] = profile
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._threads.discard(ident)
+
+    def _sample_loop(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            with self._lock:
+                threads = set(self._threads)
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(stack))] += 1
+            self._samples += 1
+
+    def _unique_path(self, suffix: str) -> str:
+        """按任务名和时间命名，同一秒内多次运行时加序号"""
+        base = os.path.join(self.directory, f"{self.task_name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        path, index = base + suffix, 1
+        while os.path.exists(path):
+            path = f"{base}-{index}{suffix}"
+            index += 1
+        return path
+
+    def stop(self) -> Optional[str]:
+        """结束剖析并保存结果，返回文件路径（需在调用 start 的线程中调用）"""
+        if self._main_profile is not None:
+            self._main_profile.disable()
+            self._main_profile = None
+        with self._lock:
+            self._threads.discard(self._main_thread)
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.path = self._unique_path('.pstats' if self.mode == 'cprofile' else '.folded')
+            if self.mode == 'cprofile':
+                with self._lock:
+                    profiles = self._profiles + list(self._thread_profiles.values())
+                stats = pstats.Stats(profiles[0])
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                stats.dump_stats(self.path)
+            else:
+                with open(self.path, 'w', encoding='utf-8') as f:
+                    for stack, count in self._stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+            if self.mode == 'sample':
+                self.logger.info(f"性能剖析结果已保存: {self.path} (采样 {self._samples} 次)")
+            else:
+                self.logger.info(f"性能剖析结果已保存: {self.path}")
+        except Exception as e:
+            self.logger.error(f"保存性能剖析结果失败: {str(e)}")
+            self.path = None
+        return self.path
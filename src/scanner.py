@@ -0,0 +1,83 @@
+"""基于 os.scandir 的目录扫描
+
+每个文件只做一次 stat（Windows 上 DirEntry.stat 直接使用目录枚举返回的信息，不产生额外系统调用），
+stat 结果随文件一起向后传递，后续的比对、上传和设置修改时间都不再重复 stat；
+workers 大于 1 时用线程池并发扫描子目录，适合网络共享和慢速磁盘
+"""
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 一个目录的扫描结果: (目录路径, [(文件名, stat 结果)], [子目录路径])
+ScanResult = Tuple[str, List[Tuple[str, Optional[os.stat_result]]], List[str]]
+
+
+def scan_dir(path: str) -> ScanResult:
+    """扫描单个目录，返回其中的文件及 stat 结果和需要继续扫描的子目录
+
+    与 os.walk 一致：指向目录的符号链接不进入；无法 stat 的文件（如失效的链接）
+    stat 结果为 None，由调用方按文件错误处理
+    """
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                    continue
+                try:
+                    files.append((entry.name, entry.stat()))
+                except OSError:
+                    files.append((entry.name, None))
+    except OSError as e:
+        # 与 os.walk 默认行为一致，无法读取的目录直接跳过
+        logger.debug(f"无法扫描目录: {path}: {str(e)}")
+    return path, files, subdirs
+
+
+def _scan_in_context(worker_context: Callable, path: str) -> ScanResult:
+    with worker_context():
+        return scan_dir(path)
+
+
+def scan_tree(top: str, workers: int = 1,
+              worker_context: Optional[Callable] = None) -> Iterator[Tuple[str, List[Tuple[str, Optional[os.stat_result]]]]]:
+    """遍历目录树，逐个目录产出 (目录路径, [(文件名, stat 结果)])
+
+    workers 为 1 时在调用线程中按深度优先顺序扫描；大于 1 时并发扫描，目录的产出顺序不固定，
+    线程池中每个目录的扫描在 worker_context() 返回的上下文中进行（用于性能剖析），None 表示不需要
+    """
+    if workers <= 1:
+        stack = [top]
+        while stack:
+            path, files, subdirs = scan_dir(stack.pop())
+            yield path, files
+            # 反序入栈，保持与 os.walk 相近的顺序
+            stack.extend(reversed(subdirs))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan') as pool:
+        def submit(path: str):
+            if worker_context is None:
+                return pool.submit(scan_dir, path)
+            return pool.submit(_scan_in_context, worker_context, path)
+
+        pending = {submit(top)}
+        backlog: List[str] = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, files, subdirs = future.result()
+                backlog.extend(subdirs)
+                yield path, files
+            # 控制同时排队的目录数，避免超大目录树一次性提交过多任务
+            while backlog and len(pending) < workers * 4:
+                pending.add(submit(backlog.pop()))
@@ -1,8 +1,13 @@
-import schedule
+import heapq
+import threading
 import time
+from datetime import datetime
 from typing import Dict
 import logging
 from src.backup_manager import BackupManager
+from src.cron import parse_schedule
+from src.task_runner import TaskRunner
+from src.watcher import WatchService
 
 class BackupScheduler:
     def __init__(self, config: Dict):
@@ -12,117 +17,118 @@ class BackupScheduler:
             config['backup_tasks']
         )
         self.logger = logging.getLogger(__name__)
-        # 添加任务运行状态跟踪
-        self.running_tasks = set()
-        
+        # 并发执行任务的工作线程池，运行登记表记录排队和运行状态
+        self.runner = TaskRunner(self.backup_manager, config.get('concurrency'))
+        self.registry = self.runner.registry
+        # 开启 watch 的任务按文件变化触发增量备份
+        self.watcher = WatchService(self.runner)
+        # 按下次执行时间排序的堆: (时间戳, 序号, 任务名)
+        self._heap = []
+        self._schedules = {}
+        # 各任务当前生效的调度表达式，重新加载时据此判断哪些任务需要调整
+        self._exprs = {}
+        self._seq = 0
+        # 串行化重新加载，避免并发的配置修改交错调整堆
+        self._reload_lock = threading.Lock()
+        # 任务增删改时唤醒调度线程重新计算等待时间
+        self._cond = threading.Condition()
+    
     def _run_backup_task(self, task_name: str):
-        """运行备份任务"""
-        # 检查任务是否已在运行
-        if task_name in self.running_tasks:
+        """把到期的任务交给工作线程池执行"""
+        # 检查任务是否已在排队或运行
+        if self.runner.submit(task_name, trigger='schedule') is None:
             self.logger.warning(f"任务 {task_name} 正在执行中，跳过本次执行")
-            return
-            
-        try:
-            # 标记任务开始运行
-            self.running_tasks.add(task_name)
-            
-            self.logger.info("=" * 50)
-            self.logger.info(f"开始执行调度任务: {task_name}")
-            self.logger.info(f"执行时间: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            
-            success = self.backup_manager.execute_backup(task_name)
-            
-            if success:
-                self.logger.info(f"调度任务 {task_name} 执行成功")
-            else:
-                self.logger.error(f"调度任务 {task_name} 执行失败")
-            self.logger.info("=" * 50)
-            
-        except Exception as e:
-            self.logger.error(f"执行任务 {task_name} 时发生错误: {str(e)}", exc_info=True)
-        finally:
-            # 任务完成后移除运行标记
-            self.running_tasks.discard(task_name)
     
     def is_backup_running(self) -> bool:
         """检查是否有备份任务正在运行"""
-        return len(self.running_tasks) > 0
+        return self.registry.has_running()
         
     def setup_schedules(self):
-        """设置所有备份任务的调度"""
-        for task_name, task_config in self.config['backup_tasks'].items():
-            schedule_str = task_config.get('schedule')
-            if not schedule_str:
-                self.logger.warning(f"任务 {task_name} 未配置调度时间")
-                continue
-                
-            try:
-                # 解析调度表达式
-                parts = schedule_str.split()
-                
-                # 处理 */n 格式（每n分钟执行一次）
-                if len(parts) == 1 and parts[0].startswith('*/'):
-                    try:
-                        interval = int(parts[0][2:])
-                        self.logger.debug(f"设置任务 {task_name} 为每 {interval} 分钟执行一次")
-                        schedule.every(interval).minutes.do(self._run_backup_task, task_name)
-                    except ValueError:
-                        self.logger.error(f"无效的分钟间隔值: {parts[0]}")
-                        continue
-                
-                # 处理 HH:MM 格式（每天特定时间执行）
-                elif len(parts) == 1 and ':' in parts[0]:
-                    time_str = parts[0]
-                    self.logger.debug(f"设置任务 {task_name} 为每天 {time_str} 执行")
-                    schedule.every().day.at(time_str).do(self._run_backup_task, task_name)
-                
-                # 处理 MM HH 格式（每天特定时间执行）
-                elif len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
-                    minute, hour = parts
-                    time_str = f"{hour.zfill(2)}:{minute.zfill(2)}"
-                    self.logger.debug(f"设置任务 {task_name} 为每天 {time_str} 执行")
-                    schedule.every().day.at(time_str).do(self._run_backup_task, task_name)
-                
-                # 处理 HH:MM W 格式（每周特定时间执行）
-                elif len(parts) == 2 and ':' in parts[0] and parts[1].isdigit():
-                    time_str, weekday = parts
-                    weekday = int(weekday)
-                    if 0 <= weekday <= 6:
-                        self.logger.debug(f"设置任务 {task_name} 为每周{weekday}的 {time_str} 执行")
-                        getattr(schedule.every(), ['monday', 'tuesday', 'wednesday', 
-                                'thursday', 'friday', 'saturday', 'sunday'][weekday]
-                        ).at(time_str).do(self._run_backup_task, task_name)
-                    else:
-                        self.logger.error(f"无效的星期值: {weekday}")
-                        continue
-                
-                # 处理 */n h-h 格式（在特定小时范围内每n分钟执行）
-                elif len(parts) == 2 and parts[0].startswith('*/') and '-' in parts[1]:
-                    interval_str, hours = parts
-                    try:
-                        interval = int(interval_str[2:])
-                        start_hour, end_hour = map(int, hours.split('-'))
-                        if 0 <= start_hour <= 23 and 0 <= end_hour <= 23:
-                            self.logger.debug(f"设置任务 {task_name} 为在 {start_hour}:00-{end_hour}:00 之间每 {interval} 分钟执行一次")
-                            job = schedule.every(interval).minutes
-                            job.do(self._run_backup_task, task_name)
-                            # 添加时间范围限制
-                            job.at(f"{start_hour:02d}:00").until(f"{end_hour:02d}:00")
-                        else:
-                            self.logger.error(f"无效的小时范围: {hours}")
-                            continue
-                    except ValueError:
-                        self.logger.error(f"无效的时间范围格式: {schedule_str}")
-                        continue
-                
-                else:
-                    self.logger.error(f"不支持的调度格式: {schedule_str}")
+        """设置所有备份任务的调度，只增加、替换或删除调度有变化的任务，并唤醒调度线程"""
+        with self._reload_lock:
+            with self._cond:
+                old_schedules, old_exprs = self._schedules, self._exprs
+            
+            schedules, exprs = {}, {}
+            for task_name, task_config in self.config['backup_tasks'].items():
+                schedule_str = task_config.get('schedule')
+                if not schedule_str:
+                    # 监视模式的任务可以只由文件变化触发
+                    if not task_config.get('watch', False):
+                        self.logger.warning(f"任务 {task_name} 未配置调度时间")
                     continue
-                
-                self.logger.info(f"成功设置任务 {task_name} 的调度: {schedule_str}")
-                
-            except Exception as e:
-                self.logger.error(f"设置任务 {task_name} 的调度失败: {str(e)}", exc_info=True)
+                expr = str(schedule_str)
+                if old_exprs.get(task_name) == expr:
+                    # 调度未变化，保留原有的下次执行时间
+                    schedules[task_name], exprs[task_name] = old_schedules[task_name], expr
+                    continue
+                try:
+                    schedules[task_name] = parse_schedule(expr)
+                    exprs[task_name] = expr
+                    self.logger.info(f"成功设置任务 {task_name} 的调度: {schedule_str} ({schedules[task_name]})")
+                except ValueError as e:
+                    self.logger.error(f"设置任务 {task_name} 的调度失败: {str(e)}")
+            self.watcher.reload(self.config['backup_tasks'])
+            
+            removed = set(old_exprs) - set(exprs)
+            changed = {name for name, expr in exprs.items() if old_exprs.get(name) != expr}
+            now = datetime.now()
+            with self._cond:
+                if removed or changed:
+                    # 去掉被删除和被替换任务的旧执行时间
+                    stale = removed | changed
+                    self._heap = [entry for entry in self._heap if entry[2] not in stale]
+                    heapq.heapify(self._heap)
+                for task_name in changed:
+                    self._push(task_name, schedules[task_name].next_after(now))
+                self._schedules, self._exprs = schedules, exprs
+                self._cond.notify_all()
+            if removed:
+                self.logger.info(f"已移除任务调度: {', '.join(sorted(removed))}")
+    
+    def reload(self, config: Dict):
+        """使用新配置重新设置调度（通过 Web 接口修改任务或服务器后调用）"""
+        self.config = config
+        self.backup_manager.servers = config['servers']
+        self.backup_manager.task_config = config['backup_tasks']
+        self.runner.configure(config.get('concurrency'))
+        self.setup_schedules()
+    
+    def notify(self):
+        """唤醒调度线程重新检查待执行的任务"""
+        with self._cond:
+            self._cond.notify_all()
+    
+    def next_run_times(self) -> Dict[str, str]:
+        """各任务的下次执行时间"""
+        with self._cond:
+            entries = [(ts, name) for ts, _, name in self._heap]
+        return {name: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+                for ts, name in sorted(entries)}
+    
+    def _push(self, task_name: str, fire_at: datetime):
+        """把任务的下次执行时间放入堆（需持有锁）"""
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_at.timestamp(), self._seq, task_name))
+    
+    def _next_due(self):
+        """等待到堆顶任务到期后弹出并返回任务名；期间被唤醒时重新计算等待时间"""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                fire_ts, _, task_name = self._heap[0]
+                delay = fire_ts - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                schedule = self._schedules.get(task_name)
+                if schedule is not None:
+                    # 从当前时间计算下次执行时间，错过的多次执行只补一次
+                    self._push(task_name, schedule.next_after(datetime.now()))
+                return task_name
     
     def run(self):
         """运行调度器"""
@@ -131,8 +137,8 @@ class BackupScheduler:
         
         while True:
             try:
-                schedule.run_pending()
-                time.sleep(7200)  # 每7200秒（2小时）检查一次待执行的任务
+                task_name = self._next_due()
+                self._run_backup_task(task_name)
             except Exception as e:
                 self.logger.error(f"调度器运行出错: {str(e)}", exc_info=True)
-                time.sleep(5)  # 发生错误时等待5秒后继续 
\ No newline at end of file
+                time.sleep(5)  # 发生错误时等待5秒后继续
@@ -1,38 +1,149 @@
 import paramiko
 import os
-from typing import Optional
+import stat
+import re
+import json
+import shlex
+import uuid
+import hashlib
+import tempfile
+import time
+from typing import Dict, Iterable, Optional, Tuple
 import logging
 
+from src import delta as delta_sync
+from src.metrics import CONNECT_SECONDS, REMOTE_STAT_SECONDS
+from src.logger import LazyText
+from src.profiling import NULL_PHASES
+
+# 本地读取文件的缓冲区大小
+READ_BUFFER_SIZE = 1024 * 1024
+
+# 默认达到该大小的文件启用断点续传
+DEFAULT_RESUME_MIN_SIZE = 64 * 1024 * 1024
+
+# 断点续传时每发送多少字节记录一次进度
+DEFAULT_CHECKPOINT_SIZE = 64 * 1024 * 1024
+
+
+class UploadCancelled(Exception):
+    """上传被取消"""
+
+
+class _ChannelWriter:
+    """把写入的数据直接发送到 SSH 通道的标准输入，并统计字节数；提供 throttle 时发送前限速"""
+
+    def __init__(self, channel, throttle=None):
+        self.channel = channel
+        self.throttle = throttle
+        self.written = 0
+
+    def write(self, data) -> int:
+        if self.throttle is not None:
+            self.throttle(len(data))
+        self.channel.sendall(data)
+        self.written += len(data)
+        return len(data)
+
+
+class _ThrottledReader:
+    """包装本地文件对象，每次 read 读出的数据发送前限速"""
+
+    def __init__(self, fileobj, throttle):
+        self.fileobj = fileobj
+        self.throttle = throttle
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        if data:
+            self.throttle(len(data))
+        return data
+
+
+def _is_windows_path(path: str) -> bool:
+    return bool(re.match(r'^[A-Za-z]:', path))
+
+
+def _quote_remote(path: str) -> str:
+    """为远程 shell 转义路径（Windows 路径使用双引号）"""
+    if _is_windows_path(path):
+        return f'"{path}"'
+    return shlex.quote(path)
+
+
+# 解包到暂存目录后逐目录移动到目标位置的远程 sh 脚本，参数为 (暂存目录, 目标目录, 解包命令)；
+# 同一文件系统内 mv 即 rename(2)，目标路径上的文件要么是旧版本要么是完整的新版本，
+# 每个目录只执行一次 mv，不会退化为每个文件一次往返；脚本退出（包括连接断开）时删除暂存目录
+_STAGED_EXTRACT_SCRIPT = (
+    'S=%s; R=%s; '
+    'trap \'rm -rf "$S"\' EXIT; trap \'exit 1\' HUP INT TERM PIPE; '
+    'mkdir "$S" && %s -C "$S" && cd "$S" && '
+    'find . -type d -exec sh -c \'cd "$0" && mkdir -p "$@"\' "$R" {} + && '
+    'find . -type d -exec sh -c \''
+    'r=$0; for d; do set --; '
+    'for f in "$d"/* "$d"/.[!.]* "$d"/..?*; do if [ -f "$f" ]; then set -- "$@" "$f"; fi; done; '
+    'if [ $# -gt 0 ]; then mv -f "$@" "$r/$d/" || exit 1; fi; done'
+    '\' "$R" {} +'
+)
+
+
 class SFTPClient:
     def __init__(self, host: str, port: int, username: str, 
-                 password: Optional[str] = None, key_file: Optional[str] = None):
+                 password: Optional[str] = None, key_file: Optional[str] = None,
+                 keepalive: int = 0, transfer: Optional[Dict] = None):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.key_file = key_file
+        self.keepalive = keepalive  # SSH keep-alive 间隔（秒），0 表示不发送
+        # 传输调优参数（window_size、max_packet_size、request_size、pipelined、
+        # buffer_size、ciphers），对应服务器配置中的 transfer 项
+        self.transfer = transfer or {}
+        # 指标中使用的服务器名称，连接池借出的连接为配置中的服务器名
+        self.server_name = host
         self.ssh = None
         self.sftp = None
         self.logger = logging.getLogger(__name__)
         self.last_skipped = False  # 添加跳过标记
+        self.last_sent_bytes = 0  # 最近一次上传实际发送的字节数（增量传输时小于文件大小）
+        self._owns_ssh = True  # 通过 open_channel 创建的通道不负责关闭 SSH 连接
+        # 本会话内已确认存在的远程目录，同一连接上的所有通道共享
+        self._known_dirs = set()
+        # 远程是否可执行指定的 Python 解释器，按解释器名缓存
+        self._remote_python = {}
+        # 服务器是否支持 posix-rename 扩展，None 表示尚未确认
+        self._posix_rename_ok = None
+        # 远程是否可执行 tar 解包，按命令名缓存
+        self._remote_tar = {}
 
     def connect(self) -> bool:
         """连接到SFTP服务器"""
         try:
             self.logger.debug(f"正在连接到服务器 {self.host}:{self.port}")
+            started = time.perf_counter()
             self.ssh = paramiko.SSHClient()
             self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             
+            # 需要调整窗口、包大小或加密算法时使用自定义 Transport
+            extra = {}
+            if any(self.transfer.get(k) for k in ('window_size', 'max_packet_size', 'ciphers')):
+                extra['transport_factory'] = self._create_transport
+            
             if self.key_file:
                 self.logger.debug("使用密钥文件认证")
                 key = paramiko.RSAKey.from_private_key_file(self.key_file)
-                self.ssh.connect(self.host, self.port, self.username, pkey=key)
+                self.ssh.connect(self.host, self.port, self.username, pkey=key, **extra)
             else:
                 self.logger.debug("使用密码认证")
                 self.ssh.connect(self.host, self.port, 
-                               self.username, self.password)
+                               self.username, self.password, **extra)
             
+            if self.keepalive:
+                self.ssh.get_transport().set_keepalive(self.keepalive)
             self.sftp = self.ssh.open_sftp()
+            self._owns_ssh = True
+            CONNECT_SECONDS.labels(self.server_name).observe(time.perf_counter() - started)
             self.logger.info(f"成功连接到服务器 {self.host}")
             return True
             
@@ -46,99 +157,650 @@ class SFTPClient:
             self.logger.error(f"连接失败: {str(e)} (host={self.host})", exc_info=True)
             return False
 
-    def check_remote_file(self, local_path: str, remote_path: str) -> bool:
+    def _create_transport(self, sock, **kwargs) -> paramiko.Transport:
+        """按传输调优参数创建 Transport：调整默认窗口和最大包大小，并把首选加密算法排在前面"""
+        if self.transfer.get('window_size'):
+            kwargs['default_window_size'] = int(self.transfer['window_size'])
+        if self.transfer.get('max_packet_size'):
+            kwargs['default_max_packet_size'] = int(self.transfer['max_packet_size'])
+        transport = paramiko.Transport(sock, **kwargs)
+        
+        preferred = self.transfer.get('ciphers')
+        if preferred:
+            options = transport.get_security_options()
+            supported = list(options.ciphers)
+            ordered = [c for c in preferred if c in supported]
+            if ordered:
+                options.ciphers = tuple(ordered + [c for c in supported if c not in ordered])
+            else:
+                self.logger.warning(f"配置的加密算法均不受支持，使用默认顺序: {preferred}")
+        return transport
+
+    def is_healthy(self) -> bool:
+        """检查连接是否仍然可用"""
+        try:
+            transport = self.ssh.get_transport() if self.ssh else None
+            if not self.sftp or not transport or not transport.is_active():
+                return False
+            self.sftp.normalize('.')
+            return True
+        except Exception as e:
+            self.logger.debug(f"连接健康检查失败: {str(e)} (host={self.host})")
+            return False
+
+    def open_channel(self) -> Optional['SFTPClient']:
+        """在同一个 SSH Transport 上打开新的 SFTP 通道
+
+        返回的客户端与当前客户端共享 SSH 连接，关闭时只关闭自己的 SFTP 通道
+        """
+        if not self.sftp and not self.connect():
+            return None
+        try:
+            channel = SFTPClient(self.host, self.port, self.username,
+                                 self.password, self.key_file, transfer=self.transfer)
+            channel.server_name = self.server_name
+            channel.ssh = self.ssh
+            channel.sftp = self.ssh.open_sftp()
+            channel._owns_ssh = False
+            channel._known_dirs = self._known_dirs
+            channel._remote_python = self._remote_python
+            channel._posix_rename_ok = self._posix_rename_ok
+            channel._remote_tar = self._remote_tar
+            self.logger.debug(f"已打开新的SFTP通道 (host={self.host})")
+            return channel
+        except Exception as e:
+            self.logger.warning(f"打开SFTP通道失败: {str(e)} (host={self.host})")
+            return None
+
+    def list_remote_dir(self, remote_dir: str) -> Optional[Dict[str, paramiko.SFTPAttributes]]:
+        """一次请求获取远程目录下所有文件的属性
+
+        返回 文件名 -> SFTPAttributes 的映射，目录不存在时返回 None
+        """
+        if not self.sftp and not self.connect():
+            raise IOError(f"SFTP连接未建立 (host={self.host})")
+        started = time.perf_counter()
+        try:
+            entries = self.sftp.listdir_attr(remote_dir)
+        except FileNotFoundError:
+            self._known_dirs.discard(remote_dir)
+            return None
+        finally:
+            REMOTE_STAT_SECONDS.labels(self.server_name, 'listdir').observe(
+                time.perf_counter() - started)
+        self._remember_dir(remote_dir)
+        files = {}
+        for entry in entries:
+            if stat.S_ISDIR(entry.st_mode or 0):
+                self._known_dirs.add(os.path.join(remote_dir, entry.filename))
+            else:
+                files[entry.filename] = entry
+        return files
+
+    def check_remote_file(self, local_path: str, remote_path: str,
+                          remote_attrs: Optional[Dict] = None,
+                          local_stat: Optional[os.stat_result] = None) -> bool:
         """检查远程文件是否需要更新
         
         通过比较文件大小和修改时间来判断是否需要更新
         返回 True 表示需要更新，False 表示不需要更新
+        remote_attrs 为已获取的远程目录列表，提供时不再单独 stat；
+        local_stat 为已获取的本地文件信息
         """
         try:
             # 获取本地文件信息
-            local_stat = os.stat(local_path)
+            if local_stat is None:
+                local_stat = os.stat(local_path)
             local_size = local_stat.st_size
             local_mtime = local_stat.st_mtime
             
             # 获取远程文件信息
             try:
-                remote_stat = self.sftp.stat(remote_path)
+                if remote_attrs is not None:
+                    remote_stat = remote_attrs.get(os.path.basename(remote_path))
+                    if remote_stat is None:
+                        raise FileNotFoundError(remote_path)
+                else:
+                    started = time.perf_counter()
+                    try:
+                        remote_stat = self.sftp.stat(remote_path)
+                    finally:
+                        REMOTE_STAT_SECONDS.labels(self.server_name, 'stat').observe(
+                            time.perf_counter() - started)
                 remote_size = remote_stat.st_size
                 remote_mtime = remote_stat.st_mtime
                 
                 # 如果远程文件存在，比较大小和修改时间
                 if remote_size == local_size and abs(remote_mtime - local_mtime) < 1:
-                    self.logger.debug(f"文件无需更新: {local_path} (大小: {self._format_size(local_size)})")
+                    self.logger.debug("文件无需更新: %s (大小: %s)", local_path,
+                                      LazyText(self._format_size, local_size))
                     return False
                 else:
-                    self.logger.debug(f"文件需要更新: {local_path} (本地大小: {self._format_size(local_size)}, 远程大小: {self._format_size(remote_size)})")
+                    self.logger.debug("文件需要更新: %s (本地大小: %s, 远程大小: %s)", local_path,
+                                      LazyText(self._format_size, local_size),
+                                      LazyText(self._format_size, remote_size))
                     return True
                     
             except FileNotFoundError:
                 # 远程文件不存在，需要备份
-                self.logger.debug(f"远程文件不存在，需要备份: {remote_path}")
+                self.logger.debug("远程文件不存在，需要备份: %s", remote_path)
                 return True
                 
         except Exception as e:
-            self.logger.error(f"检查文件状态失败: {str(e)}")
+            self.logger.error("检查文件状态失败: %s", e)
             # 如果检查失败，为安全起见返回 True 进行备份
             return True
 
-    def upload_file(self, local_path: str, remote_path: str) -> bool:
-        """上传文件到远程服务器"""
+    def upload_file(self, local_path: str, remote_path: str, force: bool = False,
+                    remote_attrs: Optional[Dict] = None, options: Optional[Dict] = None,
+                    local_stat: Optional[os.stat_result] = None) -> bool:
+        """上传文件到远程服务器
+
+        force 为 True 时跳过远程文件比对，直接上传；
+        remote_attrs 为远程目录列表，提供时说明目录已存在，不再单独检查；
+        local_stat 为调用方已获取的本地文件信息，提供时不再重复 stat；
+        options 为传输设置：
+            delta: 增量传输设置（min_size、block_size、python），大文件只发送变化的块
+            atomic: 是否先写临时文件再改名，默认 True
+            resume_min_size: 启用断点续传的最小文件大小
+            checkpoint_size: 断点续传记录进度的间隔字节数
+            cancel: threading.Event，置位后中断正在进行的上传
+            progress: 传输进度回调，见 _send_file
+            throttle: 限速回调 throttle(字节数)，每块发送前调用，按带宽限制阻塞
+            phases: 分阶段计时器（PhaseTimer），记录建目录、上传、改名、设置修改时间的耗时
+        """
+        options = options or {}
+        phases = options.get('phases') or NULL_PHASES
         try:
             self.last_skipped = False  # 重置跳过标记
-            self.logger.debug(f"准备上传文件: {local_path} -> {remote_path}")
+            self.last_sent_bytes = 0
+            self.logger.debug("准备上传文件: %s -> %s", local_path, remote_path)
             if not self.sftp:
                 self.logger.debug("SFTP连接未建立，尝试重新连接")
                 if not self.connect():
                     return False
                     
             # 检查本地文件
-            if not os.path.exists(local_path):
-                self.logger.error(f"本地文件不存在: {local_path}")
-                return False
+            if local_stat is None:
+                try:
+                    local_stat = os.stat(local_path)
+                except FileNotFoundError:
+                    self.logger.error("本地文件不存在: %s", local_path)
+                    return False
             
             # 检查是否需要更新
-            if not self.check_remote_file(local_path, remote_path):
+            if not force and not self.check_remote_file(local_path, remote_path, remote_attrs,
+                                                        local_stat):
                 self.last_skipped = True  # 设置跳过标记
-                self.logger.info(f"文件已是最新版本，跳过: {local_path}")
+                self.logger.info("文件已是最新版本，跳过: %s", local_path)
                 return True
             
-            # 确保远程目录存在
+            # 确保远程目录存在（已确认存在的目录不再检查）
             remote_dir = os.path.dirname(remote_path)
-            try:
-                self.logger.debug(f"检查远程目录: {remote_dir}")
-                self.sftp.stat(remote_dir)
-            except FileNotFoundError:
-                self.logger.debug(f"创建远程目录: {remote_dir}")
+            with phases.measure('mkdir'):
                 self._mkdir_p(remote_dir)
 
+            # 大文件优先尝试增量传输，失败时退回完整上传
+            file_size = local_stat.st_size
+            sent = None
+            delta = options.get('delta')
+            if delta and file_size >= delta.get('min_size', 0):
+                with phases.measure('delta'):
+                    sent = self._upload_delta(local_path, remote_path, file_size, delta,
+                                              cancel=options.get('cancel'),
+                                              progress=options.get('progress'),
+                                              throttle=options.get('throttle'))
+            
             # 上传文件
-            file_size = os.path.getsize(local_path)
-            self.logger.debug(f"开始上传文件 ({self._format_size(file_size)}): {local_path}")
-            self.sftp.put(local_path, remote_path)
+            if sent is None:
+                self.logger.debug("开始上传文件 (%s): %s", LazyText(self._format_size, file_size),
+                                  local_path)
+                try:
+                    sent = self._put_file(local_path, remote_path, local_stat, options)
+                except FileNotFoundError:
+                    # 目录可能已在远程被删除，清空目录缓存后重建一次
+                    self.logger.debug(f"远程目录不存在，重新创建: {remote_dir}")
+                    self._known_dirs.clear()
+                    self._mkdir_p(remote_dir)
+                    sent = self._put_file(local_path, remote_path, local_stat, options)
+            self.last_sent_bytes = sent
             
             # 设置远程文件的修改时间与本地文件一致
-            local_stat = os.stat(local_path)
-            self.sftp.utime(remote_path, (local_stat.st_atime, local_stat.st_mtime))
+            with phases.measure('utime'):
+                self.sftp.utime(remote_path, (local_stat.st_atime, local_stat.st_mtime))
             
-            self.logger.info(f"文件上传成功: {local_path} -> {remote_path}")
+            self.logger.info("文件上传成功: %s -> %s", local_path, remote_path)
             return True
             
+        except UploadCancelled:
+            # 断点续传的临时文件保留在远程，下次从已确认的位置继续；其余临时文件已删除
+            self.logger.info("上传已取消: %s", local_path)
+            return False
         except Exception as e:
-            self.logger.error(f"文件上传失败: {str(e)}", exc_info=True)
+            self.logger.error("文件上传失败: %s", e, exc_info=True)
             return False
 
-    def _mkdir_p(self, remote_directory):
-        """递归创建远程目录"""
-        if remote_directory == '/':
-            return
+    def _put_file(self, local_path: str, remote_path: str, local_stat: os.stat_result,
+                  options: Dict) -> int:
+        """上传文件内容，返回实际发送的字节数
+
+        默认先写入同目录下的临时文件 .<文件名>.part，完成后原子改名为目标文件，
+        目标路径上不会出现写了一半的文件；大文件同时记录断点，中断后从已确认的位置继续
+        """
+        file_size = local_stat.st_size
+        phases = options.get('phases') or NULL_PHASES
+        if not options.get('atomic', True):
+            with phases.measure('upload'):
+                return self._send_file(local_path, remote_path, file_size,
+                                       cancel=options.get('cancel'), progress=options.get('progress'),
+                                       throttle=options.get('throttle'))
+        
+        remote_dir, name = os.path.split(remote_path)
+        temp_path = os.path.join(remote_dir, f".{name}.part")
+        marker_path = temp_path + '.json'
+        resumable = file_size >= options.get('resume_min_size', DEFAULT_RESUME_MIN_SIZE)
+        
+        if resumable:
+            offset, digest = self._resume_offset(local_path, temp_path, marker_path, local_stat)
+            if offset:
+                self.logger.info(f"从断点继续上传: {local_path} "
+                                 f"(已完成 {self._format_size(offset)}/{self._format_size(file_size)})")
+            
+            def checkpoint(position: int, position_digest):
+                self._write_marker(marker_path, {
+                    'size': local_stat.st_size,
+                    'mtime': local_stat.st_mtime,
+                    'offset': position,
+                    'sha256': position_digest.hexdigest()
+                })
+            
+            with phases.measure('upload'):
+                sent = self._send_file(local_path, temp_path, file_size, offset, digest,
+                                       checkpoint, options.get('checkpoint_size', DEFAULT_CHECKPOINT_SIZE),
+                                       options.get('cancel'), options.get('progress'),
+                                       options.get('throttle'))
+        else:
+            try:
+                with phases.measure('upload'):
+                    sent = self._send_file(local_path, temp_path, file_size, cancel=options.get('cancel'),
+                                           progress=options.get('progress'),
+                                           throttle=options.get('throttle'))
+            except BaseException:
+                # 不续传的临时文件没有断点记录，留在远程只会成为垃圾，失败或取消时删除
+                self._remove_quietly(temp_path)
+                raise
+        
+        with phases.measure('rename'):
+            self._replace_remote(temp_path, remote_path)
+        if resumable:
+            try:
+                self.sftp.remove(marker_path)
+            except IOError:
+                pass
+        return sent
+
+    def _send_file(self, local_path: str, remote_path: str, file_size: int,
+                   offset: int = 0, digest=None, checkpoint=None,
+                   checkpoint_size: int = DEFAULT_CHECKPOINT_SIZE, cancel=None,
+                   progress=None, throttle=None) -> int:
+        """从 offset 开始流水线写入远程文件，返回发送的字节数
+
+        提供 checkpoint 时每隔 checkpoint_size 字节确认服务器已写入，再回调记录进度；
+        cancel 为 threading.Event，置位后停止发送并抛出 UploadCancelled；
+        progress(本地路径, 已发送位置, 文件大小, 本次发送字节数) 在每块写入后调用；
+        throttle(字节数) 在每块写入前调用，超出带宽限制时阻塞
+        """
+        buffer_size = int(self.transfer.get('buffer_size', READ_BUFFER_SIZE))
+        with open(local_path, 'rb') as local_file, \
+                self.sftp.open(remote_path, 'r+' if offset else 'w') as remote_file:
+            self._tune_file(remote_file)
+            if offset:
+                local_file.seek(offset)
+                remote_file.seek(offset)
+            position = offset
+            last_checkpoint = offset
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise UploadCancelled(remote_path)
+                chunk = local_file.read(buffer_size)
+                if not chunk:
+                    break
+                if throttle is not None:
+                    throttle(len(chunk))
+                remote_file.write(chunk)
+                position += len(chunk)
+                if progress is not None:
+                    progress(local_path, position, file_size, len(chunk))
+                if checkpoint is not None:
+                    digest.update(chunk)
+                    if position - last_checkpoint >= checkpoint_size:
+                        # fstat 的响应说明此前的写请求服务器都已处理
+                        remote_file.flush()
+                        if remote_file.stat().st_size >= position:
+                            checkpoint(position, digest.copy())
+                            last_checkpoint = position
+        
+        # 与 sftp.put 一样在完成后确认远程文件大小
+        remote_size = self.sftp.stat(remote_path).st_size
+        if remote_size != position:
+            raise IOError(f"上传后文件大小不一致: {remote_size} != {position} ({remote_path})")
+        return position - offset
+
+    def _tune_file(self, remote_file):
+        """按传输调优参数设置远程文件的流水线写入和单次请求大小"""
+        remote_file.set_pipelined(self.transfer.get('pipelined', True))
+        if self.transfer.get('request_size'):
+            # 默认每个写请求 32KB，OpenSSH 服务端可接受更大的请求
+            remote_file.MAX_REQUEST_SIZE = int(self.transfer['request_size'])
+
+    def _remove_quietly(self, remote_path: str):
+        """删除远程文件，文件不存在或连接已断开时忽略"""
+        try:
+            self.sftp.remove(remote_path)
+        except Exception as e:
+            self.logger.debug(f"删除远程临时文件失败: {remote_path}: {str(e)}")
+
+    def _resume_offset(self, local_path: str, temp_path: str, marker_path: str,
+                       local_stat: os.stat_result):
+        """读取断点记录，返回 (可续传的位置, 已发送部分的 sha256 对象)
+
+        本地文件未变化、远程临时文件不短于记录位置且本地前缀哈希一致时才续传
+        """
+        digest = hashlib.sha256()
+        try:
+            with self.sftp.open(marker_path, 'r') as f:
+                record = json.loads(f.read())
+            if record.get('size') != local_stat.st_size or record.get('mtime') != local_stat.st_mtime:
+                return 0, digest
+            offset = int(record['offset'])
+            if self.sftp.stat(temp_path).st_size < offset:
+                return 0, digest
+        except (IOError, ValueError, KeyError):
+            return 0, digest
+        
+        remaining = offset
+        with open(local_path, 'rb') as local_file:
+            while remaining > 0:
+                chunk = local_file.read(min(READ_BUFFER_SIZE, remaining))
+                if not chunk:
+                    return 0, hashlib.sha256()
+                digest.update(chunk)
+                remaining -= len(chunk)
+        if digest.hexdigest() != record.get('sha256'):
+            self.logger.debug(f"断点记录与本地文件不一致，重新上传: {local_path}")
+            return 0, hashlib.sha256()
+        return offset, digest
+
+    def _write_marker(self, marker_path: str, record: Dict):
+        """写入断点记录"""
+        try:
+            with self.sftp.open(marker_path, 'w') as f:
+                f.write(json.dumps(record))
+        except IOError as e:
+            self.logger.debug(f"写入断点记录失败: {marker_path}: {str(e)}")
+
+    def _replace_remote(self, source_path: str, target_path: str):
+        """把远程临时文件原子替换为目标文件"""
+        if self._posix_rename_ok is not False:
+            try:
+                self.sftp.posix_rename(source_path, target_path)
+                self._posix_rename_ok = True
+                return
+            except IOError as e:
+                if self._posix_rename_ok or getattr(e, 'errno', None) is not None:
+                    raise
+                # 服务器不支持 posix-rename 扩展
+                self.logger.debug(f"服务器不支持 posix-rename，改用 rename (host={self.host})")
+                self._posix_rename_ok = False
+        try:
+            self.sftp.remove(target_path)
+        except IOError:
+            pass
+        self.sftp.rename(source_path, target_path)
+
+    def exec_command(self, command: str,
+                     stdin_chunks: Optional[Iterable[bytes]] = None) -> Tuple[int, bytes, bytes]:
+        """在同一 SSH 连接上执行远程命令，返回 (退出码, 标准输出, 标准错误)"""
+        channel = self.ssh.get_transport().open_session()
+        try:
+            channel.exec_command(command)
+            if stdin_chunks is not None:
+                for chunk in stdin_chunks:
+                    channel.sendall(chunk)
+            channel.shutdown_write()
+            stdout = channel.makefile('rb').read()
+            stderr = channel.makefile_stderr('rb').read()
+            return channel.recv_exit_status(), stdout, stderr
+        finally:
+            channel.close()
+
+    def _has_remote_python(self, python: str) -> bool:
+        """检查远程能否通过 exec 通道运行 Python（结果在会话内缓存）"""
+        if python not in self._remote_python:
+            try:
+                status, stdout, _ = self.exec_command(f'{python} -c "print(42)"')
+                self._remote_python[python] = status == 0 and stdout.strip() == b'42'
+            except Exception as e:
+                self.logger.debug(f"远程执行命令失败: {str(e)} (host={self.host})")
+                self._remote_python[python] = False
+            if not self._remote_python[python]:
+                self.logger.info(f"远程无法执行 {python}，增量传输不可用，改为完整上传 (host={self.host})")
+        return self._remote_python[python]
+
+    def has_remote_tar(self, tar: str = 'tar') -> bool:
+        """检查远程能否通过 exec 通道运行 tar（结果在会话内缓存）"""
+        if tar not in self._remote_tar:
+            try:
+                status, _, _ = self.exec_command(f'{tar} --version')
+                self._remote_tar[tar] = status == 0
+            except Exception as e:
+                self.logger.debug(f"远程执行命令失败: {str(e)} (host={self.host})")
+                self._remote_tar[tar] = False
+            if not self._remote_tar[tar]:
+                self.logger.info(f"远程无法执行 {tar}，小文件将逐个上传 (host={self.host})")
+        return self._remote_tar[tar]
+
+    def supports_staged_extract(self, remote_dir: str) -> bool:
+        """能否先解包到暂存目录再移动到位（需要远程 POSIX sh，Windows 路径不支持）"""
+        return not _is_windows_path(remote_dir)
+
+    def _extract_command(self, remote_dir: str, source: str, tar: str, atomic: bool) -> str:
+        """解包 source（- 表示标准输入）到 remote_dir 的远程命令"""
+        if not atomic:
+            return f'{tar} -xf {source} -C {_quote_remote(remote_dir)}'
+        staging = os.path.join(remote_dir, f".bulk-{uuid.uuid4().hex}")
+        script = _STAGED_EXTRACT_SCRIPT % (shlex.quote(staging), shlex.quote(remote_dir),
+                                           f'{tar} -xf {source}')
+        return f'sh -c {shlex.quote(script)}'
+
+    def extract_tar(self, remote_dir: str, write_archive, tar: str = 'tar',
+                    throttle=None, atomic: bool = True) -> int:
+        """把 write_archive 生成的 tar 发送到远程目录解包，返回发送的字节数
+
+        优先通过 exec 通道流式发送给 tar -x；失败时先把归档上传为临时文件再解包；
+        throttle 为限速回调，见 upload_file；
+        atomic 为 True 时先解包到目标目录下的暂存目录，再移动到目标位置，与逐个上传时的
+        .part 临时文件一样，中断时目标路径上不会出现不完整的文件；为 False 时直接解包到目标路径
+        """
+        self._mkdir_p(remote_dir)
+        try:
+            return self._extract_tar_stream(remote_dir, write_archive, tar, throttle, atomic)
+        except Exception as e:
+            self.logger.warning(f"流式解包失败，改为上传归档后解包: {str(e)} (host={self.host})")
+        return self._extract_tar_archive(remote_dir, write_archive, tar, throttle, atomic)
+
+    def _extract_tar_stream(self, remote_dir: str, write_archive, tar: str, throttle=None,
+                            atomic: bool = True) -> int:
+        channel = self.ssh.get_transport().open_session()
         try:
-            self.sftp.stat(remote_directory)
+            channel.exec_command(self._extract_command(remote_dir, '-', tar, atomic))
+            writer = _ChannelWriter(channel, throttle)
+            write_archive(writer)
+            channel.shutdown_write()
+            stderr = channel.makefile_stderr('rb').read()
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        if status != 0:
+            raise IOError(f"远程解包失败 (exit={status}): {stderr.decode('utf-8', 'replace').strip()}")
+        return writer.written
+
+    def _extract_tar_archive(self, remote_dir: str, write_archive, tar: str, throttle=None,
+                             atomic: bool = True) -> int:
+        archive_path = os.path.join(remote_dir, f".bulk-{uuid.uuid4().hex}.tar")
+        with tempfile.TemporaryFile() as spool:
+            write_archive(spool)
+            size = spool.tell()
+            spool.seek(0)
+            # putfo 分块读取并发送，每块发送前限速
+            reader = _ThrottledReader(spool, throttle) if throttle is not None else spool
+            self.sftp.putfo(reader, archive_path, size)
+        try:
+            status, _, stderr = self.exec_command(
+                self._extract_command(remote_dir, _quote_remote(archive_path), tar, atomic))
+            if status != 0:
+                raise IOError(f"远程解包失败 (exit={status}): {stderr.decode('utf-8', 'replace').strip()}")
+        finally:
+            try:
+                self.sftp.remove(archive_path)
+            except IOError:
+                pass
+        return size
+
+    def _upload_delta(self, local_path: str, remote_path: str, file_size: int,
+                      delta: Dict, cancel=None, progress=None, throttle=None) -> Optional[int]:
+        """增量上传大文件，返回实际发送的字节数；无法增量时返回 None
+
+        需要远程能执行 python：签名计算和文件重建都在远程完成，重建结果写入临时文件后原子替换，
+        远程旧文件在替换前保持不变；不能执行时返回 None，由调用方走 .part 临时文件的完整上传。
+        cancel、progress 与 _send_file 相同，按每条增量指令检查和上报
+        """
+        python = delta.get('python', 'python3')
+        if not self._has_remote_python(python):
+            return None
+        try:
+            remote_stat = self.sftp.stat(remote_path)
         except IOError:
-            parent = os.path.dirname(remote_directory)
-            if parent != '/':
-                self._mkdir_p(parent)
-            self.sftp.mkdir(remote_directory)
+            return None  # 远程没有旧版本，只能完整上传
+        if not remote_stat.st_size:
+            return None
+        
+        block_size = int(delta.get('block_size', delta_sync.DEFAULT_BLOCK_SIZE))
+        # 未匹配的数据在本地逐字节滚动比对（纯 Python，约每秒数 MB），
+        # 超过文件一半或 max_literal 时放弃增量，避免比对的 CPU 耗时超过完整上传
+        max_literal = min(file_size // 2, delta.get('max_literal', delta_sync.DEFAULT_MAX_LITERAL))
+        try:
+            sent = self._delta_via_exec(local_path, remote_path, file_size, block_size,
+                                        python, max_literal, cancel, progress, throttle)
+        except UploadCancelled:
+            raise
+        except Exception as e:
+            self.logger.warning(f"增量传输失败，改为完整上传: {local_path}: {str(e)}")
+            return None
+        if sent is not None:
+            self.logger.debug(f"增量传输完成: {local_path} (发送 {self._format_size(sent)}, "
+                              f"文件大小 {self._format_size(file_size)})")
+        return sent
+
+    def _delta_via_exec(self, local_path: str, remote_path: str, file_size: int, block_size: int,
+                        python: str, max_literal: int, cancel=None, progress=None,
+                        throttle=None) -> Optional[int]:
+        """远程计算块签名并在远程重建文件，写入临时文件后原子替换
+
+        取消时中断发送，远程未收到结束指令不会替换原文件
+        """
+        status, stdout, stderr = self.exec_command(
+            delta_sync.remote_command(python, 'sig', remote_path, block_size))
+        if status != 0:
+            raise IOError(f"计算远程块签名失败: {stderr.decode('utf-8', 'replace').strip()}")
+        signatures = delta_sync.parse_signatures(stdout.decode('ascii').splitlines())
+        
+        remote_dir, name = os.path.split(remote_path)
+        temp_path = os.path.join(remote_dir, f".{name}.delta")
+        sent = [0]
+        
+        def counted(ops):
+            # position 是已描述到的新文件位置，复制指令按块大小计
+            position = 0
+            for op in ops:
+                if cancel is not None and cancel.is_set():
+                    raise UploadCancelled(remote_path)
+                if op[0] == 'copy':
+                    position = min(position + block_size, file_size)
+                elif op[0] == 'data':
+                    position += len(op[1])
+                op_sent = 0
+                for chunk in delta_sync.encode_delta((op,)):
+                    if throttle is not None:
+                        throttle(len(chunk))
+                    op_sent += len(chunk)
+                    yield chunk
+                sent[0] += op_sent
+                if progress is not None:
+                    progress(local_path, position, file_size, op_sent)
+        
+        ops = delta_sync.generate_delta(local_path, signatures, block_size, max_literal)
+        try:
+            status, stdout, stderr = self.exec_command(
+                delta_sync.remote_command(python, 'apply', remote_path, temp_path,
+                                          remote_path, block_size),
+                counted(ops))
+        except delta_sync.DeltaTooLarge:
+            self.logger.debug(f"文件变化过大，放弃增量传输: {local_path}")
+            return None
+        if status != 0 or stdout.strip() != b'OK':
+            raise IOError(f"远程重建文件失败 (exit={status}): {stderr.decode('utf-8', 'replace').strip()}")
+        return sent[0]
+
+    def set_remote_mtime(self, remote_path: str, atime: float, mtime: float) -> bool:
+        """只同步远程文件的修改时间，不传输内容"""
+        try:
+            if not self.sftp and not self.connect():
+                return False
+            self.sftp.utime(remote_path, (atime, mtime))
+            return True
+        except Exception as e:
+            self.logger.debug(f"同步远程修改时间失败: {remote_path}: {str(e)}")
+            return False
+
+    def _mkdir_p(self, remote_directory):
+        """确保远程目录存在
+
+        先自下而上找到最近的已存在目录（优先使用缓存），再自上而下一次性创建缺失的各级目录
+        """
+        missing = []
+        path = remote_directory
+        while path and path != '/' and path not in self._known_dirs:
+            try:
+                self.sftp.stat(path)
+            except IOError:
+                missing.append(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+                continue
+            # 找到已存在的目录，其上级目录必然也存在
+            self._remember_dir(path)
+            break
+        
+        for directory in reversed(missing):
+            try:
+                self.sftp.mkdir(directory)
+            except IOError:
+                # 并发上传时目录可能已被其他通道创建
+                self.sftp.stat(directory)
+            self._known_dirs.add(directory)
+
+    def _remember_dir(self, remote_directory):
+        """记录目录及其所有上级目录为已存在"""
+        path = remote_directory
+        while path and path not in self._known_dirs:
+            self._known_dirs.add(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
 
     def _format_size(self, size_in_bytes):
         """格式化文件大小显示"""
@@ -151,5 +813,8 @@ class SFTPClient:
     def close(self):
         if self.sftp:
             self.sftp.close()
+            self.sftp = None
         if self.ssh:
-            self.ssh.close() 
\ No newline at end of file
+            if self._owns_ssh:
+                self.ssh.close()
+            self.ssh = None
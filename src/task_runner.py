@@ -0,0 +1,291 @@
+import os
+import time
+import uuid
+import threading
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+from src.events import get_event_bus
+
+# 运行状态
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+
+
+class TaskRun:
+    """一次任务运行的登记信息"""
+
+    def __init__(self, task_name: str, trigger: str, reconcile: bool,
+                 server: str, disk, paths: Optional[Set[str]] = None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.task_name = task_name
+        self.trigger = trigger  # schedule、manual 或 watch
+        self.reconcile = reconcile
+        self.paths = paths  # 监视模式下只备份的变化路径
+        self.server = server
+        self.disk = disk
+        self.state = QUEUED
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.success = None
+        # 运行结束时置位，手动触发的调用方可等待结果
+        self.done = threading.Event()
+        # 取消请求，运行中的备份在各阶段检查后停止
+        self.cancelled = threading.Event()
+        # 开始执行后由 BackupManager 关联的运行上下文，用于查询进度
+        self.backup_run = None
+        # 手动触发时指定的剖析方式（覆盖任务配置），以及运行结束后剖析结果的路径
+        self.profile = None
+        self.profile_path = None
+
+    def progress(self) -> Dict:
+        """已处理的文件数和字节数，扫描结束后给出预计剩余时间"""
+        backup_run = self.backup_run
+        if backup_run is None:
+            return {}
+        stats = dict(backup_run.stats)
+        files_done = stats['success_files'] + stats['skipped_files'] + stats['failed_files']
+        eta = None
+        if self.state == RUNNING and backup_run.scan_complete and stats['processed_size'] > 0:
+            rate = stats['processed_size'] / max(time.time() - self.started_at, 0.001)
+            eta = round(max(stats['total_size'] - stats['processed_size'], 0) / rate)
+        return {
+            'files_total': stats['total_files'],
+            'files_done': files_done,
+            'files_failed': stats['failed_files'],
+            'bytes_total': stats['total_size'],
+            'bytes_done': stats['processed_size'],
+            'bytes_sent': stats['transferred_size'],
+            'throttled_seconds': round(stats['throttled_seconds'], 2),
+            'scan_complete': backup_run.scan_complete,
+            'eta_seconds': eta,
+            'errors': list(backup_run.errors),
+        }
+
+    def to_dict(self) -> Dict:
+        def fmt(ts):
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)) if ts else None
+        return {
+            'run_id': self.run_id,
+            'task_name': self.task_name,
+            'trigger': self.trigger,
+            'state': self.state,
+            'server': self.server,
+            'paths': None if self.paths is None else len(self.paths),
+            'queued_at': fmt(self.queued_at),
+            'started_at': fmt(self.started_at),
+            'finished_at': fmt(self.finished_at),
+            'success': self.success,
+            'cancelled': self.cancelled.is_set(),
+            'profile_path': self.profile_path,
+        }
+
+
+class RunRegistry:
+    """记录排队中、运行中和最近完成的任务运行
+
+    同一任务同时只允许一个排队或运行中的实例
+    """
+
+    def __init__(self, history_size: int = 50):
+        self._lock = threading.Lock()
+        self._active: Dict[str, TaskRun] = {}
+        self._recent = deque(maxlen=history_size)
+        # 状态变化推送给订阅者
+        self.bus = get_event_bus()
+
+    def register(self, run: TaskRun) -> bool:
+        """登记新的运行，同名任务已在排队或运行时返回 False"""
+        with self._lock:
+            if run.task_name in self._active:
+                return False
+            self._active[run.task_name] = run
+        self.bus.publish('run', run.to_dict())
+        return True
+
+    def mark_running(self, run: TaskRun):
+        with self._lock:
+            run.state = RUNNING
+            run.started_at = time.time()
+        self.bus.publish('run', run.to_dict())
+
+    def mark_finished(self, run: TaskRun, success: bool):
+        with self._lock:
+            run.state = FINISHED
+            run.success = success
+            run.finished_at = time.time()
+            self._active.pop(run.task_name, None)
+            self._recent.appendleft(run)
+        run.done.set()
+        self.bus.publish('run', run.to_dict())
+
+    def is_active(self, task_name: str) -> bool:
+        with self._lock:
+            return task_name in self._active
+
+    def get_active(self, task_name: str) -> Optional[TaskRun]:
+        with self._lock:
+            return self._active.get(task_name)
+
+    def get(self, run_id: str) -> Optional[TaskRun]:
+        """按运行 ID 查找排队中、运行中或最近完成的运行"""
+        with self._lock:
+            for run in list(self._active.values()) + list(self._recent):
+                if run.run_id == run_id:
+                    return run
+        return None
+
+    def has_running(self) -> bool:
+        with self._lock:
+            return any(run.state == RUNNING for run in self._active.values())
+
+    def snapshot(self) -> Dict[str, List[Dict]]:
+        """当前排队、运行中和最近完成的运行"""
+        with self._lock:
+            active = sorted(self._active.values(), key=lambda run: run.queued_at)
+            return {
+                'queued': [run.to_dict() for run in active if run.state == QUEUED],
+                'running': [run.to_dict() for run in active if run.state == RUNNING],
+                'recent': [run.to_dict() for run in self._recent],
+            }
+
+
+def _disk_key(path: str):
+    """源路径所在磁盘的标识，同一磁盘上的任务共享磁盘并发限制"""
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return os.path.splitdrive(os.path.abspath(path))[0] or os.sep
+
+
+class TaskRunner:
+    """并发执行备份任务的工作线程池
+
+    在全局并发数之外，同一目标服务器、同一源磁盘上同时运行的任务数也受限制；
+    受限的任务留在队列中，不阻塞后面可以执行的任务
+    """
+
+    def __init__(self, backup_manager, concurrency: Optional[Dict] = None):
+        self.backup_manager = backup_manager
+        self.logger = logging.getLogger(__name__)
+        self.registry = RunRegistry()
+        self._cond = threading.Condition()
+        self._pending: List[TaskRun] = []
+        self._running_total = 0
+        self._running_by_server: Dict[str, int] = {}
+        self._running_by_disk: Dict = {}
+        self._workers: List[threading.Thread] = []
+        self.configure(concurrency)
+
+    def configure(self, concurrency: Optional[Dict]):
+        """更新并发限制（配置重新加载时调用）"""
+        concurrency = concurrency or {}
+        with self._cond:
+            self.max_tasks = max(int(concurrency.get('max_tasks', 2)), 1)
+            self.per_server = max(int(concurrency.get('per_server', 1)), 1)
+            self.per_disk = max(int(concurrency.get('per_disk', 1)), 1)
+            self._cond.notify_all()
+
+    def submit(self, task_name: str, trigger: str = 'schedule', reconcile: bool = False,
+               paths: Optional[Set[str]] = None, profile=None) -> Optional[TaskRun]:
+        """把任务加入队列，同名任务已在排队或运行时返回 None；profile 指定本次运行的剖析方式"""
+        task = self.backup_manager.task_config.get(task_name, {})
+        run = TaskRun(task_name, trigger, reconcile,
+                      task.get('target_server'), _disk_key(task.get('source_path', '')), paths)
+        run.profile = profile
+        if not self.registry.register(run):
+            return None
+        with self._cond:
+            self._pending.append(run)
+            self._ensure_workers()
+            self._cond.notify_all()
+        return run
+
+    def cancel(self, run_id: str) -> Optional[TaskRun]:
+        """取消运行：排队中的直接移出队列，运行中的通知其停止；不存在时返回 None"""
+        run = self.registry.get(run_id)
+        if run is None or run.state == FINISHED:
+            return run
+        run.cancelled.set()
+        with self._cond:
+            queued = run in self._pending
+            if queued:
+                self._pending.remove(run)
+        if queued:
+            self.logger.info(f"已取消排队中的任务: {run.task_name}")
+            self.registry.mark_finished(run, False)
+        else:
+            self.logger.info(f"正在取消任务: {run.task_name}")
+        return run
+
+    def _server_limit(self, server_name: str) -> int:
+        server = self.backup_manager.servers.get(server_name) or {}
+        return max(int(server.get('max_concurrent_tasks', self.per_server)), 1)
+
+    def _take_eligible(self) -> Optional[TaskRun]:
+        """按排队顺序取出第一个未超过各项并发限制的任务（需持有锁）"""
+        if self._running_total >= self.max_tasks:
+            return None
+        for index, run in enumerate(self._pending):
+            if self._running_by_server.get(run.server, 0) >= self._server_limit(run.server):
+                continue
+            if self._running_by_disk.get(run.disk, 0) >= self.per_disk:
+                continue
+            del self._pending[index]
+            self._running_total += 1
+            self._running_by_server[run.server] = self._running_by_server.get(run.server, 0) + 1
+            self._running_by_disk[run.disk] = self._running_by_disk.get(run.disk, 0) + 1
+            return run
+        return None
+
+    def _ensure_workers(self):
+        """按全局并发数补足工作线程（需持有锁）"""
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        while len(self._workers) < self.max_tasks:
+            worker = threading.Thread(target=self._worker_loop, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                run = self._take_eligible()
+                while run is None:
+                    self._cond.wait()
+                    run = self._take_eligible()
+            try:
+                self._execute(run)
+            finally:
+                with self._cond:
+                    self._running_total -= 1
+                    self._running_by_server[run.server] -= 1
+                    self._running_by_disk[run.disk] -= 1
+                    self._cond.notify_all()
+
+    def _execute(self, run: TaskRun):
+        """运行备份任务"""
+        self.registry.mark_running(run)
+        success = False
+        try:
+            self.logger.info("=" * 50)
+            self.logger.info(f"开始执行任务: {run.task_name} (触发方式: {run.trigger})")
+            self.logger.info(f"执行时间: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+            success = self.backup_manager.execute_backup(run.task_name, reconcile=run.reconcile,
+                                                         paths=run.paths, job=run)
+
+            if success:
+                self.logger.info(f"任务 {run.task_name} 执行成功")
+            elif run.cancelled.is_set():
+                self.logger.warning(f"任务 {run.task_name} 已取消")
+            else:
+                self.logger.error(f"任务 {run.task_name} 执行失败")
+            self.logger.info("=" * 50)
+
+        except Exception as e:
+            self.logger.error(f"执行任务 {run.task_name} 时发生错误: {str(e)}", exc_info=True)
+        finally:
+            self.registry.mark_finished(run, success)
@@ -0,0 +1,180 @@
+"""传输带宽限制
+
+令牌桶限速器，按时间段设置不同的速率；同一服务器的所有并发上传共享一个限速器，
+任务还可以单独限速。配置示例:
+
+    bandwidth_limit: "10MB"              # 固定限速（字节/秒，可用 KB、MB、GB 后缀）
+    bandwidth_limit:                     # 按时间段限速，按顺序匹配第一个包含当前时间的时间段
+      - window: "09:00-18:00"
+        rate: "5MB"
+      - window: "22:00-06:00"            # 可以跨越午夜
+        rate: "50MB"
+                                         # 不在任何时间段内时不限速
+"""
+import re
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+# 限速器重新计算当前时间段速率的间隔（秒）
+RATE_CHECK_INTERVAL = 1.0
+
+_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2,
+          'G': 1024 ** 3, 'GB': 1024 ** 3}
+
+
+def parse_rate(value: Union[str, int, float, None]) -> Optional[float]:
+    """把 '5MB'、'512KB'、数字（字节/秒）转换为字节/秒，0、'unlimited' 或空表示不限速"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    text = str(value).strip().upper()
+    if text in ('', 'UNLIMITED', 'NONE', '0'):
+        return None
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*([KMG]?B?)(?:/S)?$', text)
+    if not match:
+        raise ValueError(f"无法识别的速率: {value}")
+    rate = float(match.group(1)) * _UNITS[match.group(2)]
+    return rate if rate > 0 else None
+
+
+def _parse_window(window: str) -> Tuple[int, int]:
+    """'09:00-18:00' -> (开始分钟, 结束分钟)"""
+    match = re.match(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$', str(window))
+    if not match:
+        raise ValueError(f"无法识别的时间段: {window}")
+    start_h, start_m, end_h, end_m = (int(x) for x in match.groups())
+    if start_h > 23 or end_h > 24 or start_m > 59 or end_m > 59:
+        raise ValueError(f"无法识别的时间段: {window}")
+    return start_h * 60 + start_m, end_h * 60 + end_m
+
+
+class BandwidthSchedule:
+    """按时间段变化的速率设置"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.default: Optional[float] = None
+        self.windows: List[Tuple[int, int, Optional[float]]] = []
+        if isinstance(spec, list):
+            for entry in spec:
+                if 'window' in entry:
+                    start, end = _parse_window(entry['window'])
+                    self.windows.append((start, end, parse_rate(entry.get('rate'))))
+                else:
+                    # 不带时间段的条目作为其余时间的速率
+                    self.default = parse_rate(entry.get('rate'))
+        else:
+            self.default = parse_rate(spec)
+
+    def rate_at(self, now: datetime) -> Optional[float]:
+        """now 时的速率（字节/秒），None 表示不限速"""
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.windows:
+            if start < end:
+                inside = start <= minute < end
+            elif start > end:
+                inside = minute >= start or minute < end
+            else:
+                inside = True  # 开始和结束相同表示全天
+            if inside:
+                return rate
+        return self.default
+
+
+class TokenBucket:
+    """线程安全的令牌桶
+
+    令牌不足时预支，调用方按欠缺的令牌数睡眠，多个线程按到达顺序分享带宽；
+    每次调用只持有一次锁，适合在每个数据块的发送路径上调用
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = rate
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, amount: int) -> float:
+        """取走 amount 个令牌，必要时睡眠，返回睡眠的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class Throttle:
+    """按时间段调整速率的限速器"""
+
+    def __init__(self, spec):
+        self.schedule = BandwidthSchedule(spec)
+        self._bucket: Optional[TokenBucket] = None
+        self._rate: Optional[float] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, spec):
+        """配置变化时更新时间段设置"""
+        with self._lock:
+            self.schedule = BandwidthSchedule(spec)
+            self._checked = 0.0
+
+    def _current_bucket(self) -> Optional[TokenBucket]:
+        now = time.monotonic()
+        if now - self._checked < RATE_CHECK_INTERVAL:
+            return self._bucket
+        with self._lock:
+            rate = self.schedule.rate_at(datetime.now())
+            if rate != self._rate:
+                if rate is None:
+                    self._bucket = None
+                elif self._bucket is None:
+                    self._bucket = TokenBucket(rate)
+                else:
+                    self._bucket.set_rate(rate)
+                self._rate = rate
+            self._checked = now
+            return self._bucket
+
+    def consume(self, amount: int) -> float:
+        """发送 amount 字节前调用，返回因限速等待的秒数"""
+        bucket = self._current_bucket()
+        if bucket is None:
+            return 0.0
+        return bucket.consume(amount)
+
+
+# 按服务器共享的限速器，同一服务器的所有任务和通道共用
+_server_throttles: Dict[str, Throttle] = {}
+_server_lock = threading.Lock()
+
+
+def get_server_throttle(server_name: str, spec) -> Optional[Throttle]:
+    """获取服务器的限速器，未配置限速时返回 None"""
+    with _server_lock:
+        if not spec:
+            _server_throttles.pop(server_name, None)
+            return None
+        throttle = _server_throttles.get(server_name)
+        if throttle is None:
+            throttle = _server_throttles[server_name] = Throttle(spec)
+        elif throttle.schedule.spec != spec:
+            throttle.update(spec)
+        return throttle
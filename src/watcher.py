@@ -0,0 +1,389 @@
+"""基于文件系统变化通知的实时增量备份
+
+开启 watch 的任务订阅源目录的变化事件（Linux 上直接使用 inotify，其他平台在安装了
+watchdog 时使用 watchdog），把变化的路径累积到去抖后的脏集合中，只备份这些路径；
+超过完整扫描间隔或事件队列溢出时退回完整扫描
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import logging
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# inotify 事件掩码
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# 监视线程检查脏集合的间隔（秒）
+TICK_SECONDS = 1.0
+
+# 监视触发的运行连续失败时，重试等待时间的上限（秒）
+MAX_RETRY_DELAY = 1800.0
+
+
+class DirtySet:
+    """去抖的变化路径集合
+
+    最后一次事件之后安静 debounce 秒，或第一次事件之后超过 max_delay 秒，才取出路径
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths: Set[str] = set()
+        self._first_event = None
+        self._last_event = None
+        self.overflowed = False
+
+    def add(self, path: str):
+        with self._lock:
+            now = time.time()
+            self._paths.add(path)
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+
+    def mark_overflow(self):
+        """事件丢失，只能完整扫描"""
+        with self._lock:
+            self.overflowed = True
+            now = time.time()
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+
+    def take(self, debounce: float, max_delay: float) -> Optional[Tuple[Set[str], bool]]:
+        """到期时取出 (变化路径, 是否溢出) 并清空，未到期返回 None"""
+        with self._lock:
+            if self._last_event is None:
+                return None
+            now = time.time()
+            if now - self._last_event < debounce and now - self._first_event < max_delay:
+                return None
+            result = (self._paths, self.overflowed)
+            self._paths = set()
+            self.overflowed = False
+            self._first_event = self._last_event = None
+            return result
+
+    def restore(self, paths: Set[str], overflowed: bool):
+        """任务无法提交或未成功完成时放回取出的路径，下次再试"""
+        with self._lock:
+            self._paths |= paths
+            self.overflowed = self.overflowed or overflowed
+            now = time.time()
+            if self._first_event is None:
+                self._first_event = now
+            if self._last_event is None:
+                self._last_event = now
+
+
+class InotifyBackend:
+    """通过 ctypes 调用 inotify 递归监视目录"""
+
+    def __init__(self, root: str, dirty: DirtySet):
+        self.root = os.path.abspath(root)
+        self.dirty = dirty
+        self.logger = logging.getLogger(__name__)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self._watches: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _add_tree(self, top: str):
+        """为目录及其所有子目录添加监视"""
+        for root, dirs, _ in os.walk(top):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    # 超过 fs.inotify.max_user_watches，无法保证不漏事件
+                    raise OSError(err, "inotify 监视数量已达上限")
+                continue
+            self._watches[wd] = root
+
+    def start(self):
+        self._add_tree(self.root)
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        os.close(self._fd)
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], TICK_SECONDS)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                self.logger.error(f"读取 inotify 事件失败: {str(e)}")
+                self.dirty.mark_overflow()
+                continue
+            self._handle(data)
+
+    def _handle(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.logger.warning(f"inotify 事件队列溢出，将完整扫描: {self.root}")
+                self.dirty.mark_overflow()
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # 新目录在添加监视前可能已写入文件，整个目录作为变化路径
+                try:
+                    self._add_tree(path)
+                except OSError:
+                    self.dirty.mark_overflow()
+            self.dirty.add(path)
+
+
+# 不改变内容的 watchdog 事件（只读打开、关闭）
+_IGNORED_WATCHDOG_EVENTS = ('opened', 'closed_no_write')
+
+
+class _WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, dirty: DirtySet):
+        super().__init__()
+        self.dirty = dirty
+
+    def on_any_event(self, event):
+        if event.event_type in _IGNORED_WATCHDOG_EVENTS:
+            return
+        # 目录的 modified 事件只表示目录项变化，变化的文件自身另有事件，加入目录会扫描整个目录
+        if event.is_directory and event.event_type == 'modified':
+            return
+        self.dirty.add(os.fsdecode(event.src_path))
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            self.dirty.add(os.fsdecode(dest_path))
+
+
+class WatchdogBackend:
+    """使用可选依赖 watchdog 监视目录（非 Linux 平台）"""
+
+    def __init__(self, root: str, dirty: DirtySet):
+        self.root = os.path.abspath(root)
+        self._observer = Observer()
+        self._observer.schedule(_WatchdogHandler(dirty), self.root, recursive=True)
+
+    def start(self):
+        self._observer.start()
+
+    def stop(self):
+        self._observer.stop()
+        self._observer.join(timeout=5)
+
+
+def create_backend(root: str, dirty: DirtySet):
+    """按平台创建监视后端，不支持时返回 None"""
+    if sys.platform.startswith('linux'):
+        return InotifyBackend(root, dirty)
+    if Observer is not None:
+        return WatchdogBackend(root, dirty)
+    return None
+
+
+class _TaskWatch:
+    """单个任务的监视状态"""
+
+    def __init__(self, task_name: str, task: Dict):
+        self.task_name = task_name
+        self.source_path = task['source_path']
+        self.debounce = float(task.get('watch_debounce_seconds', 5))
+        self.max_delay = float(task.get('watch_max_delay_seconds', 60))
+        self.full_scan_interval = float(task.get('watch_full_scan_minutes', 360)) * 60
+        self.retry_interval = float(task.get('retry_interval', 300))
+        self.dirty = DirtySet()
+        self.backend = None
+        # 上次完整扫描的时间，0 表示启动后先做一次完整扫描，补上未监视期间的变化
+        self.last_full_scan = 0.0
+        # 已提交、尚未确认成功的运行及其取出的变化：(运行, 变化路径, 是否完整扫描)
+        self.pending = None
+        # 连续失败次数，以及失败后下次提交的最早时间
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def retry_later(self):
+        """运行失败后按 retry_interval 指数退避，等待时间不超过 MAX_RETRY_DELAY"""
+        delay = min(self.retry_interval * 2 ** self.failures, MAX_RETRY_DELAY)
+        self.failures += 1
+        self.retry_at = time.time() + delay
+        return delay
+
+
+class WatchService:
+    """管理所有开启 watch 的任务，把去抖后的变化路径提交给任务线程池"""
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._watches: Dict[str, _TaskWatch] = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def reload(self, tasks: Dict):
+        """按任务配置启动、停止或重建监视"""
+        with self._lock:
+            wanted = {name: task for name, task in tasks.items()
+                      if task.get('watch', False) and os.path.isdir(task.get('source_path', ''))}
+            for name in list(self._watches):
+                watch = self._watches[name]
+                task = wanted.get(name)
+                if task is None or task['source_path'] != watch.source_path:
+                    self._stop_watch(watch)
+                    del self._watches[name]
+            for name, task in wanted.items():
+                if name in self._watches:
+                    continue
+                watch = _TaskWatch(name, task)
+                try:
+                    watch.backend = create_backend(watch.source_path, watch.dirty)
+                    if watch.backend is None:
+                        self.logger.error(f"无法监视任务 {name} 的源目录：非 Linux 平台需要 watchdog"
+                                          f"（见 requirements.txt），任务仅按计划执行")
+                        continue
+                    watch.backend.start()
+                except OSError as e:
+                    self.logger.warning(f"监视任务 {name} 的源目录失败，仅按计划执行: {str(e)}")
+                    self._stop_watch(watch)
+                    continue
+                self._watches[name] = watch
+                self.logger.info(f"开始监视任务 {name} 的源目录: {watch.source_path}")
+            # 配置中的去抖和完整扫描间隔可能已变化
+            for name, watch in self._watches.items():
+                task = wanted[name]
+                watch.debounce = float(task.get('watch_debounce_seconds', 5))
+                watch.max_delay = float(task.get('watch_max_delay_seconds', 60))
+                watch.full_scan_interval = float(task.get('watch_full_scan_minutes', 360)) * 60
+                watch.retry_interval = float(task.get('retry_interval', 300))
+
+        if self._watches and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            for watch in self._watches.values():
+                self._stop_watch(watch)
+            self._watches.clear()
+
+    def _stop_watch(self, watch: _TaskWatch):
+        if watch.backend is None:
+            return
+        try:
+            watch.backend.stop()
+        except Exception as e:
+            self.logger.debug(f"停止监视失败: {watch.task_name}: {str(e)}")
+        watch.backend = None
+
+    def _loop(self):
+        while not self._stop.wait(TICK_SECONDS):
+            with self._lock:
+                watches = list(self._watches.values())
+            for watch in watches:
+                try:
+                    self._check(watch)
+                except Exception as e:
+                    self.logger.error(f"检查任务 {watch.task_name} 的变化失败: {str(e)}")
+
+    def _check(self, watch: _TaskWatch):
+        """到达完整扫描间隔或事件溢出时完整扫描，否则只提交变化的路径"""
+        if watch.pending is not None:
+            run, paths, full = watch.pending
+            if not run.done.is_set():
+                # 同一任务同时只能有一个运行，期间的变化留在脏集合中
+                return
+            watch.pending = None
+            if run.success:
+                watch.failures = 0
+            elif run.cancelled.is_set():
+                # 被用户取消的运行不自动重试，变化留到下次事件或完整扫描
+                self.logger.info(f"任务 {watch.task_name} 已取消，不自动重试")
+            else:
+                # 运行失败，这些变化尚未备份，放回脏集合，退避后重试
+                delay = watch.retry_later()
+                self.logger.warning(f"任务 {watch.task_name} 未成功完成，"
+                                    f"{'完整扫描' if full else f'{len(paths)} 个变化路径'}"
+                                    f"将在 {delay:.0f} 秒后重试")
+                watch.dirty.restore(paths, full)
+
+        now = time.time()
+        if now < watch.retry_at:
+            return
+        if now - watch.last_full_scan >= watch.full_scan_interval:
+            run = self.runner.submit(watch.task_name, trigger='watch')
+            if run is not None:
+                # 完整扫描会覆盖此前累积的变化
+                taken = watch.dirty.take(0, 0)
+                watch.pending = (run, taken[0] if taken else set(), True)
+                watch.last_full_scan = now
+            return
+
+        taken = watch.dirty.take(watch.debounce, watch.max_delay)
+        if taken is None:
+            return
+        paths, overflowed = taken
+        run = self.runner.submit(watch.task_name, trigger='watch',
+                                 paths=None if overflowed else paths)
+        if run is None:
+            # 任务正在执行，保留变化路径等下次提交
+            watch.dirty.restore(paths, overflowed)
+            return
+        watch.pending = (run, paths, overflowed)
+        if overflowed:
+            watch.last_full_scan = now
+        else:
+            self.logger.info(f"任务 {watch.task_name} 检测到 {len(paths)} 个变化路径")
@@ -4,13 +4,14 @@ warnings.filterwarnings(
     message='TripleDES has been moved to cryptography.hazmat.decrepit.ciphers.algorithms.TripleDES'
 )
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, make_response, Response
+import queue
 import logging
-import yaml
 import os
 import threading
 import time
 import sys
+import hashlib
 
 # 添加项目根目录到 Python 路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,8 +22,16 @@ if parent_dir not in sys.path:
 # 导入必要的模块
 from src.scheduler import BackupScheduler
 from src.logger import setup_logger
-from src.history import get_history, backup_history
-from src.sftp_client import SFTPClient
+from src.history import (get_history, get_rollups, history_version, configure_history,
+                         parse_time, ROLLUP_FORMATS)
+from src.connection_pool import get_connection_pool
+from src.calibrate import calibrate_server, save_calibration
+from src.cron import parse_schedule
+from src.config_store import get_config_store
+from src.task_runner import FINISHED
+from src.events import get_event_bus, format_sse
+from src.metrics import get_registry
+from src.logger import tail_log, read_log_from
 
 # 禁用 Werkzeug 的请求日志
 log = logging.getLogger('werkzeug')
@@ -73,18 +82,24 @@ def before_request():
     app.logger.debug(f"App path: {APP_PATH}")
 
 scheduler = None
-config = None
+
+# 配置文件路径及其缓存存储，所有读写都经过存储，避免每个请求重新解析和整体重写配置文件
+CONFIG_PATH = os.path.join(APP_PATH, 'config', 'config.yaml')
+config_store = get_config_store(CONFIG_PATH)
 
 def load_config():
-    """加载配置文件"""
+    """加载配置文件（文件未变化时直接返回缓存）"""
     try:
-        config_path = os.path.join(APP_PATH, 'config', 'config.yaml')
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+        return config_store.get()
     except Exception as e:
         app.logger.error(f"加载配置文件失败: {str(e)}")
         raise
 
+def apply_config(new_config):
+    """配置变化后更新调度器，只调整受影响的任务"""
+    if scheduler is not None:
+        scheduler.reload(new_config)
+
 def run_scheduler():
     """在后台线程运行调度器"""
     global scheduler
@@ -95,11 +110,8 @@ def index():
     """主页"""
     try:
         # 加载最新的配置
-        config_path = os.path.join(APP_PATH, 'config', 'config.yaml')
-        app.logger.debug(f"Loading config from: {config_path}")
-        
-        with open(config_path, 'r', encoding='utf-8') as f:
-            current_config = yaml.safe_load(f)
+        app.logger.debug(f"Loading config from: {CONFIG_PATH}")
+        current_config = load_config()
         
         template_file = os.path.join(TEMPLATE_PATH, 'index.html')
         app.logger.debug(f"Template file path: {template_file}")
@@ -115,29 +127,147 @@ def index():
 @app.route('/api/tasks')
 def get_tasks():
     """获取所有任务"""
-    return jsonify(config['backup_tasks'])
+    return jsonify(load_config()['backup_tasks'])
 
 @app.route('/api/servers')
 def get_servers():
     """获取所有服务器"""
-    return jsonify(config['servers'])
+    return jsonify(load_config()['servers'])
 
 @app.route('/api/run_backup', methods=['POST'])
 def run_backup():
-    """手动触发备份任务"""
+    """手动触发备份任务，加入任务队列后立即返回任务 ID"""
     task_name = request.json.get('task_name')
-    if not task_name or task_name not in config['backup_tasks']:
+    if not task_name or task_name not in load_config()['backup_tasks']:
         return jsonify({'success': False, 'message': '无效的任务名称'})
     
     try:
-        success = scheduler.backup_manager.execute_backup(task_name)
+        # 交给任务线程池执行，同样受全局、服务器和磁盘并发限制；
+        # reconcile 为 True 时忽略本地清单，与远程逐个核对；profile 为 cprofile 或 sample 时剖析本次运行
+        run = scheduler.runner.submit(task_name, trigger='manual',
+                                      reconcile=bool(request.json.get('reconcile', False)),
+                                      profile=request.json.get('profile'))
+        if run is None:
+            # 同一任务已在排队或运行，返回已有的任务 ID
+            active = scheduler.registry.get_active(task_name)
+            return jsonify({
+                'success': False,
+                'message': '任务正在执行中',
+                'job_id': active.run_id if active else None
+            })
         return jsonify({
-            'success': success,
-            'message': '备份任务执行成功' if success else '备份任务执行失败'
+            'success': True,
+            'message': '备份任务已加入队列',
+            'job_id': run.run_id
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务的状态和进度"""
+    run = scheduler.registry.get(job_id)
+    if run is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    job = run.to_dict()
+    job['progress'] = run.progress()
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """取消排队中或运行中的任务"""
+    run = scheduler.runner.cancel(job_id)
+    if run is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    if run.state == FINISHED and not run.cancelled.is_set():
+        return jsonify({'success': False, 'message': '任务已结束', 'job': run.to_dict()}), 409
+    return jsonify({'success': True, 'message': '任务已取消', 'job': run.to_dict()})
+
+@app.route('/api/runs')
+def get_runs():
+    """获取排队中、运行中和最近完成的任务"""
+    return jsonify(scheduler.registry.snapshot())
+
+# 没有事件时发送注释行保持连接的间隔（秒）
+EVENTS_KEEPALIVE = 15
+
+@app.route('/api/events')
+def events():
+    """通过 Server-Sent Events 推送任务状态变化（run）和传输进度（progress）
+
+    连接建立后先推送一次当前的运行快照（runs），断线重连后界面据此恢复状态
+    """
+    bus = get_event_bus()
+    subscription = bus.subscribe()
+    
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse('runs', scheduler.registry.snapshot())
+            while True:
+                try:
+                    event_type, data = subscription.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event_type, data)
+        finally:
+            bus.unsubscribe(subscription)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# /api/logs 单次最多返回的行数和字节数，以及 follow 模式等待新日志的最长时间（秒）
+LOGS_MAX_LINES = 2000
+LOGS_MAX_BYTES = 512 * 1024
+LOGS_FOLLOW_TIMEOUT = 25
+
+@app.route('/api/logs')
+def get_logs():
+    """读取日志
+
+    不带 offset 时返回文件末尾的 lines 行（默认 200）；带 offset 时返回该偏移之后新写入的行，
+    follow=1 且暂无新日志时最多等待 LOGS_FOLLOW_TIMEOUT 秒；日志轮转后偏移超出文件大小时重新从末尾读取。
+    返回的 offset 用于下一次请求
+    """
+    log_file = load_config().get('logging', {}).get('file', 'logs/backup.log')
+    try:
+        lines = min(max(int(request.args.get('lines', 200)), 0), LOGS_MAX_LINES)
+        offset = request.args.get('offset')
+        offset = int(offset) if offset not in (None, '') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': '参数格式错误'}), 400
+    follow = request.args.get('follow') in ('1', 'true')
+    
+    if not os.path.exists(log_file):
+        return jsonify({'logs': [], 'offset': 0, 'size': 0, 'reset': False})
+    
+    reset = False
+    size = os.path.getsize(log_file)
+    if offset is not None and offset > size:
+        offset = None
+        reset = True
+    if offset is None:
+        logs, offset = tail_log(log_file, lines)
+    else:
+        deadline = time.time() + LOGS_FOLLOW_TIMEOUT
+        while follow and size <= offset and time.time() < deadline:
+            time.sleep(0.5)
+            size = os.path.getsize(log_file)
+        if size < offset:
+            logs, offset = tail_log(log_file, lines)
+            reset = True
+        else:
+            logs, offset = read_log_from(log_file, offset, LOGS_MAX_BYTES)
+    return jsonify({'logs': logs, 'offset': offset, 'size': os.path.getsize(log_file),
+                    'reset': reset})
+
+@app.route('/metrics')
+def metrics():
+    """以 Prometheus 文本格式输出文件数、字节数、失败数计数器和各类耗时直方图"""
+    return Response(get_registry().render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/servers/add', methods=['POST'])
 def add_server():
     """添加新服务器"""
@@ -146,25 +276,19 @@ def add_server():
         if not all(k in server_data for k in ['name', 'host', 'port', 'username']):
             return jsonify({'success': False, 'message': '缺少必要的服务器信息'})
             
-        # 加载当前配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'r', encoding='utf-8') as f:
-            current_config = yaml.safe_load(f)
-            
-        # 检查服务器名是否已存在
-        if server_data['name'] in current_config['servers']:
-            return jsonify({'success': False, 'message': '服务器名称已存在'})
-            
-        # 添加新服务器
-        current_config['servers'][server_data['name']] = {
-            'host': server_data['host'],
-            'port': int(server_data['port']),
-            'username': server_data['username'],
-            'password': server_data.get('password', '')
-        }
-        
-        # 保存配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'w', encoding='utf-8') as f:
-            yaml.dump(current_config, f, allow_unicode=True)
+        # 在配置存储的锁内修改，退出 with 时原子写回并更新调度器
+        with config_store.edit() as current_config:
+            # 检查服务器名是否已存在
+            if server_data['name'] in current_config['servers']:
+                return jsonify({'success': False, 'message': '服务器名称已存在'})
+                
+            # 添加新服务器
+            current_config['servers'][server_data['name']] = {
+                'host': server_data['host'],
+                'port': int(server_data['port']),
+                'username': server_data['username'],
+                'password': server_data.get('password', '')
+            }
             
         return jsonify({'success': True, 'message': '服务器添加成功'})
     except Exception as e:
@@ -178,21 +302,18 @@ def edit_server():
         if not all(k in server_data for k in ['name', 'host', 'port', 'username']):
             return jsonify({'success': False, 'message': '缺少必要的服务器信息'})
             
-        # 加载当前配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'r', encoding='utf-8') as f:
-            current_config = yaml.safe_load(f)
-            
-        # 更新服务器信息
-        current_config['servers'][server_data['name']] = {
-            'host': server_data['host'],
-            'port': int(server_data['port']),
-            'username': server_data['username'],
-            'password': server_data.get('password', '')
-        }
+        with config_store.edit() as current_config:
+            # 更新服务器信息，保留连接池和传输调优等其他配置项
+            server = current_config['servers'].setdefault(server_data['name'], {})
+            server.update({
+                'host': server_data['host'],
+                'port': int(server_data['port']),
+                'username': server_data['username'],
+                'password': server_data.get('password', '')
+            })
         
-        # 保存配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'w', encoding='utf-8') as f:
-            yaml.dump(current_config, f, allow_unicode=True)
+        # 连接参数可能已变化，关闭连接池中的旧连接
+        get_connection_pool().evict(server_data['name'])
             
         return jsonify({'success': True, 'message': '服务器信息更新成功'})
     except Exception as e:
@@ -206,29 +327,24 @@ def delete_server():
         if not server_name:
             return jsonify({'success': False, 'message': '未指定服务器名称'})
             
-        # 加载当前配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'r', encoding='utf-8') as f:
-            current_config = yaml.safe_load(f)
+        with config_store.edit() as current_config:
+            # 检查服务器是否在使用中
+            for task in current_config['backup_tasks'].values():
+                if task['target_server'] == server_name:
+                    return jsonify({
+                        'success': False, 
+                        'message': '该服务器正在被备份任务使用，无法删除'
+                    })
+                    
+            if server_name not in current_config['servers']:
+                return jsonify({'success': False, 'message': '服务器不存在'})
             
-        # 检查服务器是否在使用中
-        for task in current_config['backup_tasks'].values():
-            if task['target_server'] == server_name:
-                return jsonify({
-                    'success': False, 
-                    'message': '该服务器正在被备份任务使用，无法删除'
-                })
-                
-        # 删除服务器
-        if server_name in current_config['servers']:
+            # 删除服务器
             del current_config['servers'][server_name]
             
-            # 保存配置
-            with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'w', encoding='utf-8') as f:
-                yaml.dump(current_config, f, allow_unicode=True)
-                
-            return jsonify({'success': True, 'message': '服务器删除成功'})
-        else:
-            return jsonify({'success': False, 'message': '服务器不存在'})
+        get_connection_pool().evict(server_name)
+            
+        return jsonify({'success': True, 'message': '服务器删除成功'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -240,16 +356,21 @@ def test_server():
         if not all(k in server_data for k in ['host', 'port', 'username']):
             return jsonify({'success': False, 'message': '缺少必要的服务器信息'})
             
-        # 创建临时SFTP客户端测试连接
-        client = SFTPClient(
-            host=server_data['host'],
-            port=int(server_data['port']),
-            username=server_data['username'],
-            password=server_data.get('password', '')
-        )
-        
-        success = client.connect()
-        client.close()
+        # 从连接池借用连接测试，已建立的连接只做健康检查，不重复握手
+        server_name = server_data.get('name') or \
+            f"{server_data['username']}@{server_data['host']}:{server_data['port']}"
+        server_config = dict(load_config()['servers'].get(server_name, {}))
+        server_config.update({
+            'host': server_data['host'],
+            'port': int(server_data['port']),
+            'username': server_data['username'],
+            'password': server_data.get('password', '')
+        })
+        pool = get_connection_pool()
+        client = pool.acquire(server_name, server_config, timeout=10)
+        success = client is not None and client.is_healthy()
+        if client is not None:
+            pool.release(server_name, client, discard=not success)
         
         if success:
             return jsonify({'success': True, 'message': '服务器连接测试成功'})
@@ -258,6 +379,30 @@ def test_server():
     except Exception as e:
         return jsonify({'success': False, 'message': f'服务器连接测试失败: {str(e)}'})
 
+@app.route('/api/servers/calibrate', methods=['POST'])
+def calibrate_server_api():
+    """对服务器做吞吐量探测并给出建议的传输参数，save 为 true 时写入配置"""
+    try:
+        data = request.json or {}
+        server_name = data.get('name')
+        servers = load_config()['servers']
+        if server_name not in servers:
+            return jsonify({'success': False, 'message': '服务器不存在'})
+        
+        transfer = calibrate_server(servers[server_name],
+                                    remote_dir=data.get('remote_dir', '.'),
+                                    probe_mb=int(data.get('probe_mb', 8)))
+        if transfer is None:
+            return jsonify({'success': False, 'message': '校准失败，无法完成吞吐量探测'})
+        
+        if data.get('save', False):
+            save_calibration(CONFIG_PATH, server_name, transfer)
+            get_connection_pool().evict(server_name)
+        
+        return jsonify({'success': True, 'transfer': transfer})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'校准失败: {str(e)}'})
+
 @app.route('/api/tasks/add', methods=['POST'])
 def add_task():
     """添加新备份任务"""
@@ -265,35 +410,32 @@ def add_task():
         task_data = request.json
         if not all(k in task_data for k in ['name', 'source_path', 'target_server', 'target_path', 'schedule']):
             return jsonify({'success': False, 'message': '缺少必要的任务信息'})
-            
-        # 加载当前配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'r', encoding='utf-8') as f:
-            current_config = yaml.safe_load(f)
-            
-        # 检查任务名是否已存在
-        if task_data['name'] in current_config['backup_tasks']:
-            return jsonify({'success': False, 'message': '任务名称已存在'})
-            
-        # 检查目标服务器是否存在
-        if task_data['target_server'] not in current_config['servers']:
-            return jsonify({'success': False, 'message': '目标服务器不存在'})
-            
-        # 添加新任务
-        current_config['backup_tasks'][task_data['name']] = {
-            'source_path': task_data['source_path'],
-            'target_server': task_data['target_server'],
-            'target_path': task_data['target_path'],
-            'schedule': task_data['schedule'],
-            'retry_times': task_data.get('retry_times', 3),
-            'retry_interval': task_data.get('retry_interval', 30)
-        }
         
-        # 保存配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'w', encoding='utf-8') as f:
-            yaml.dump(current_config, f, allow_unicode=True)
+        # 检查调度表达式
+        try:
+            parse_schedule(str(task_data['schedule']))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'无效的调度表达式: {str(e)}'})
             
-        # 重新加载调度器
-        scheduler.setup_schedules()
+        with config_store.edit() as current_config:
+            # 检查任务名是否已存在
+            if task_data['name'] in current_config['backup_tasks']:
+                return jsonify({'success': False, 'message': '任务名称已存在'})
+                
+            # 检查目标服务器是否存在
+            if task_data['target_server'] not in current_config['servers']:
+                return jsonify({'success': False, 'message': '目标服务器不存在'})
+                
+            # 添加新任务
+            current_config['backup_tasks'][task_data['name']] = {
+                'source_path': task_data['source_path'],
+                'target_server': task_data['target_server'],
+                'target_path': task_data['target_path'],
+                'schedule': task_data['schedule'],
+                'retry_times': task_data.get('retry_times', 3),
+                'retry_interval': task_data.get('retry_interval', 30),
+                'upload_workers': int(task_data.get('upload_workers', 1))
+            }
             
         return jsonify({'success': True, 'message': '任务添加成功'})
     except Exception as e:
@@ -306,31 +448,30 @@ def edit_task():
         task_data = request.json
         if not all(k in task_data for k in ['name', 'source_path', 'target_server', 'target_path', 'schedule']):
             return jsonify({'success': False, 'message': '缺少必要的任务信息'})
-            
-        # 加载当前配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'r', encoding='utf-8') as f:
-            current_config = yaml.safe_load(f)
-            
-        # 检查目标服务器是否存在
-        if task_data['target_server'] not in current_config['servers']:
-            return jsonify({'success': False, 'message': '目标服务器不存在'})
-            
-        # 更新任务信息
-        current_config['backup_tasks'][task_data['name']] = {
-            'source_path': task_data['source_path'],
-            'target_server': task_data['target_server'],
-            'target_path': task_data['target_path'],
-            'schedule': task_data['schedule'],
-            'retry_times': task_data.get('retry_times', 3),
-            'retry_interval': task_data.get('retry_interval', 30)
-        }
         
-        # 保存配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'w', encoding='utf-8') as f:
-            yaml.dump(current_config, f, allow_unicode=True)
+        # 检查调度表达式
+        try:
+            parse_schedule(str(task_data['schedule']))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'无效的调度表达式: {str(e)}'})
             
-        # 重新加载调度器
-        scheduler.setup_schedules()
+        with config_store.edit() as current_config:
+            # 检查目标服务器是否存在
+            if task_data['target_server'] not in current_config['servers']:
+                return jsonify({'success': False, 'message': '目标服务器不存在'})
+                
+            # 更新任务信息（保留界面上未展示的高级配置项）
+            task = current_config['backup_tasks'].setdefault(task_data['name'], {})
+            task.update({
+                'source_path': task_data['source_path'],
+                'target_server': task_data['target_server'],
+                'target_path': task_data['target_path'],
+                'schedule': task_data['schedule'],
+                'retry_times': task_data.get('retry_times', 3),
+                'retry_interval': task_data.get('retry_interval', 30)
+            })
+            if 'upload_workers' in task_data:
+                task['upload_workers'] = int(task_data['upload_workers'])
             
         return jsonify({'success': True, 'message': '任务更新成功'})
     except Exception as e:
@@ -344,37 +485,94 @@ def delete_task():
         if not task_name:
             return jsonify({'success': False, 'message': '未指定任务名称'})
             
-        # 加载当前配置
-        with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'r', encoding='utf-8') as f:
-            current_config = yaml.safe_load(f)
+        with config_store.edit() as current_config:
+            if task_name not in current_config['backup_tasks']:
+                return jsonify({'success': False, 'message': '任务不存在'})
             
-        # 删除任务
-        if task_name in current_config['backup_tasks']:
+            # 删除任务
             del current_config['backup_tasks'][task_name]
-            
-            # 保存配置
-            with open(os.path.join(APP_PATH, 'config', 'config.yaml'), 'w', encoding='utf-8') as f:
-                yaml.dump(current_config, f, allow_unicode=True)
-                
-            # 重新加载调度器
-            scheduler.setup_schedules()
                 
-            return jsonify({'success': True, 'message': '任务删除成功'})
-        else:
-            return jsonify({'success': False, 'message': '任务不存在'})
+        return jsonify({'success': True, 'message': '任务删除成功'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+# 历史记录每页的默认条数和上限
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
 @app.route('/api/history')
 def get_history_api():
-    """获取备份历史记录"""
-    return jsonify(get_history())
+    """获取备份历史记录，按时间从新到旧分页
+
+    参数: limit 每页条数；cursor 为上一页返回的 next_cursor，继续取更早的记录；
+    after 为上次返回的 latest，只返回之后新增的记录（从旧到新）；
+    task、status（success/failed）、since、until（时间戳或 2025-01-20 16:11:53 格式，与 /api/stats 相同）用于筛选。
+    支持 If-None-Match，历史记录未变化时返回 304
+    """
+    # 历史记录只追加和清理，最小、最大 id 不变时同一查询的结果不变
+    version = history_version()
+    etag = hashlib.sha1(f"{version}|{request.query_string.decode()}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    try:
+        limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor', type=int)
+        after = request.args.get('after', type=int)
+        since = parse_time(request.args.get('since'))
+        until = parse_time(request.args.get('until'))
+        status = request.args.get('status')
+        if status not in (None, '', 'success', 'failed'):
+            raise ValueError(f"不支持的状态: {status}")
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    success = None if not status else status == 'success'
+    
+    if after is not None:
+        # 增量模式：只返回游标之后的新记录
+        records = get_history(limit, 0, request.args.get('task'), since, until,
+                              success=success, after_id=after)
+        result = {
+            'records': records,
+            'latest': records[-1]['id'] if records else after,
+            'has_more': len(records) == limit,
+        }
+    else:
+        records = get_history(limit, 0, request.args.get('task'), since, until, newest_first=True,
+                              success=success, before_id=cursor)
+        result = {
+            'records': records,
+            'next_cursor': records[-1]['id'] if len(records) == limit else None,
+            'latest': max([version[1] or 0] + [record['id'] for record in records]),
+        }
+    
+    response = make_response(jsonify(result))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/stats')
 def get_stats():
-    """获取备份统计信息"""
+    """获取备份统计信息
+
+    总数和按任务统计覆盖全部历史，daily_stats 为最近7天；
+    可选参数 granularity（hour/day）、since、until、task 时额外返回该范围内的汇总桶 buckets
+    """
+    from datetime import datetime, timedelta
+    try:
+        since = parse_time(request.args.get('since'))
+        until = parse_time(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ROLLUP_FORMATS:
+        return jsonify({'success': False, 'message': f"不支持的统计粒度: {granularity}"}), 400
+    
     stats = {
-        'total_backups': len(backup_history),
+        'total_backups': 0,
         'success_rate': 0,
         'total_files': 0,
         'total_size': 0,
@@ -382,62 +580,62 @@ def get_stats():
         'task_stats': {}
     }
     
-    if backup_history:
-        success_count = sum(1 for record in backup_history if record['success'])
-        stats['success_rate'] = (success_count / len(backup_history)) * 100
-        
-        # 按日期统计
-        from datetime import datetime, timedelta
-        today = datetime.now().date()
-        for i in range(7):  # 最近7天
-            date = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-            stats['daily_stats'][date] = {
-                'total': 0,
-                'success': 0,
-                'failed': 0
-            }
-            
-        # 统计每个任务的情况
-        for record in backup_history:
-            # 更新任务统计
-            if record['task_name'] not in stats['task_stats']:
-                stats['task_stats'][record['task_name']] = {
-                    'total': 0,
-                    'success': 0,
-                    'failed': 0
-                }
-            task_stat = stats['task_stats'][record['task_name']]
-            task_stat['total'] += 1
-            if record['success']:
-                task_stat['success'] += 1
-            else:
-                task_stat['failed'] += 1
-                
-            # 更新日期统计
-            date = datetime.strptime(record['time'], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d')
-            if date in stats['daily_stats']:
-                day_stat = stats['daily_stats'][date]
-                day_stat['total'] += 1
-                if record['success']:
-                    day_stat['success'] += 1
-                else:
-                    day_stat['failed'] += 1
+    # 按天汇总的桶数只与天数和任务数有关，与历史记录条数无关
+    success_count = 0
+    for bucket in get_rollups('day'):
+        stats['total_backups'] += bucket['runs']
+        stats['total_files'] += bucket['files']
+        stats['total_size'] += bucket['size']
+        success_count += bucket['success']
+        task_stat = stats['task_stats'].setdefault(bucket['task_name'], {
+            'total': 0,
+            'success': 0,
+            'failed': 0
+        })
+        task_stat['total'] += bucket['runs']
+        task_stat['success'] += bucket['success']
+        task_stat['failed'] += bucket['failed']
+    if stats['total_backups']:
+        stats['success_rate'] = (success_count / stats['total_backups']) * 100
+    
+    # 按日期统计
+    today = datetime.now().date()
+    for i in range(7):  # 最近7天
+        date = (today - timedelta(days=i)).strftime('%Y-%m-%d')
+        stats['daily_stats'][date] = {
+            'total': 0,
+            'success': 0,
+            'failed': 0
+        }
+    first_day = datetime.combine(today - timedelta(days=6), datetime.min.time())
+    for bucket in get_rollups('day', since=first_day.timestamp()):
+        day_stat = stats['daily_stats'].get(bucket['bucket'])
+        if day_stat is not None:
+            day_stat['total'] += bucket['runs']
+            day_stat['success'] += bucket['success']
+            day_stat['failed'] += bucket['failed']
+    
+    if since is not None or until is not None or 'granularity' in request.args or 'task' in request.args:
+        stats['buckets'] = get_rollups(granularity, since, until, request.args.get('task'))
     
     return jsonify(stats)
 
 def create_app():
     """创建并配置Flask应用"""
-    global config, scheduler
+    global scheduler
     
     # 加载配置
     config = load_config()
     
     # 设置日志
     logger = setup_logger(config['logging'])
+    configure_history(config.get('history'))
     
     # 创建调度器
     scheduler = BackupScheduler(config)
     scheduler.setup_schedules()
+    # 配置通过接口修改或被外部修改后，调度器只调整变化的任务
+    config_store.subscribe(apply_config)
     
     # 启动调度器线程
     scheduler_thread = threading.Thread(target=run_scheduler)
@@ -0,0 +1,101 @@
+import threading
+import unittest
+from contextlib import contextmanager
+
+from src.pipeline import Pipeline
+
+# 流水线卡住时测试失败而不是永久阻塞
+RUN_TIMEOUT = 10
+
+
+def run_pipeline(pipeline: Pipeline, source) -> bool:
+    """在后台线程中运行流水线，返回是否在超时前结束"""
+    thread = threading.Thread(target=pipeline.run, args=(source,), daemon=True)
+    thread.start()
+    thread.join(RUN_TIMEOUT)
+    return not thread.is_alive()
+
+
+class PipelineWorkerFailureTest(unittest.TestCase):
+
+    def _build(self, workers: int, open_worker=None, close_worker=None):
+        results = []
+        lock = threading.Lock()
+
+        def transfer(state, item, emit):
+            emit(item)
+
+        def record(state, item, emit):
+            with lock:
+                results.append(item)
+
+        pipeline = Pipeline('test')
+        pipeline.add_stage('transfer', transfer, workers=workers, queue_size=2,
+                           open_worker=open_worker, close_worker=close_worker)
+        pipeline.add_stage('record', record)
+        return pipeline, results
+
+    def test_close_worker_error_does_not_hang(self):
+        def close_worker(state, emit):
+            emit('flushed')
+            raise IOError('flush failed')
+
+        pipeline, results = self._build(3, close_worker=close_worker)
+        self.assertTrue(run_pipeline(pipeline, range(50)))
+        self.assertEqual(sorted(r for r in results if r != 'flushed'), list(range(50)))
+        self.assertEqual(results.count('flushed'), 3)
+        transfer = pipeline.stats()[1]
+        self.assertEqual(transfer['processed'], 50)
+        self.assertEqual(transfer['errors'], 3)
+
+    def test_close_worker_error_with_single_worker(self):
+        def close_worker(state, emit):
+            raise IOError('flush failed')
+
+        pipeline, results = self._build(1, close_worker=close_worker)
+        self.assertTrue(run_pipeline(pipeline, range(10)))
+        self.assertEqual(sorted(results), list(range(10)))
+        self.assertEqual(pipeline.errors, 1)
+
+    def test_open_worker_error_drains_input(self):
+        def open_worker(index):
+            if index == 0:
+                raise IOError('connect failed')
+            return index
+
+        pipeline, results = self._build(2, open_worker=open_worker)
+        self.assertTrue(run_pipeline(pipeline, range(50)))
+        transfer = pipeline.stats()[1]
+        # 出错线程消费掉的项计为错误，其余由另一个线程正常处理
+        self.assertEqual(len(results), transfer['processed'])
+        self.assertEqual(transfer['processed'] + transfer['errors'] - 1, 50)
+
+    def test_all_workers_fail_to_open(self):
+        def open_worker(index):
+            raise IOError('connect failed')
+
+        pipeline, results = self._build(2, open_worker=open_worker)
+        self.assertTrue(run_pipeline(pipeline, range(20)))
+        self.assertEqual(results, [])
+        self.assertEqual(pipeline.stats()[1]['errors'], 22)
+
+
+    def test_worker_context_error_does_not_hang(self):
+        entered = []
+
+        @contextmanager
+        def worker_context():
+            if not entered:
+                entered.append(threading.get_ident())
+                raise ValueError('Another profiling tool is already active')
+            yield
+
+        pipeline, results = self._build(2)
+        pipeline.worker_context = worker_context
+        self.assertTrue(run_pipeline(pipeline, range(30)))
+        self.assertEqual(len(results), pipeline.stats()[-1]['processed'])
+        self.assertGreaterEqual(pipeline.errors, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from src.watcher import (DirtySet, InotifyBackend, Observer, WatchService, WatchdogBackend,
+                         _TaskWatch, _WatchdogHandler)
+
+# 等待监视线程收到事件的最长时间（秒）
+EVENT_TIMEOUT = 5
+
+
+def event(event_type: str, src_path: str, is_directory: bool = False, dest_path: str = None):
+    """与 watchdog 事件对象属性相同的事件"""
+    return SimpleNamespace(event_type=event_type, src_path=src_path,
+                           is_directory=is_directory, dest_path=dest_path)
+
+
+def wait_for_paths(dirty: DirtySet):
+    """等待脏集合中出现路径并取出"""
+    deadline = time.time() + EVENT_TIMEOUT
+    while time.time() < deadline:
+        # 等事件去抖后再取，避免漏掉同一次写入的后续事件
+        result = dirty.take(0.2, EVENT_TIMEOUT)
+        if result is not None:
+            return result
+        time.sleep(0.05)
+    return None
+
+
+class WatchdogHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirty = DirtySet()
+        self.handler = _WatchdogHandler(self.dirty)
+
+    def test_file_created_dirties_only_file(self):
+        # watchdog 对新建文件报告文件的 created/modified 和父目录的 modified
+        self.handler.on_any_event(event('created', '/data/dir/new.txt'))
+        self.handler.on_any_event(event('modified', '/data/dir/new.txt'))
+        self.handler.on_any_event(event('modified', '/data/dir', is_directory=True))
+        self.assertEqual(self.dirty.take(0, 0), ({'/data/dir/new.txt'}, False))
+
+    def test_directory_created_and_moved(self):
+        self.handler.on_any_event(event('created', '/data/sub', is_directory=True))
+        self.handler.on_any_event(event('moved', '/data/old', is_directory=True, dest_path='/data/new'))
+        self.assertEqual(self.dirty.take(0, 0), ({'/data/sub', '/data/old', '/data/new'}, False))
+
+    def test_read_only_events_ignored(self):
+        self.handler.on_any_event(event('opened', '/data/dir/a.txt'))
+        self.handler.on_any_event(event('closed_no_write', '/data/dir/a.txt'))
+        self.assertIsNone(self.dirty.take(0, 0))
+
+
+class BackendFileCreatedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'dir'))
+        self.dirty = DirtySet()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def check_file_created(self, backend):
+        backend.start()
+        try:
+            path = os.path.join(self.root, 'dir', 'new.txt')
+            with open(path, 'w') as f:
+                f.write('data')
+            self.assertEqual(wait_for_paths(self.dirty), ({path}, False))
+        finally:
+            backend.stop()
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify 仅在 Linux 上可用")
+    def test_inotify(self):
+        self.check_file_created(InotifyBackend(self.root, self.dirty))
+
+    @unittest.skipIf(Observer is None, "未安装 watchdog")
+    def test_watchdog(self):
+        self.check_file_created(WatchdogBackend(self.root, self.dirty))
+
+
+class Runner:
+    """记录提交的运行，运行状态由测试设置"""
+
+    def __init__(self):
+        self.runs = []
+
+    def submit(self, task_name, trigger=None, paths=None):
+        run = SimpleNamespace(paths=paths, done=threading.Event(), cancelled=threading.Event(),
+                              success=False)
+        self.runs.append(run)
+        return run
+
+
+class WatchRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = Runner()
+        self.service = WatchService(self.runner)
+        self.watch = _TaskWatch('task', {'source_path': '/data', 'retry_interval': 10,
+                                         'watch_debounce_seconds': 0})
+        self.watch.last_full_scan = time.time()
+        self.watch.dirty.add('/data/a.txt')
+        self.service._check(self.watch)
+        self.assertEqual(len(self.runner.runs), 1)
+
+    def finish(self, success=False, cancelled=False):
+        run = self.runner.runs[-1]
+        run.success = success
+        if cancelled:
+            run.cancelled.set()
+        run.done.set()
+        self.service._check(self.watch)
+
+    def test_failed_run_backs_off(self):
+        self.finish()
+        self.assertEqual(len(self.runner.runs), 1)
+        self.assertAlmostEqual(self.watch.retry_at - time.time(), 10, delta=1)
+        self.watch.retry_at = 0
+        self.service._check(self.watch)
+        self.assertEqual(self.runner.runs[-1].paths, {'/data/a.txt'})
+        # 再次失败时等待时间加倍
+        self.finish()
+        self.assertAlmostEqual(self.watch.retry_at - time.time(), 20, delta=1)
+
+    def test_success_resets_backoff(self):
+        self.finish()
+        self.watch.retry_at = 0
+        self.service._check(self.watch)
+        self.finish(success=True)
+        self.assertEqual(self.watch.failures, 0)
+
+    def test_cancelled_run_not_restored(self):
+        self.finish(cancelled=True)
+        self.assertEqual(len(self.runner.runs), 1)
+        self.assertIsNone(self.watch.dirty.take(0, 0))
+        self.assertEqual(self.watch.retry_at, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()